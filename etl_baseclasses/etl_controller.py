@@ -139,4 +139,38 @@ class BatchLoadController(ETLController):
                     break
                 
         for etl_data in etl_data_to_process:
-            etl_functions_dict['load'](etl_data)
\ No newline at end of file
+            etl_functions_dict['load'](etl_data)
+
+
+class ParallelTransformController(ETLController):
+    
+    """
+        A ParallelTransformController passes the ETLData to the ETLDelegate's batch_transform function as a generator that extracts each ETLData
+        as it is requested, so the Transformer can transform them in parallel (ex: a backfill after an outage) while the next ETLData are extracted.
+        The ETLData are sorted by the 'load_order_key' function (by default the ETLData name) before they are extracted, the single loader loads 
+        each ETLData as soon as it is transformed, in that order.
+    """
+    
+    def __init__(self,  etl_project_basepath, etl_project_name, etl_controller_config):
+        ETLController.__init__(self, etl_project_basepath, etl_project_name, etl_controller_config)
+        
+        self.load_order_key = etl_controller_config.get('load_order_key', lambda etl_data:etl_data.getETLDataName())
+        
+    def processETLData(self, etl_data_to_process, etl_functions_dict):
+        
+        # the load order key only depends on properties set before the extract, so the ETLData are sorted before they are extracted
+        sorted_etl_data = sorted(etl_data_to_process, key=self.load_order_key)
+        
+        number_of_etl_data_loaded = 0
+        for etl_data in etl_functions_dict['batch_transform'](self._extractETLData(sorted_etl_data, etl_functions_dict['extract'])):
+            etl_functions_dict['load'](etl_data)
+            number_of_etl_data_loaded +=1
+            self.debug_logger("number_of_etl_data_loaded: ", number_of_etl_data_loaded, "of", len(sorted_etl_data))
+            
+    def _extractETLData(self, etl_data_to_process, extract):
+        
+        # yields each ETLData that is extracted without errors, ETLData are only extracted when the batch transform asks for the next one
+        for etl_data in etl_data_to_process:
+            self._setETLDataProperties(etl_data)
+            if extract(etl_data) != None:
+                yield etl_data
@@ -25,8 +25,14 @@ class Transformer(object):
     """
         A Transformer is responsible for conforming the data into a pre-defined standard format, 
         or type that meets the technical and business requirements for an ETL data source.
+        
+        batchTransform is optional, it transforms a list of ETLData (ex: in parallel) and yields each one in the given order once it is transformed.
     """
     def transform(self, etl_data): pass
+    def batchTransform(self, etl_data_list):
+        for etl_data in etl_data_list:
+            self.transform(etl_data)
+            yield etl_data
 
 
 class Loader(object):
@@ -24,6 +24,8 @@ class ETLData(object):
         self.meta_data_to_transform = ""
         self.meta_data_to_load = {}
         
+        self.raster_statistics = None # optional list of the raster's RasterStatistics per band, computed at transform time
+        
         self.extract_dir = ""
         self.transform_dir = ""
         self.load_dir = ""
@@ -73,6 +75,12 @@ class ETLData(object):
     
     def getMetaDataToLoad(self):
         return self.meta_data_to_load
+    
+    def setRasterStatistics(self, raster_statistics):
+        self.raster_statistics = raster_statistics
+    
+    def getRasterStatistics(self):
+        return self.raster_statistics
           
     def setExtractDir(self, extract_dir):
         self.extract_dir = extract_dir
@@ -73,7 +73,7 @@ class ETLDelegate(object):
     def _manageETLProcess(self):
         
         etl_data_to_process = self._getETLDataToProcess()
-        etl_functions_dict = {'extract':self.extract,'transform':self.transform,'load':self.load}
+        etl_functions_dict = {'extract':self.extract,'transform':self.transform,'load':self.load,'batch_transform':self.batchTransform}
         self._processETLData(etl_data_to_process, etl_functions_dict)
     
     def _getETLDataToProcess(self):
@@ -119,6 +119,21 @@ class ETLDelegate(object):
         self._execute(self.transformer.transform, etl_data, "TRANSFORM")
         return None if self._ETLDataIsFlagged(etl_data) else etl_data
                  
+    def batchTransform(self, etl_data_list):
+        
+        self.debug_logger("-------------------- BATCH TRANSFORM --------------------")
+        
+        # transformers that do not implement batchTransform transform each ETLData in turn
+        if not hasattr(self.transformer, 'batchTransform'):
+            for etl_data in etl_data_list:
+                if self.transform(etl_data) is not None:
+                    yield etl_data
+            return
+        
+        for etl_data in self.transformer.batchTransform(etl_data_list):
+            if not self._ETLDataIsFlagged(etl_data):
+                yield etl_data
+                 
     def load(self, etl_data):
         
         self._execute(self.loader.load, etl_data, "LOAD")
@@ -152,7 +167,7 @@ class FTPETLDelegate(ETLDelegate):
     
     def _manageETLProcess(self):
                                 
-        etl_functions_dict = {'extract':self.extract,'transform':self.transform,'load':self.load}
+        etl_functions_dict = {'extract':self.extract,'transform':self.transform,'load':self.load,'batch_transform':self.batchTransform}
         
         for ftp_directory in self.etl_config['ftp_dirs']:
             self.debug_logger("processing FTP directory",ftp_directory)
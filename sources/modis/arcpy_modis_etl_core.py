@@ -10,6 +10,7 @@ import arcpy
 
 # ETL utils
 from etl_utils import URLDownloadManager
+from arcpy_utils import ArcRasterStatisticsUtils
 
 
 class MODISExtractValidator(object):
@@ -34,7 +35,11 @@ class MODISExtractValidator(object):
         
     def validateExtract(self, all_modis_rasters_list):
         
-        current_modis_rasters = self.raster_catalog.getValuesFromDatetimeRange(self.raster_name_field, self.start_datetime, self.end_datetime)
+        # only the part of the raster catalog covered by the oldest candidate image needs to be retrieved
+        end_datetime = self._getOldestImageDatetime(all_modis_rasters_list)
+        self.debug_logger("end_datetime", end_datetime)
+        
+        current_modis_rasters = self.raster_catalog.getValuesFromDatetimeRange(self.raster_name_field, self.start_datetime, end_datetime)
         self.debug_logger("len(current_modis_rasters)", len(current_modis_rasters))
         
         missing_modis_rasters = list(set(all_modis_rasters_list) - set(current_modis_rasters))        
@@ -43,6 +48,59 @@ class MODISExtractValidator(object):
         missing_modis_rasters.sort(key=lambda x:x,reverse=True) # re-sort and reverse since the both lists were cast as sets
         
         return missing_modis_rasters
+    
+    def _getOldestImageDatetime(self, all_modis_rasters_list):
+        
+        # Bhutan.2012345.terra.ndvi.2km.tif --> 2012-DEC-10
+        if not all_modis_rasters_list:
+            return self.end_datetime
+        
+        oldest_julian_day = min(r.split(".")[1] for r in all_modis_rasters_list)
+        
+        return max(datetime.strptime(oldest_julian_day, '%Y%j'), self.end_datetime)
+
+
+class MODISExtractPlanner(object):
+    
+    """
+        Class MODISExtractPlanner determines which days to request for each MODIS image combination (subset, satellite, subtype, size) 
+        so that a MODISExtractor does not create candidates for the full archive range on every run.
+        
+        The high-level steps to accomplish this task include:
+        
+            1) retrieve the latest day (high-water mark) in the raster catalog for the given image combination
+            2) return the days after the high-water mark plus the gap-fill lookback days before it
+            3) return every day within the datetime range if the image combination is not in the raster catalog yet
+    """
+    
+    def __init__(self, planner_config):
+        
+        self.raster_catalog = planner_config['raster_catalog']
+        self.raster_name_field = planner_config['raster_name_field']
+        self.datetime_field = planner_config.get('datetime_field', self.raster_catalog.options['datetime_field'])
+        self.gap_fill_days = planner_config.get('gap_fill_days', 3) # days before the high-water mark to request again to fill any gaps
+        self.debug_logger = planner_config.get('debug_logger',lambda*a,**kwa:None)
+        
+    def getJulianDayList(self, image_name_pattern, start_datetime, end_datetime):
+        
+        high_water_mark = self._getHighWaterMark(image_name_pattern)
+        self.debug_logger("high_water_mark", image_name_pattern, high_water_mark)
+        
+        number_of_days = int((start_datetime - end_datetime).days)
+        if high_water_mark:
+            days_after_high_water_mark = (start_datetime.date() - high_water_mark.date()).days
+            number_of_days = max(0, min(number_of_days, days_after_high_water_mark + self.gap_fill_days))
+        
+        # create a list of year and day of the year items ex: ["2012345","2012346", "2012347"] 
+        return [(start_datetime - timedelta(days=day)).strftime('%Y%j') for day in range(number_of_days)]
+        
+    def _getHighWaterMark(self, image_name_pattern):
+        
+        # image_name_pattern is a SQL LIKE pattern for a single image combination ex: "Bhutan.%.terra.ndvi.2km.tif"
+        where_clause = "%s LIKE \'%s\'" % (self.raster_name_field, image_name_pattern)
+        high_water_mark = self.raster_catalog.getMaxValueFromField(self.datetime_field, where_clause)
+        
+        return high_water_mark if isinstance(high_water_mark, datetime) else None
 
 
 class MODISExtractor(URLDownloadManager):
@@ -51,11 +109,11 @@ class MODISExtractor(URLDownloadManager):
         Class MODISExtractor:
         
             1) retrieves a list of image names given the URL component combonation. (This is sent to a MODISExtractValidator)
-            2) downloads both the MODIS image and meta-data from the given URLs
+            2) downloads both the MODIS image and meta-data from the given URLs (concurrently, over pooled keep-alive connections)
     """
     
     def __init__(self, extractor_config):
-        URLDownloadManager.__init__(self)
+        URLDownloadManager.__init__(self, extractor_config.get('url_download_options', None))
                 
         self.extn = extractor_config['extn']
         self.subsets = extractor_config['subset']
@@ -66,10 +124,14 @@ class MODISExtractor(URLDownloadManager):
         self.text_content_types = extractor_config['text_content_types']
         self.start_datetime = extractor_config['start_datetime']
         self.end_datetime = extractor_config['end_datetime']
+        self.extract_planner = extractor_config.get('extract_planner', None) # optional MODISExtractPlanner
         self.debug_logger = extractor_config.get('debug_logger',lambda*a,**kwa:None)
         
     def getDataToExtract(self):
         
+        if self.extract_planner:
+            return self._buildPlannedImageNameList()
+        
         correct_julian_day_year_list = self._getJulianDayListFromDateRange(self.start_datetime, self.end_datetime)
         modis_image_names_for_julian_days =  self._buildImageNameList(correct_julian_day_year_list)
         
@@ -92,6 +154,25 @@ class MODISExtractor(URLDownloadManager):
         ]
                             
         return modis_image_name_list
+    
+    def _buildPlannedImageNameList(self):
+        
+        createImageName = lambda*r:".".join(r).replace("..",".") # replace '..' with '.'for MODIS True Color cases since subtype = ''
+        extn = self.extn
+        modis_image_name_list = []
+        
+        for subset in self.subsets:
+            for satellite in self.satellites:
+                for subtype in self.subtypes:
+                    for size in self.sizes:
+                        
+                        image_name_pattern = createImageName(subset, "%", satellite, subtype, size, extn)
+                        julian_day_year_list = self.extract_planner.getJulianDayList(image_name_pattern, self.start_datetime, self.end_datetime)
+                        modis_image_name_list.extend(createImageName(subset, year_and_julian_day, satellite, subtype, size, extn) for year_and_julian_day in julian_day_year_list)
+        
+        self.debug_logger("len(modis_image_name_list)", len(modis_image_name_list))
+        
+        return modis_image_name_list
 
     def _getJulianDayListFromDateRange(self, start_datetime, end_datetime):
                 
@@ -110,14 +191,16 @@ class MODISExtractor(URLDownloadManager):
             meta_data_url = modis_data.getMetaDataToExtract()
             self.debug_logger("meta_data_url",meta_data_url)
             
+            # the image and meta-data are requested concurrently, if either one is unavailable the other is not downloaded
             file_to_download = os.path.join(modis_data.getExtractDir(), modis_data.getETLDataName())
-            downloaded_image_path = self.downloadResultFromURL(modis_image_url, file_to_download, self.image_content_types)
+            downloaded_image_path, meta_data = self.getResultsFromURLs([
+                {'url':modis_image_url, 'content_types':self.image_content_types, 'downloaded_file_path':file_to_download},
+                {'url':meta_data_url, 'content_types':self.text_content_types} # returns a string of the meta-data
+            ])
             self.debug_logger("downloaded_image_path", downloaded_image_path)
             
-            meta_data = self.getResultFromURL(meta_data_url, self.text_content_types) # returns a string of the meta-data
-            
-            # if a MODIS image is available
-            if(downloaded_image_path):
+            # if both the MODIS image and its meta-data are available
+            if(downloaded_image_path and meta_data):
                 
                 modis_data.setDataToLoad(downloaded_image_path)
                 modis_data.setMetaDataToTransform(meta_data)
@@ -138,6 +221,12 @@ class MODISMetaDataTransformer(object):
         
             1)    converts the MODIS images meta-data string into a dictionary
             2)    adds additional custom field values to the dictionary (values to fields not asscociated with the MODIS image meta-data)
+            3)    optionally computes the RasterStatistics of every band of the MODIS image for the MODISLoader ('raster_statistics_config')
+            
+        raster_statistics_config <dict>:
+        
+            'histogram_bins' <int>: optional, the number of histogram bins, default 256
+            'histogram_range' <tuple>: optional, the (min, max) range of the histogram bins, default the band's minimum and maximum
     """
     
     def __init__(self,meta_data_transformer_config=None):
@@ -145,7 +234,10 @@ class MODISMetaDataTransformer(object):
         if not meta_data_transformer_config:
             meta_data_transformer_config = {}
         
+        self.raster_statistics_config = meta_data_transformer_config.get('raster_statistics_config', None)
         self.debug_logger = meta_data_transformer_config.get('debug_logger',lambda*a,**kwa:None)
+        
+        self.raster_statistics_utils = ArcRasterStatisticsUtils()
     
     def transform(self, modis_data):
         
@@ -160,11 +252,22 @@ class MODISMetaDataTransformer(object):
 
             modis_data.setMetaDataToLoad(meta_data_dict)
             
+            if self.raster_statistics_config:
+                self._setRasterStatistics(modis_data)
+            
         except Exception as e:
             
             self.debug_logger("transformMetaData Exception:",str(e),str(arcpy.GetMessages(2)))
             modis_data.handleException(exception=("transformMetaData:",str(e)),messages=arcpy.GetMessages(2))
         
+    def _setRasterStatistics(self, modis_data):
+        
+        # the image is streamed from its URL straight to disk as a (compressed) GeoTIFF, no decoded pixels exist before this read
+        modis_image = modis_data.getDataToLoad()
+        band_statistics = self.raster_statistics_utils.getBandStatistics(modis_image, self.raster_statistics_config)
+        modis_data.setRasterStatistics(band_statistics)
+        self.debug_logger("band statistics", modis_image, len(band_statistics))
+        
     def _createMetaDataList(self, meta_data_string):
         
         # the first part of the meta-data is easily split by a new line character, 
@@ -197,6 +300,9 @@ class MODISLoader(object):
         
             1)    inserts the given MODIS image into the given raster catalog
             2)    updates the fields asscoiated with the inserted image in the raster catalog
+            
+        If the MODISMetaDataTransformer computed the image's RasterStatistics, the image is copied without calculating its statistics, they are set 
+        on the catalog's copy of the image instead and the statistics of its first band are written into the stats_ fields of the raster catalog.
     """
     
     def __init__(self, loader_config):
@@ -204,31 +310,52 @@ class MODISLoader(object):
         self.raster_catalog = loader_config['raster_catalog']
         self.copy_raster_config = loader_config.get('CopyRaster_management_config',{})
         self.debug_logger = loader_config.get('debug_logger',lambda*a,**kwa:None)
+        
+        self.raster_statistics_utils = ArcRasterStatisticsUtils()
     
     def load(self, modis_data):
         
         try:
             modis_image = modis_data.getDataToLoad()
+            meta_data = modis_data.getMetaDataToLoad()
+            band_statistics = modis_data.getRasterStatistics()
+            
+            self._copyRaster(modis_image, calculate_statistics=not band_statistics)
+            raster_name = str(os.path.basename(modis_image))
             
-            self._copyRaster(modis_image)
-            self.raster_catalog.updateFieldsForInput(str(os.path.basename(modis_image)), modis_data.getMetaDataToLoad())
+            if band_statistics:
+                
+                # the statistics are set on the catalog's copy of the image, the copy is what ArcGIS draws
+                self.raster_statistics_utils.setRasterStatistics(self.raster_catalog.getRasterFullpath(raster_name), band_statistics)
+                meta_data.update(band_statistics[0].getFieldValues())
+            
+            self.raster_catalog.updateFieldsForInput(raster_name, meta_data)
             
         except Exception as e:
             
             self.debug_logger("load Exception:",str(e),str(arcpy.GetMessages(2)))
             modis_data.handleException(exception=("load:",str(e)),messages=arcpy.GetMessages(2))
     
-    def _copyRaster(self, modis_image):
-        
-        crc = self.copy_raster_config
-        copy_result = arcpy.CopyRaster_management(
-            modis_image, 
-            self.raster_catalog.fullpath, 
-            crc.get('config_keyword',''), 
-            crc.get('background_value',''), 
-            crc.get('nodata_value',''), 
-            crc.get('onebit_to_eightbit',''), 
-            crc.get('colormap_to_RGB',''), 
-            crc.get('pixel_type','')
-        )
-        self.debug_logger("CopyRaster_management result status",copy_result.status)
\ No newline at end of file
+    def _copyRaster(self, modis_image, calculate_statistics=True):
+        
+        # the statistics computed at transform time are set on the catalog's copy of the image after the copy
+        raster_statistics_environment = arcpy.env.rasterStatistics
+        if not calculate_statistics:
+            arcpy.env.rasterStatistics = "NONE"
+        
+        try:
+            crc = self.copy_raster_config
+            copy_result = arcpy.CopyRaster_management(
+                modis_image, 
+                self.raster_catalog.fullpath, 
+                crc.get('config_keyword',''), 
+                crc.get('background_value',''), 
+                crc.get('nodata_value',''), 
+                crc.get('onebit_to_eightbit',''), 
+                crc.get('colormap_to_RGB',''), 
+                crc.get('pixel_type','')
+            )
+            self.debug_logger("CopyRaster_management result status",copy_result.status)
+            
+        finally:
+            arcpy.env.rasterStatistics = raster_statistics_environment
\ No newline at end of file
@@ -16,11 +16,11 @@ sys.path.append("PATH ON DISK TO BASE ETL MODULES \\ReferenceNode\\ETL\\ETLScrip
 # ETL framework 
 from etl_controller import ETLController
 from modis_etl_delegate import MODISETLDelegate
-from arcpy_modis_etl_core import MODISLoader, MODISExtractor, MODISMetaDataTransformer, MODISExtractValidator
+from arcpy_modis_etl_core import MODISLoader, MODISExtractor, MODISMetaDataTransformer, MODISExtractValidator, MODISExtractPlanner
 
 # ETL utils
 from etl_utils import ETLDebugLogger, ETLExceptionManager
-from arcpy_utils import RasterCatalog, FileGeoDatabase, AGServiceManager
+from arcpy_utils import RasterCatalog, FileGeoDatabase, AGServiceManager, ArcRasterStatisticsUtils
 
 
 # --------------- ETL ---------------------------------------------------------------------------------------------------
@@ -60,6 +60,10 @@ def createRasterCatalog(output_basepath, raster_catalog_name):
 #    arcpy.AddField_management(raster_catalog.fullpath, 'ellipsoid', 'TEXT', '', '', 10)
 #    arcpy.AddField_management(raster_catalog.fullpath, 'L2_granules', 'TEXT', '', '', 500)
     
+    # raster statistics fields, written when the MODISMetaDataTransformer has a raster_statistics_config. Unlike the fields above they are 
+    # added to an existing raster catalog as well, since the raster_statistics_config is on by default -------------------------------------
+    ArcRasterStatisticsUtils().addStatisticsFields(raster_catalog.fullpath)
+    
     return raster_catalog
 
 
@@ -92,6 +96,14 @@ def executeETL(raster_catalog):
         'debug_logger':update_debug_log
     })
     
+    modis_extract_planner = MODISExtractPlanner({
+                                                 
+        "raster_catalog":raster_catalog,
+        "raster_name_field":"Name",
+        "gap_fill_days":3, # days before the latest image in the raster catalog to request again
+        'debug_logger':update_debug_log
+    })
+    
     modis_extractor = MODISExtractor({
                                       
         "image_content_types":['image/tiff'], # checks the header content type for this value before downloading the images
@@ -103,11 +115,16 @@ def executeETL(raster_catalog):
         "subtype":[''], # ('' == MODIS True Color) list only has one item since it is the category of the raster catalog the ETL is updating
         "start_datetime":start_datetime,
         "end_datetime":end_datetime,
+        "extract_planner":modis_extract_planner,
         'debug_logger':update_debug_log
     })
     
     modis_meta_data_transformer = MODISMetaDataTransformer({
                                                             
+        "raster_statistics_config":{ # optional, comment out/delete entire key to let ArcGIS calculate the statistics, requires the stats_ fields in the raster catalog
+            'histogram_bins':256,
+            'histogram_range':(0, 256) # one bin per 8-bit value
+        },
         'debug_logger':update_debug_log
     })
         
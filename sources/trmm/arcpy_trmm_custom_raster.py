@@ -3,13 +3,82 @@
 
 # standard library
 import os
-import sys
 from datetime import datetime, timedelta
 
 # third-party
 from arcpy.sa import *
+import numpy as np
 import arcpy
 
+# ETL utils
+from color_map_utils import ColorMap, PNGWriter
+
+# TRMM numpy utils
+from trmm_accumulations import TRMMRollingAccumulator, TRMMDailyAccumulator, TRMMWindowAccumulator
+from trmm_grid_utils import TRMMGridUtils
+from trmm_time_cube import TRMMTimeCube
+from trmm_sparse_grid import TRMMSparseGrid
+
+
+class TRMMWorkspaceRasterIndex(object):
+    
+    """
+        Class TRMMWorkspaceRasterIndex keeps the names of the rasters extracted into a workspace in an index file, so the rasters that 
+        still need to be extracted are found with set arithmetic instead of an arcpy.Exists call per raster. Names are compared in lower case.
+        
+        If the index file does not exist (ex: the first run after an upgrade) it is rebuilt from arcpy.ListRasters in the workspace,
+        rasters deleted from the workspace outside of the TRMMCustomRasterCreator require the index file to be deleted as well.
+        
+        public interface:
+        
+            getRasterNames() <set>: returns the lower case names of the rasters in the workspace
+            addRasterNames(raster_names): adds the given names to the index file
+            removeRasterNames(raster_names): removes the given names from the index file
+    """
+    
+    INDEX_FILE_NAME = "extracted_rasters.idx"
+    
+    def __init__(self, workspace_fullpath):
+        
+        self.workspace_fullpath = workspace_fullpath
+        self.index_fullpath = os.path.join(workspace_fullpath, self.INDEX_FILE_NAME)
+        
+    def getRasterNames(self):
+        
+        if not os.path.isfile(self.index_fullpath):
+            self._saveRasterNames(self._listWorkspaceRasters())
+            
+        with open(self.index_fullpath, "r") as index_file:
+            return set(line.strip() for line in index_file if line.strip())
+        
+    def addRasterNames(self, raster_names):
+        
+        self._saveRasterNames(self.getRasterNames() | set(str(r).lower() for r in raster_names))
+        
+    def removeRasterNames(self, raster_names):
+        
+        self._saveRasterNames(self.getRasterNames() - set(str(r).lower() for r in raster_names))
+        
+    def _listWorkspaceRasters(self):
+        
+        previous_workspace = arcpy.env.workspace
+        try:
+            arcpy.env.workspace = self.workspace_fullpath
+            return set(str(r).lower() for r in (arcpy.ListRasters("*") or []))
+        finally:
+            arcpy.env.workspace = previous_workspace
+        
+    def _saveRasterNames(self, raster_names):
+        
+        # write to a temp file first so an interrupted run never leaves a partially written index behind
+        temp_index_fullpath = self.index_fullpath + ".tmp"
+        with open(temp_index_fullpath, "w") as index_file:
+            index_file.write("\n".join(sorted(raster_names)))
+            
+        if os.path.isfile(self.index_fullpath):
+            os.remove(self.index_fullpath)
+        os.rename(temp_index_fullpath, self.index_fullpath)
+
 
 class TRMMCustomRasterRequest:
     
@@ -20,10 +89,16 @@ class TRMMCustomRasterRequest:
             factory_specifications <dict>: options for the output raster
                          
                 'output_raster_fullpath' <str>: the fullpath and name of the output raster
-                'clip_extent' <str>: the processing extent contained within "-180.0 -50.0 180.0 50.0" and given in the same format "xMin yMin xMax yMax"
-                'clip_raster' <arcpy.Raster>: the fullpath to a raster to be used in clipping the TRMM output raster using arcpy.Clip_management
+                'clip_extent' <str>: the processing extent contained within "-180.0 -50.0 180.0 50.0" and given in the same format "xMin yMin xMax yMax",
+                the composite is clipped to the rows and columns of the cells that intersect the extent
+                'clip_raster' <arcpy.Raster>: the fullpath to a raster on the 0.25 degree TRMM grid, the cells that are NoData or 0 in it are NoData in the TRMM output raster
                 'CopyRaster_management_config' <dict>: config for arcpy.CopyRaster_Management
-                'AddColormap_management_config' <dict>: config for arcpy.AddColormap_management
+                'AddColormap_management_config' <dict>: config for arcpy.AddColormap_management, not used with a color_map_renderer_config
+                'color_map_renderer_config' <dict>: optional, renders the composite with a .clr color map into a PNG quick-look, the parsed color map is also 
+                written as a .clr sidecar of the workspace raster so it is copied to the output raster without AddColormap_management
+                
+                    'input_CLR_file' <str>: the .clr color map, parsed once per run by ColorMap
+                    'quick_look_fullpath' <str>: the fullpath of the output .png, outside of any geodatabase
                 
             input_raster_catalog_options <dict>: options for the input raster catalog
             
@@ -50,12 +125,42 @@ class TRMMCustomRasterRequest:
     def getRasterCatalogFullpath(self):
         
         return self.input_raster_catalog_options['raster_catalog_fullpath']
+    
+    def getStartDatetime(self):
+        
+        return self.input_raster_catalog_options['start_datetime']
+    
+    def getEndDatetime(self):
+        
+        return self.input_raster_catalog_options['end_datetime']
+    
+    def getRasterCatalogQueryKey(self):
+        
+        # requests with the same key query the same rasters and only differ by their datetime range
+        ico = self.input_raster_catalog_options
+        return (ico['raster_catalog_fullpath'], ico['raster_name_field'], ico['datetime_field'], ico.get('additional_where_clause',""))
+    
+    def getRasterNamesAndDatetimes(self, start_datetime, end_datetime):
+        
+        # returns a list of (raster name, datetime) for the given datetime range instead of the request's own range
+        raster_name_field = self.input_raster_catalog_options['raster_name_field']
+        datetime_field = self.input_raster_catalog_options['datetime_field']
+        where_clause = self._createWhereClause(start_datetime, end_datetime)
+        where_clause += self.input_raster_catalog_options.get('additional_where_clause',"")
+
+        rows = arcpy.SearchCursor(self.input_raster_catalog_options['raster_catalog_fullpath'], where_clause, "", "%s; %s" % (raster_name_field, datetime_field))
+        try:
+            return [(str(row.getValue(raster_name_field)), row.getValue(datetime_field)) for row in rows]
+        finally:
+            del rows
         
-    def extractRastersToWorkspace(self, path_to_extract_into):
+    def extractRastersToWorkspace(self, path_to_extract_into, rasters_to_extract_list=None):
         
         try:
         
-            rasters_to_extract_list = self._getListOfRasterNamesFromRasterCatalog()
+            if rasters_to_extract_list is None:
+                rasters_to_extract_list = self._getListOfRasterNamesFromRasterCatalog()
+                
             extracted_rasters_list = self._extractRastersFromRasterCatalog(rasters_to_extract_list, path_to_extract_into)
     
             return extracted_rasters_list
@@ -80,10 +185,10 @@ class TRMMCustomRasterRequest:
         finally:
             del rows
             
-    def _createWhereClause(self):
+    def _createWhereClause(self, start_datetime=None, end_datetime=None):
         
-        start_datetime = self.input_raster_catalog_options['start_datetime']
-        end_datetime = self.input_raster_catalog_options['end_datetime']
+        start_datetime = start_datetime or self.input_raster_catalog_options['start_datetime']
+        end_datetime = end_datetime or self.input_raster_catalog_options['end_datetime']
         datetime_field = self.input_raster_catalog_options['datetime_field']
         datetime_field_format = self.input_raster_catalog_options['datetime_field_format']
         datetime_sql_cast = self.input_raster_catalog_options['datetime_sql_cast']
@@ -96,31 +201,46 @@ class TRMMCustomRasterRequest:
             
     def _extractRastersFromRasterCatalog(self, rasters_to_extract_list, path_to_extract_into):
 
-        extracted_raster_list = []
-        joinPath = os.path.join
         raster_name_field = self.input_raster_catalog_options['raster_name_field']
         output_raster_catalog = self.input_raster_catalog_options['raster_catalog_fullpath']
         
+        # keep the order of the given rasters and drop duplicates
+        unique_rasters_list = []
+        unique_raster_names = set()
         for raster_name in rasters_to_extract_list:
-            
-            extracted_raster_fullpath = joinPath(path_to_extract_into, raster_name)
-            self.debug_logger("processing raster...",raster_name)
-            
-            if arcpy.Exists(extracted_raster_fullpath) and (raster_name not in extracted_raster_list):
-                extracted_raster_list.append(raster_name)
-                       
-            else:
+            if raster_name.lower() not in unique_raster_names:
+                unique_raster_names.add(raster_name.lower())
+                unique_rasters_list.append(raster_name)
+        
+        workspace_raster_index = TRMMWorkspaceRasterIndex(path_to_extract_into)
+        missing_raster_names = unique_raster_names - workspace_raster_index.getRasterNames()
+        missing_rasters_list = [r for r in unique_rasters_list if r.lower() in missing_raster_names]
+        self.debug_logger("rasters to extract", len(missing_rasters_list), "already in the workspace", len(unique_rasters_list) - len(missing_rasters_list))
+        
+        # RasterCatalogToRasterDataset mosaics every selected raster into a single dataset, so each raster is still extracted with its own call
+        extracted_rasters_list = []
+        try:
+            for raster_name in missing_rasters_list:
+                
+                self.debug_logger("extracting raster...",raster_name)
                 where_clause = "%s = \'%s\'" % (raster_name_field, str(raster_name))
-                arcpy.RasterCatalogToRasterDataset_management(output_raster_catalog, raster_name, where_clause)
-                extracted_raster_list.append(raster_name)
+                arcpy.RasterCatalogToRasterDataset_management(output_raster_catalog, os.path.join(path_to_extract_into, raster_name), where_clause)
+                extracted_rasters_list.append(raster_name)
                 
-        return extracted_raster_list
+        finally:
+            if extracted_rasters_list:
+                workspace_raster_index.addRasterNames(extracted_rasters_list)
+                
+        return unique_rasters_list
 
 
 class TRMMCustomRasterCreator:
     
     """creates a custom raster from a given TRMMCustomRasterRequest object.
     
+        Requests that query the same raster catalog (ex: the nested 1, 7 and 30-day composites) are merged into one plan: 
+        the union of their rasters is extracted once and every window is summed in a single time-ordered pass (see TRMMWindowAccumulator).
+    
         raster_creator_options <dict>: config options for the TRMM raster creator.
     
             'workspace_fullpath' <str>: output workspace location for the raster creation process                                             
@@ -132,16 +252,47 @@ class TRMMCustomRasterCreator:
                 'local_raster_archive_days' <int>: rasters outside this number will be deleted ex: 90
                 'raster_name_datetime_format' <str>: to determine if a raster is outside the archive days, 
                  each name must be in an easily convertable datetime string format. ex: "t_%Y%m%d%H"
+                 
+            'rolling_accumulator_options' <dict>: optional, keeps a running sum per output raster so each run only adds new and subtracts expired 3-hour rasters
+            
+                'state_directory' <str>: directory of the running sum state files (see TRMMRollingAccumulator)
+                'verify_running_sums' <bool>: rebuilds each running sum after it is updated and logs whether they match, a mismatch keeps the rebuilt sum
+                
+            'time_cube_options' <dict>: optional, reads the 3-hour grids from a TRMMTimeCube instead of extracting them from the raster catalog
+            
+                'cube_directory' <str>: directory of the time cube written by the TRMMLoader
+                'precip_min' <float>: cells below this value are not added to the sums, same as the TRMMTransformer's precip_min
+                
+            'sparse_grid_options' <dict>: optional, reads the 3-hour grids from the TRMMSparseGrid files written by the TRMMTransformer instead of extracting 
+            them from the raster catalog. The archive_options also apply to the sparse grids, which replace the extracted rasters as the local archive.
+            
+                'sparse_grid_directory' <str>: the TRMMTransformer's sparse_grid_directory
+                
+            'daily_accumulator_options' <dict>: optional, sums each window from the TRMMDailyAccumulator's daily partials of the days whose grids are all in the window, 
+            only the 3-hour grids of the remaining days (the window's edges and days with an incomplete partial) are read. Takes precedence over the rolling_accumulator_options.
+            
+                'state_directory' <str>: the state_directory of the TRMMLoader's daily_accumulator
+                'truncate_grids' <bool>: optional, the truncate_grids of the TRMMLoader's daily_accumulator, the edge grids are truncated the same way, default False
     
             'debug_logger' <object.method>: method that will be passes variable string arguments to display current progress and values
             'exception_handler' <object.method>: method that will be variable string arguments with exception information
     """
 
+    # the grid every extracted raster is read into, same as the arcpy.env.extent of the map algebra composites
+    GRID_LOWER_LEFT_X, GRID_LOWER_LEFT_Y, GRID_COLS, GRID_ROWS, GRID_CELLSIZE = -180.0, -50.0, 1440, 400, 0.25
+    
+    # time cube grids are named by their datetime
+    TIME_CUBE_GRID_NAME_FORMAT = "cube_%Y%m%d%H"
+    
+    # the 50 N to 50 S rows of a grid in the bin layout (time cube and sparse grids) that are read into the grid above
+    BIN_LAYOUT_ROW_SLICE = slice(40, 440)
+
     def __init__(self,  raster_creator_options):
         
         self.raster_creator_options = raster_creator_options
         self.workspace_fullpath = raster_creator_options['workspace_fullpath']
         self.custom_raster_requests = []
+        self.clip_raster_masks = {} # clip raster fullpath: boolean mask of the grid
         
         if not os.path.isdir(self.workspace_fullpath):
             os.mkdir(self.workspace_fullpath)
@@ -149,6 +300,41 @@ class TRMMCustomRasterCreator:
         self.debug_logger = raster_creator_options.get('debug_logger',lambda*a,**kwa:None)
         self.exception_handler = raster_creator_options.get('exception_handler',lambda*a,**kwa:None)
         
+        self.time_cube = None
+        self.grid_loader = self._loadGridFromWorkspace
+        time_cube_options = raster_creator_options.get('time_cube_options', None)
+        if time_cube_options:
+            
+            self.time_cube = TRMMTimeCube({'cube_directory':time_cube_options['cube_directory'], 'debug_logger':self.debug_logger})
+            self.grid_loader = self._loadGridFromTimeCube
+            
+        self.sparse_grid_directory = None
+        sparse_grid_options = raster_creator_options.get('sparse_grid_options', None)
+        if sparse_grid_options and not self.time_cube:
+            
+            self.sparse_grid_directory = sparse_grid_options['sparse_grid_directory']
+            self.grid_loader = self._loadGridFromSparseGrid
+        
+        self.daily_accumulator = None
+        daily_accumulator_options = raster_creator_options.get('daily_accumulator_options', None)
+        if daily_accumulator_options:
+            
+            self.daily_accumulator = TRMMDailyAccumulator({
+                'state_directory':daily_accumulator_options['state_directory'],
+                'truncate_grids':daily_accumulator_options.get('truncate_grids', False),
+                'debug_logger':self.debug_logger
+            })
+        
+        self.rolling_accumulator = None
+        rolling_accumulator_options = raster_creator_options.get('rolling_accumulator_options', None)
+        if rolling_accumulator_options:
+            
+            self.rolling_accumulator = TRMMRollingAccumulator({
+                'state_directory':rolling_accumulator_options['state_directory'],
+                'grid_loader':self.grid_loader,
+                'debug_logger':self.debug_logger
+            })
+        
     def addCustomRasterReuests(self, custom_raster_requests):
         
         self.custom_raster_requests = custom_raster_requests
@@ -162,20 +348,13 @@ class TRMMCustomRasterCreator:
             arcpy.env.overwriteOutput = True
             arcpy.CheckOutExtension("spatial")
 
-            for custom_raster in self.custom_raster_requests:
-                self.debug_logger("Processing Raster")
+            for custom_raster_requests in self._groupRequestsByRasterCatalogQuery():
                 
-                factory_specifications = custom_raster.getFactorySpecifications()
-                output_raster_fullpath = factory_specifications['output_raster_fullpath']
-                raster_catalog_is_not_locked = arcpy.TestSchemaLock(custom_raster.getRasterCatalogFullpath())
-                
-                extracted_raster_list = custom_raster.extractRastersToWorkspace(self.workspace_fullpath)
-                self.debug_logger("Len(extracted_raster_list)", len(extracted_raster_list))
-
-                if extracted_raster_list and raster_catalog_is_not_locked:
-
-                    final_raster = self._createCumulativeRaster(extracted_raster_list, factory_specifications)
-                    self._saveRaster(final_raster, output_raster_fullpath, factory_specifications)
+                # a single request is summed with map algebra, otherwise the union of the requests is extracted once and summed with numpy
+                if len(custom_raster_requests) == 1 and not (self.rolling_accumulator or self.daily_accumulator or self.time_cube or self.sparse_grid_directory or self._isClippedOrRendered(custom_raster_requests[0])):
+                    self._createCustomRaster(custom_raster_requests[0])
+                else:
+                    self._createCustomRastersFromSharedExtract(custom_raster_requests)
 
             self._finishCustomRasterManagment()
             self.debug_logger("Finished TRMM Custom Raster Creation Process")
@@ -190,33 +369,297 @@ class TRMMCustomRasterCreator:
             arcpy.CheckInExtension("spatial")
             self.debug_logger("checked IN spatial extension")
 
-    def _createCumulativeRaster(self, rasters_list, factory_specifications):
+    def _groupRequestsByRasterCatalogQuery(self):
+        
+        request_groups = {}
+        request_group_keys = [] # keep the groups in the order of their first request
+        for custom_raster in self.custom_raster_requests:
+            
+            request_group_key = custom_raster.getRasterCatalogQueryKey()
+            if request_group_key not in request_groups:
+                request_groups[request_group_key] = []
+                request_group_keys.append(request_group_key)
+            request_groups[request_group_key].append(custom_raster)
+            
+        return [request_groups[k] for k in request_group_keys]
+    
+    def _createCustomRaster(self, custom_raster):
+        self.debug_logger("Processing Raster")
+        
+        factory_specifications = custom_raster.getFactorySpecifications()
+        output_raster_fullpath = factory_specifications['output_raster_fullpath']
+        raster_catalog_is_not_locked = arcpy.TestSchemaLock(custom_raster.getRasterCatalogFullpath())
+        
+        extracted_raster_list = custom_raster.extractRastersToWorkspace(self.workspace_fullpath)
+        self.debug_logger("Len(extracted_raster_list)", len(extracted_raster_list))
+
+        if extracted_raster_list and raster_catalog_is_not_locked:
+
+            final_raster = self._createCumulativeRaster(extracted_raster_list)
+            self._saveRaster(final_raster, output_raster_fullpath, factory_specifications)
+            
+    def _createCustomRastersFromSharedExtract(self, custom_raster_requests):
+        self.debug_logger("Processing Rasters From A Shared Extract", len(custom_raster_requests))
+        
+        if self.time_cube:
+            rasters_with_datetimes = self._getTimeCubeGrids(custom_raster_requests)
+        elif self.sparse_grid_directory:
+            rasters_with_datetimes = self._getSparseGrids(custom_raster_requests)
+        else:
+            rasters_with_datetimes = self._getCatalogRasters(custom_raster_requests)
+            
+        if not rasters_with_datetimes:
+            return
+        
+        if self.daily_accumulator:
+            window_sums = self._sumWindowsFromDailyPartials(custom_raster_requests, rasters_with_datetimes)
+            
+        elif self.rolling_accumulator:
+            rasters_with_datetimes = self._extractSharedRasters(custom_raster_requests[0], rasters_with_datetimes)
+            window_sums = dict((self._getWindowName(r), self._getRunningSum(r, rasters_with_datetimes)) for r in custom_raster_requests)
+            
+        else:
+            rasters_with_datetimes = self._extractSharedRasters(custom_raster_requests[0], rasters_with_datetimes)
+            windows = [(self._getWindowName(r), r.getStartDatetime(), r.getEndDatetime()) for r in custom_raster_requests]
+            window_sums = TRMMWindowAccumulator.sumWindows(rasters_with_datetimes, windows, self.grid_loader)
+            
+        for custom_raster in custom_raster_requests:
+            
+            window_sum = window_sums[self._getWindowName(custom_raster)]
+            if window_sum is not None:
+                
+                factory_specifications = custom_raster.getFactorySpecifications()
+                
+                # multiply by 3 since each TRMM raster 3-hour period is an average not a sum
+                final_sum, lower_left_corner = self._clipCumulativeSum(window_sum * 3, factory_specifications)
+                final_raster = self._createCumulativeRasterFromSum(final_sum, lower_left_corner)
+                self._saveRaster(final_raster, factory_specifications['output_raster_fullpath'], factory_specifications)
+                
+                if factory_specifications.get('color_map_renderer_config', None):
+                    self._writeQuickLook(final_sum, factory_specifications['color_map_renderer_config'])
+
+    def _getCatalogRasters(self, custom_raster_requests):
+        
+        # the union of every request's rasters
+        return custom_raster_requests[0].getRasterNamesAndDatetimes(
+            max(r.getStartDatetime() for r in custom_raster_requests), 
+            min(r.getEndDatetime() for r in custom_raster_requests)
+        )
+    
+    def _extractSharedRasters(self, plan_request, rasters_with_datetimes):
+        
+        # only rasters read from the raster catalog are extracted, time cube and sparse grids are read directly
+        if self.time_cube or self.sparse_grid_directory or not rasters_with_datetimes:
+            return rasters_with_datetimes
+        
+        raster_catalog_is_not_locked = arcpy.TestSchemaLock(plan_request.getRasterCatalogFullpath())
+        extracted_raster_list = plan_request.extractRastersToWorkspace(self.workspace_fullpath, [name for name, dt in rasters_with_datetimes])
+        self.debug_logger("Len(extracted_raster_list)", len(extracted_raster_list or []))
+        
+        if not (extracted_raster_list and raster_catalog_is_not_locked):
+            return []
+        
+        extracted_rasters = set(extracted_raster_list)
+        return [(name, dt) for name, dt in rasters_with_datetimes if name in extracted_rasters]
+    
+    def _getSparseGrids(self, custom_raster_requests):
+        
+        rasters_with_datetimes = self._getCatalogRasters(custom_raster_requests)
+        sparse_grids_with_datetimes = [(name, dt) for name, dt in rasters_with_datetimes if os.path.isfile(self._getSparseGridFullpath(name))]
+        self.debug_logger("Len(sparse grids)", len(sparse_grids_with_datetimes), "missing", len(rasters_with_datetimes) - len(sparse_grids_with_datetimes))
+        
+        return sparse_grids_with_datetimes
+    
+    def _sumWindowsFromDailyPartials(self, custom_raster_requests, rasters_with_datetimes):
+        
+        # split each window into the days whose daily partial contains exactly the window's grids of that day and the grids of the other days
+        daily_partial_datetimes = {}
+        window_plans = []
+        for custom_raster in custom_raster_requests:
+            
+            start_datetime, end_datetime = custom_raster.getStartDatetime(), custom_raster.getEndDatetime()
+            rasters_by_day = {}
+            for raster_name, raster_datetime in rasters_with_datetimes:
+                if end_datetime <= raster_datetime <= start_datetime:
+                    rasters_by_day.setdefault(raster_datetime.date(), []).append((raster_name, raster_datetime))
+            
+            daily_partial_days, edge_rasters = [], []
+            for day, day_rasters in rasters_by_day.items():
+                
+                if day not in daily_partial_datetimes:
+                    daily_partial_datetimes[day] = self.daily_accumulator.getGridDatetimes(day)
+                
+                if daily_partial_datetimes[day] == set(raster_datetime for raster_name, raster_datetime in day_rasters):
+                    daily_partial_days.append(day)
+                else:
+                    edge_rasters.extend(day_rasters)
+                    
+            self.debug_logger(self._getWindowName(custom_raster), "daily partials:", len(daily_partial_days), "edge grids:", len(edge_rasters))
+            window_plans.append((self._getWindowName(custom_raster), daily_partial_days, edge_rasters))
+        
+        # only the edge grids of every window are extracted
+        all_edge_rasters = sorted(set(r for window_name, days, edge_rasters in window_plans for r in edge_rasters), key=lambda r: r[1])
+        loaded_edge_rasters = set(self._extractSharedRasters(custom_raster_requests[0], all_edge_rasters))
+        
+        window_sums = {}
+        for window_name, daily_partial_days, edge_rasters in window_plans:
+            
+            if not set(edge_rasters).issubset(loaded_edge_rasters):
+                self.debug_logger(window_name, "edge grids could not be extracted, skipping...")
+                window_sums[window_name] = None
+                continue
+            
+            grids = [self._toCompositeGrid(self.daily_accumulator.getDailyPartial(day)) for day in daily_partial_days]
+            
+            # the daily partials of truncated grids are only added to edge grids truncated the same way, the time cube and sparse grids are not truncated
+            grids += [TRMMGridUtils.toAccumulationGrid(self.grid_loader(raster_name), 0, self.daily_accumulator.truncate_grids) for raster_name, raster_datetime in edge_rasters]
+            window_sums[window_name] = sum(grids[1:], grids[0]) if grids else None
+            
+        return window_sums
+    
+    def _getSparseGridFullpath(self, raster_name):
+        
+        return os.path.join(self.sparse_grid_directory, raster_name + ".npz")
+    
+    def _getTimeCubeGrids(self, custom_raster_requests):
+        
+        grid_datetimes = self.time_cube.getDatetimes(
+            min(r.getEndDatetime() for r in custom_raster_requests), 
+            max(r.getStartDatetime() for r in custom_raster_requests)
+        )
+        self.debug_logger("Len(time cube grids)", len(grid_datetimes))
+        
+        return [(dt.strftime(self.TIME_CUBE_GRID_NAME_FORMAT), dt) for dt in grid_datetimes]
+        
+    def _createCumulativeRaster(self, rasters_list):
         
         self.debug_logger("Creating Cumulative Raster...")
         final_raster = sum([Con(IsNull(raster), 0, raster) for raster in rasters_list]) # for each raster in the list, set all NULL to 0 then SUM
         final_raster = Float(final_raster)
         final_raster = final_raster * 3 # multiply by 3 since each TRMM raster 3-hour period is an average not a sum
         
+        final_raster = SetNull(final_raster == 0, final_raster) # set 0's back to NULL after all mathematical operations are peformed
+        self.debug_logger("SetNull(final_raster == 0, final_raster)")
+        
+        return final_raster
+    
+    def _getWindowName(self, custom_raster):
+        
+        return os.path.basename(custom_raster.getFactorySpecifications()['output_raster_fullpath'])
+    
+    def _getRunningSum(self, custom_raster, rasters_with_datetimes):
+        
+        window_name = self._getWindowName(custom_raster)
+        start_datetime, end_datetime = custom_raster.getStartDatetime(), custom_raster.getEndDatetime()
+        rasters_list = [name for name, dt in rasters_with_datetimes if end_datetime <= dt <= start_datetime]
+        self.debug_logger("Updating Running Sum...", window_name)
+        
+        if not rasters_list:
+            return None
+        
+        running_sum = self.rolling_accumulator.updateWindow(window_name, rasters_list)
+        verify_running_sums = self.raster_creator_options['rolling_accumulator_options'].get('verify_running_sums', False)
+        if verify_running_sums and not self.rolling_accumulator.verifyWindow(window_name):
+            running_sum = self.rolling_accumulator.rebuildWindow(window_name, rasters_list)
+            
+        return running_sum
+    
+    def _createCumulativeRasterFromSum(self, final_sum, lower_left_corner):
+        
+        self.debug_logger("Creating Cumulative Raster From Sum...")
+        
+        # 0's are NULL, same as SetNull(final_raster == 0, final_raster)
+        return arcpy.NumPyArrayToRaster(final_sum.astype('float32'), arcpy.Point(*lower_left_corner), self.GRID_CELLSIZE, self.GRID_CELLSIZE, 0)
+    
+    def _clipCumulativeSum(self, final_sum, factory_specifications):
+        
+        # returns the clipped sum and its (lower_left_x, lower_left_y), clipping a regular grid needs no intermediate rasters
         if factory_specifications.get('clip_extent', None):
             
             self.debug_logger("Adding Clip Extent...")
-            output_clip_raster = os.path.join(os.path.join(sys.path[0], "scratch.gdb"),"temp_clip")
-            final_raster = arcpy.Clip_management(final_raster, factory_specifications['clip_extent'], output_clip_raster)
+            row_slice, col_slice, (lower_left_x, lower_left_y, cellsize) = TRMMGridUtils.getClipExtentSlices(
+                factory_specifications['clip_extent'].split(), 
+                (self.GRID_LOWER_LEFT_X, self.GRID_LOWER_LEFT_Y, self.GRID_CELLSIZE), 
+                (self.GRID_ROWS, self.GRID_COLS)
+            )
+            
+            return (final_sum[row_slice, col_slice], (lower_left_x, lower_left_y))
 
         elif factory_specifications.get('clip_raster', None):
             
             self.debug_logger("Adding Clip Raster...")
-            final_raster = final_raster * Raster(factory_specifications['clip_raster']) 
+            final_sum = final_sum * self._getClipRasterMask(factory_specifications['clip_raster'])
+            
+        return (final_sum, (self.GRID_LOWER_LEFT_X, self.GRID_LOWER_LEFT_Y))
+    
+    def _getClipRasterMask(self, clip_raster):
         
-        final_raster = SetNull(final_raster == 0, final_raster) # set 0's back to NULL after all mathematical operations are peformed
-        self.debug_logger("SetNull(final_raster == 0, final_raster)")
+        # the mask of each clip raster is read once per run and shared by the requests that use it
+        if clip_raster not in self.clip_raster_masks:
+            
+            cell_width = arcpy.Describe(clip_raster).meanCellWidth
+            if abs(cell_width - self.GRID_CELLSIZE) > 1e-9:
+                raise ValueError("clip_raster %s has a cellsize of %s instead of %s" % (clip_raster, cell_width, self.GRID_CELLSIZE))
+            
+            # NoData is read as 0, so the cells outside of the clip raster are 0 and set back to NULL like the product of the rasters
+            clip_values = arcpy.RasterToNumPyArray(clip_raster, arcpy.Point(self.GRID_LOWER_LEFT_X, self.GRID_LOWER_LEFT_Y), self.GRID_COLS, self.GRID_ROWS, 0)
+            self.clip_raster_masks[clip_raster] = (clip_values != 0)
+            
+        return self.clip_raster_masks[clip_raster]
+    
+    def _isClippedOrRendered(self, custom_raster):
         
-        return final_raster
+        factory_specifications = custom_raster.getFactorySpecifications()
         
+        return bool(factory_specifications.get('clip_extent') or factory_specifications.get('clip_raster') or factory_specifications.get('color_map_renderer_config'))
+    
+    def _writeQuickLook(self, final_sum, color_map_renderer_config):
+        
+        color_map = ColorMap.fromCLRFile(color_map_renderer_config['input_CLR_file'])
+        quick_look_directory = os.path.dirname(color_map_renderer_config['quick_look_fullpath'])
+        if not os.path.isdir(quick_look_directory):
+            os.makedirs(quick_look_directory)
+        
+        # 0's are NULL in the composite raster
+        indices, palette = color_map.toPaletted(final_sum, nodata_value=0)
+        PNGWriter.writePaletted(color_map_renderer_config['quick_look_fullpath'], indices, palette)
+        self.debug_logger("quick_look_fullpath", color_map_renderer_config['quick_look_fullpath'])
+    
+    def _loadGridFromWorkspace(self, raster_name):
+        
+        # NoData cells are read as 0, same as Con(IsNull(raster), 0, raster)
+        return arcpy.RasterToNumPyArray(
+            os.path.join(self.workspace_fullpath, raster_name), 
+            arcpy.Point(self.GRID_LOWER_LEFT_X, self.GRID_LOWER_LEFT_Y), 
+            self.GRID_COLS, 
+            self.GRID_ROWS, 
+            0
+        )
+    
+    def _loadGridFromTimeCube(self, grid_name):
+        
+        precip = self.time_cube.getGrid(datetime.strptime(grid_name, self.TIME_CUBE_GRID_NAME_FORMAT))
+        
+        # cells below precip_min (including missing values) are NoData in the catalog rasters
+        precip[~(precip >= self.raster_creator_options['time_cube_options'].get('precip_min', 0))] = 0
+        
+        return self._toCompositeGrid(precip)
+    
+    def _loadGridFromSparseGrid(self, raster_name):
+        
+        # the sparse grid only contains the cells >= precip_min of the TRMMTransformer
+        return self._toCompositeGrid(TRMMSparseGrid.load(self._getSparseGridFullpath(raster_name)).densify())
+    
+    def _toCompositeGrid(self, precip):
+        
+        # roll the 0-360 bin layout to -180-180 and keep the rows within the composite extent
+        return np.roll(precip, self.GRID_COLS // 2, axis=1)[self.BIN_LAYOUT_ROW_SLICE]
+    
     def _saveRaster(self, raster_to_save, output_raster_fullpath, factory_specifications):
         self.debug_logger("Saving Final Raster")
 
-        if factory_specifications.get('AddColormap_management_config', None):
+        color_map_renderer_config = factory_specifications.get('color_map_renderer_config', None)
+        if factory_specifications.get('AddColormap_management_config', None) and not color_map_renderer_config:
             self.debug_logger("Adding Color Map...")
             
             color_map_config = factory_specifications['AddColormap_management_config']
@@ -229,10 +672,19 @@ class TRMMCustomRasterCreator:
         self.debug_logger("local_raster_fullpath",local_raster_fullpath)
         self.debug_logger("output_raster_fullpath",output_raster_fullpath)
         
+        # the workspace raster is a grid in a folder, CopyRaster copies the colormap of its .clr sidecar
+        clr_sidecar_fullpath = None
+        if color_map_renderer_config:
+            clr_sidecar_fullpath = ColorMap.fromCLRFile(color_map_renderer_config['input_CLR_file']).writeCLRSidecar(local_raster_fullpath)
+            self.debug_logger("clr_sidecar_fullpath", clr_sidecar_fullpath)
+        
         self._removeExistingRasterIfExists(output_raster_fullpath)
         self._copyRaster(factory_specifications['CopyRaster_management_config'], local_raster_fullpath, output_raster_fullpath)        
         self._removeExistingRasterIfExists(local_raster_fullpath)
         
+        if clr_sidecar_fullpath and os.path.isfile(clr_sidecar_fullpath):
+            os.remove(clr_sidecar_fullpath)
+        
     def _copyRaster(self, copy_raster_managment_config, local_raster_fullpath, output_raster_fullpath):
         
         self.debug_logger("Copying Raster...", output_raster_fullpath)
@@ -269,6 +721,12 @@ class TRMMCustomRasterCreator:
                 local_raster_list = [r for r in arcpy.ListRasters(raster_name_prefix+"*","*") if str(r[:len(raster_name_prefix)]).lower() == str(raster_name_prefix)]
                 list_of_rasters_to_delete = [raster for raster in local_raster_list if datetime.strptime(str(raster), raster_name_datetime_format) < archive_date]
                 self._deleteRasters(list_of_rasters_to_delete)
+                
+                if self.sparse_grid_directory:
+                    
+                    # sparse grids are named after the catalog rasters, the TRMMTransformer also prunes them with the raster catalog's archive_days
+                    deleted_sparse_grids = TRMMSparseGrid.deleteOutdatedGrids(self.sparse_grid_directory, raster_name_datetime_format, archive_date)
+                    self.debug_logger("Deleted sparse grids", len(deleted_sparse_grids))
                     
         elif remove_all_rasters_on_finish:
             
@@ -277,5 +735,12 @@ class TRMMCustomRasterCreator:
             
     def _deleteRasters(self, list_of_rasters_to_delete):
         
-        for r in list_of_rasters_to_delete:
-            arcpy.Delete_management(r)
\ No newline at end of file
+        deleted_rasters_list = []
+        try:
+            for r in list_of_rasters_to_delete:
+                arcpy.Delete_management(r)
+                deleted_rasters_list.append(r)
+                
+        finally:
+            if deleted_rasters_list:
+                TRMMWorkspaceRasterIndex(self.workspace_fullpath).removeRasterNames(deleted_rasters_list)
\ No newline at end of file
@@ -4,15 +4,25 @@
 
 # standard library
 import os
-from datetime import datetime
+import json
+import multiprocessing
+from datetime import datetime, timedelta
 from itertools import takewhile
+from collections import deque
 
 # third-party
-import arcpy
 import numpy as np
+import arcpy
 
 # ETL utils
 from etl_utils import FTPDownloadManager, UnzipUtils
+from color_map_utils import ColorMap, PNGWriter
+from arcpy_utils import ArcRasterStatisticsUtils
+
+# TRMM numpy utils
+from trmm_grid_utils import TRMMGridUtils
+from trmm_grid_transform import transformGridOutputs, transformBinToRaster
+from trmm_sparse_grid import TRMMSparseGrid
 
 
 class TRMMExtractValidator(object):
@@ -56,12 +66,145 @@ class TRMMExtractValidator(object):
         bin_datetime_format = '%Y%m%d%H' # 2012010215 --> 2012-JAN-02 3:00PM
         isWithinDatetimeRange = lambda b:dtrp(b.split(".")[1], bin_datetime_format) <= start_dt and dtrp(b.split(".")[1], bin_datetime_format) >= end_dt
         ftp_bins_list.sort(key=lambda x: x, reverse=True) # sort the list and reverse so the most recent bin files are first
+
+        current_bins_processed_set = set(current_bins_processed_list)
+        
         # function takewhile returns values from the given ftp_bins_list while the given input function isWithinDatetimeRange is True
-        missing_bin_list = [bin for bin in takewhile(isWithinDatetimeRange, ftp_bins_list) if bin not in current_bins_processed_list]
+        missing_bin_list = [bin for bin in takewhile(isWithinDatetimeRange, ftp_bins_list) if bin not in current_bins_processed_set]
 
         return missing_bin_list
     
 
+class TRMMFTPDirectoryPlanner(object):
+    
+    """
+        Class TRMMFTPDirectoryPlanner determines which FTP directories to list for the current ETL run.
+        
+        Bins of the current year are stored in the base FTP directory and bins of previous years in a sub-directory named by the year.
+        
+        The high-level steps to accomplish this task include:
+        
+            1) retrieve the bins already processed in the raster catalog within the given datetime range
+            2) determine the missing 3-hour bin datetimes by comparing every expected bin datetime in the range with the processed bins
+            3) return the year directory of each previous year that has a missing bin, followed by the base directory if the current year has a missing bin
+            
+        Early in January the bins of the last days of the previous year may not have been moved to their year directory yet, so the base directory is 
+        also listed if a missing bin is within 'rollover_days' of the start of the current year.
+        
+        A bin that was never published would otherwise make its year directory listed on every run until it is outside of the datetime range. If an 
+        'absent_bins_fullpath' is given, the missing bins of a year directory that are not in its listing (see recordDirectoryListing) are saved there as 
+        confirmed absent, and a year directory whose missing bins are all confirmed absent is only listed again once the confirmation is older than 
+        'absent_bin_recheck_days' (default 7).
+        
+        public interface:
+        
+            getMissingBinDatetimes() <list>: returns the sorted datetimes of the expected bins that are not in the raster catalog
+            getFTPDirectoriesToProcess(missing_bin_datetimes=None) <list>: returns the FTP directories that contain the given (or the current) missing bins
+            recordDirectoryListing(ftp_directory, ftp_file_names) <void>: confirms the missing bins of a year directory that are not in its listing as absent
+    """
+    
+    BIN_DATETIME_FORMAT = '%Y%m%d%H' # 2012010215 --> 2012-JAN-02 3:00PM
+    LISTING_DATETIME_FORMAT = '%Y%m%d%H%M%S'
+    
+    def __init__(self, planner_config):
+        
+        self.raster_catalog = planner_config['raster_catalog']
+        self.ftp_file_name_field = planner_config['ftp_file_name_field']
+        self.ftp_base_directory = planner_config['ftp_base_directory']
+        self.start_datetime = planner_config['start_datetime']
+        self.end_datetime = planner_config['end_datetime']
+        self.bin_interval_hours = planner_config.get('bin_interval_hours', 3)
+        self.rollover_days = planner_config.get('rollover_days', 7)
+        self.absent_bins_fullpath = planner_config.get('absent_bins_fullpath', None)
+        self.absent_bin_recheck_days = planner_config.get('absent_bin_recheck_days', 7)
+        self.debug_logger = planner_config.get('debug_logger',lambda*a,**kwa:None)
+        
+        self.missing_bin_datetimes = []
+        
+    def getMissingBinDatetimes(self):
+        
+        current_bins_processed_list = self.raster_catalog.getValuesFromDatetimeRange(self.ftp_file_name_field, self.start_datetime, self.end_datetime)
+        processed_bin_datetimes = set(datetime.strptime(str(b).split(".")[1], self.BIN_DATETIME_FORMAT) for b in current_bins_processed_list)
+        
+        missing_bin_datetimes = [dt for dt in self._getExpectedBinDatetimes() if dt not in processed_bin_datetimes]
+        self.debug_logger("len(missing_bin_datetimes)", len(missing_bin_datetimes))
+        
+        return missing_bin_datetimes
+        
+    def getFTPDirectoriesToProcess(self, missing_bin_datetimes=None):
+        
+        if missing_bin_datetimes is None:
+            missing_bin_datetimes = self.getMissingBinDatetimes()
+        self.missing_bin_datetimes = missing_bin_datetimes # the bins confirmed by recordDirectoryListing
+            
+        current_year = self.start_datetime.year
+        rollover_datetime = datetime(current_year, 1, 1) - timedelta(days=self.rollover_days)
+        
+        # a missing bin that was recently confirmed absent from its year directory does not make the directory listed again
+        recheck_datetime = datetime.utcnow() - timedelta(days=self.absent_bin_recheck_days)
+        absent_bins = self._readAbsentBins()
+        isRecentlyConfirmedAbsent = lambda dt: absent_bins.get(dt.strftime(self.BIN_DATETIME_FORMAT), "") > recheck_datetime.strftime(self.LISTING_DATETIME_FORMAT)
+        
+        previous_years = sorted(set(dt.year for dt in missing_bin_datetimes if dt.year < current_year and not isRecentlyConfirmedAbsent(dt)), reverse=True)
+        ftp_directories_to_process = [self.ftp_base_directory + str(year) for year in previous_years]
+        
+        if [dt for dt in missing_bin_datetimes if dt >= rollover_datetime]:
+            ftp_directories_to_process.append(self.ftp_base_directory) # the 'recents' folder of the bins for the current year
+            
+        self.debug_logger("ftp_directories_to_process", ftp_directories_to_process)
+        
+        return ftp_directories_to_process
+    
+    def recordDirectoryListing(self, ftp_directory, ftp_file_names):
+        
+        year_string = ftp_directory[len(self.ftp_base_directory):].strip("/")
+        if not self.absent_bins_fullpath or not year_string.isdigit():
+            return # the bins of the base directory may still be published
+        
+        listed_bin_datetime_strings = set(f.split(".")[1] for f in ftp_file_names if len(f.split(".")) > 1)
+        listing_datetime_string = datetime.utcnow().strftime(self.LISTING_DATETIME_FORMAT)
+        
+        # the confirmations outside of the datetime range are dropped so the file does not grow
+        absent_bins = self._readAbsentBins()
+        end_datetime_string, start_datetime_string = self.end_datetime.strftime(self.BIN_DATETIME_FORMAT), self.start_datetime.strftime(self.BIN_DATETIME_FORMAT)
+        absent_bins = dict((b, l) for b, l in absent_bins.items() if end_datetime_string <= b <= start_datetime_string and b not in listed_bin_datetime_strings)
+        
+        for bin_datetime in self.missing_bin_datetimes:
+            
+            bin_datetime_string = bin_datetime.strftime(self.BIN_DATETIME_FORMAT)
+            if str(bin_datetime.year) == year_string and bin_datetime_string not in listed_bin_datetime_strings:
+                absent_bins[bin_datetime_string] = listing_datetime_string
+                
+        self.debug_logger("confirmed absent bins", ftp_directory, sorted(b for b, l in absent_bins.items() if l == listing_datetime_string))
+        
+        with open(self.absent_bins_fullpath, "w") as absent_bins_file:
+            json.dump(absent_bins, absent_bins_file)
+            
+    def _readAbsentBins(self):
+        
+        # {bin datetime string: datetime string of the listing that confirmed the bin absent}
+        if not self.absent_bins_fullpath or not os.path.isfile(self.absent_bins_fullpath):
+            return {}
+        
+        with open(self.absent_bins_fullpath, "r") as absent_bins_file:
+            return json.load(absent_bins_file)
+    
+    def _getExpectedBinDatetimes(self):
+        
+        # the first bin on or after end_datetime, bins are at the hours divisible by the bin interval
+        bin_datetime = self.end_datetime.replace(minute=0, second=0, microsecond=0)
+        while bin_datetime < self.end_datetime or bin_datetime.hour % self.bin_interval_hours:
+            bin_datetime += timedelta(hours=1)
+            
+        expected_bin_datetimes = []
+        while bin_datetime <= self.start_datetime:
+            
+            expected_bin_datetimes.append(bin_datetime)
+            bin_datetime += timedelta(hours=self.bin_interval_hours)
+            
+        return expected_bin_datetimes
+    
+
 class TRMMExtractor(FTPDownloadManager):
     
     """
@@ -69,19 +212,26 @@ class TRMMExtractor(FTPDownloadManager):
         
             1) retrieves a list of all bin files from a given FTP directory. (This list is sent to a TRMMExtractValidator).
             2) downloads a bin file from the given FTP directory.
+            
+        If an 'ftp_directory_planner' is given, each listing is passed to its recordDirectoryListing so the bins absent from a year directory are remembered.
     """
     
     def __init__(self, extractor_config):
         FTPDownloadManager.__init__(self, extractor_config['ftp_options'])
 
         self.target_file_extn = extractor_config.get('target_file_extn', None)
+        self.ftp_directory_planner = extractor_config.get('ftp_directory_planner', None)
         self.debug_logger = extractor_config.get('debug_logger',lambda*a,**kwa:None)
                                                     
     def getDataToExtract(self, ftp_directory):
         
         self.openConnection()
+        
+        ftp_file_names = self.getFileNamesFromDirectory(ftp_directory, self.target_file_extn)
+        if self.ftp_directory_planner:
+            self.ftp_directory_planner.recordDirectoryListing(ftp_directory, ftp_file_names)
 
-        return self.getFileNamesFromDirectory(ftp_directory, self.target_file_extn)
+        return ftp_file_names
 
     def extract(self, trmm_data):
         
@@ -111,12 +261,28 @@ class TRMMTransformer(object):
         
             1) converts a bin into an ESRI raster grid
             2) retrieve the bin's header (meta-data) as a string
+            3) sets the bin's precipitation grid on the TRMMETLData for the TRMMLoader
+            4) optionally saves the cells >= precip_min as a TRMMSparseGrid in the 'sparse_grid_directory', the sparse grids older than
+               'sparse_grid_archive_days' (default: the raster catalog's archive_days) are deleted when the transformer is created
+            5) optionally computes the raster's RasterStatistics from the precipitation grid for the TRMMLoader ('raster_statistics_config')
         
         The high-level steps to accomplish task 1) includes:
         
-            1) read the binary file data and write it out to a CSV using numpy
+            1) read the binary file data and write it out to a CSV using vectorized numpy operations (TRMMGridUtils)
             2) create an xy event layer from the CSV
             3) create a raster from the xy event layer
+            
+        If a 'raster_writer_config' is given, task 1) instead writes the grid straight to a georeferenced raster:
+        
+            1) read the binary file data and roll it from 0-360 to -180-180 with cells below precip_min set to NoData (TRMMGridUtils)
+            2) write the float32 grid with RasterGridWriter as an ESRI float grid ('FLT') or GeoTIFF ('TIF') in the raster catalog's spatial reference
+            
+        raster_statistics_config <dict>:
+        
+            'histogram_bins' <int>: optional, the number of histogram bins, default 256
+            'histogram_range' <tuple>: optional, the (min, max) mm/hr range of the histogram bins, default the grid's minimum and maximum
+            'truncate_values' <bool>: optional, computes the statistics of the values truncated to integers, set it when the TRMMLoader copies the rasters 
+            with an integer pixel_type (ex: 16_BIT_UNSIGNED) so the statistics match the catalog's rasters, default False
     """
     
     def __init__(self, transformer_config, decoratee):
@@ -125,23 +291,44 @@ class TRMMTransformer(object):
         self.raster_name_prefix = transformer_config.get('raster_name_prefix', 0)
         self.make_xy_event_layer_config = transformer_config.get('MakeXYEventLayer_management_config', {})
         self.point_to_raster_config = transformer_config.get('PointToRaster_conversion_config', {})
+        self.raster_writer_config = transformer_config.get('raster_writer_config', None)
+        self.raster_catalog = transformer_config.get('raster_catalog', None)
+        self.batch_transform_processes = transformer_config.get('batch_transform_processes', None)
+        self.sparse_grid_directory = transformer_config.get('sparse_grid_directory', None)
+        self.raster_statistics_config = transformer_config.get('raster_statistics_config', None)
+        
+        if self.sparse_grid_directory and not os.path.isdir(self.sparse_grid_directory):
+            os.makedirs(self.sparse_grid_directory)
+            
         self.debug_logger = transformer_config.get('debug_logger',lambda*a,**kwa:None)
         
+        if self.sparse_grid_directory:
+            default_archive_days = self.raster_catalog.options['archive_days'] if self.raster_catalog else None
+            self._deleteOutdatedSparseGrids(transformer_config.get('sparse_grid_archive_days', default_archive_days))
+        
         self.decoratee = decoratee # this is the TRMMMetaDataTransformer
         
     def transform(self, trmm_data):
 
         try:
             bin_file = trmm_data.getDataToTransform()
+            header_string, precip = TRMMGridUtils.readBinFile(bin_file)
             
-            csv_file, header_string = self._transformBinToCSV(bin_file, trmm_data.getTransformDir())
-            self.debug_logger("csv_file",csv_file)
-            
-            raster = self._transformCSVToRaster(csv_file, trmm_data.getLoadDir())
+            if self.raster_writer_config:
+                raster = self._transformGridToRaster(precip, bin_file, trmm_data.getLoadDir())
+                
+            else:
+                csv_file = self._transformGridToCSV(precip, bin_file, trmm_data.getTransformDir())
+                self.debug_logger("csv_file",csv_file)
+                
+                raster = self._transformCSVToRaster(csv_file, trmm_data.getLoadDir())
+                
             self.debug_logger("raster",raster)
             
             trmm_data.setDataToLoad(raster)
             trmm_data.setMetaDataToTransform(header_string)
+            trmm_data.setPrecipitationGrid(precip) # kept for the TRMMLoader's optional time cube, daily accumulator and quick-look
+            trmm_data.setRasterStatistics(transformGridOutputs(precip, self.percip_min, self._getSparseGridFullpath(bin_file), self.raster_statistics_config))
             
             self.decoratee.transform(trmm_data) # call the meta-transformer to transform the header into a dictonary
             
@@ -150,55 +337,13 @@ class TRMMTransformer(object):
             self.debug_logger("transform Exception:",str(e),str(arcpy.GetMessages(2)))
             trmm_data.handleException(exception=("transform:",str(e)),messages=arcpy.GetMessages(2))
         
-    def _transformBinToCSV(self, bin_to_process, transform_dir):
-        
-        rows, cols, precip_scale_factor = 480, 1440, 100.0 # tuple assignment
-        precip_min = self.percip_min
-         
-        # retrieve the header and data strings ---------
-        with open(bin_to_process,'rb') as bin_file:
-            
-            data_string = bin_file.read() 
-            # split by the last key's value to remove the meta-data, then re-concat the value
-            header_string = str(data_string.split("=LAST")[0]+"=LAST") 
-            
-        # execute numpy operations ---------------------
-        precip = np.fromstring(data_string[2880:1385280], np.int16)
-        precip = precip.byteswap()
-        precip = np.asarray(precip, np.float32)
-        precip /= precip_scale_factor
-        precip = precip.reshape(rows, cols)
-        
-        vstack = np.vstack
-        arange = np.arange 
-        
-        # north-south extent
-        lat = arange(59.875, -60.125, -0.25, dtype=float)
-        z = arange(59.875, -60.125, -0.25, dtype=float)
-        
-        for i in range(1, cols): 
-            lat = vstack((lat, z)) 
-        lat = lat.transpose()
+    def _transformGridToCSV(self, precip, bin_to_process, transform_dir):
         
-        # east-west extent
-        lng = arange(0.125, 360.125, +0.25, dtype=float)
-        z = arange(0.125, 360.125, +0.25, dtype=float)
-        
-        for i in range(1, rows): 
-            lng = vstack((lng, z))     
-              
         # write lat, long, and precipitation values to csv -----------------------------
         csv_name = bin_to_process.split(".")[1] + ".csv"
         csv_fullpath = os.path.join(transform_dir, csv_name)
         
-        with open(csv_fullpath, "w") as out_csv:            
-            out_csv.write('lat,long,precipitation\n')
-            
-            for i in np.ndindex(precip.shape):
-                if precip[i] >= precip_min:
-                    out_csv.write('%g,%g,%g\n' % (lat[i], lng[i], precip[i]))
-            
-        return (csv_fullpath, header_string)
+        return TRMMGridUtils.writePrecipitationCSV(precip, self.percip_min, csv_fullpath)
         
     def _transformCSVToRaster(self, csv_file, load_dir):
         
@@ -224,6 +369,120 @@ class TRMMTransformer(object):
         self.debug_logger("PointToRaster_conversion status", point_to_raster_result.status) 
         
         return output_raster
+    
+    def _transformGridToRaster(self, precip, bin_to_process, load_dir):
+        
+        return TRMMGridUtils.writeRaster(precip, *self._getRasterWriterArguments(bin_to_process, load_dir))
+    
+    def _getRasterName(self, bin_to_process):
+        
+        return self.raster_name_prefix + os.path.basename(bin_to_process).split(".")[1]
+    
+    def _deleteOutdatedSparseGrids(self, sparse_grid_archive_days):
+        
+        if not sparse_grid_archive_days:
+            return
+        
+        # a sparse grid is written for every bin, only the grids named after a raster ex: "T_2012010112.npz" are deleted
+        archive_date = datetime.utcnow() - timedelta(days=sparse_grid_archive_days)
+        sparse_grid_name_format = self.raster_name_prefix + TRMMFTPDirectoryPlanner.BIN_DATETIME_FORMAT
+        deleted_sparse_grids = TRMMSparseGrid.deleteOutdatedGrids(self.sparse_grid_directory, sparse_grid_name_format, archive_date)
+        self.debug_logger("Deleted sparse grids", len(deleted_sparse_grids))
+        
+    def _getSparseGridFullpath(self, bin_to_process):
+        
+        # the sparse grid keeps the bin layout and is named after the raster in the raster catalog ex: "T_2012010112.npz"
+        if not self.sparse_grid_directory:
+            return None
+        
+        return os.path.join(self.sparse_grid_directory, self._getRasterName(bin_to_process) + ".npz")
+    
+    def _getRasterWriterArguments(self, bin_to_process, load_dir):
+        
+        # returns (raster_fullpath, raster_format, precip_min, nodata_value, spatial_reference) for TRMMGridUtils.writeRaster
+        rwc = self.raster_writer_config
+        spatial_reference = self.raster_catalog.options['raster_spatial_reference'] if self.raster_catalog else None
+        
+        return (os.path.join(load_dir, self._getRasterName(bin_to_process)), rwc.get('raster_format', 'FLT'), self.percip_min, rwc.get('nodata_value', -9999), spatial_reference)
+    
+    def batchTransform(self, trmm_data_list):
+        
+        """
+            This method transforms the given TRMMETLData (a list or a generator that extracts each one as it is requested) and yields each one 
+            in the given order as soon as it is transformed.
+            
+            With a 'raster_writer_config', the bins are read and written to rasters by transformBinToRaster in a multiprocessing.Pool of 
+            'batch_transform_processes' processes (default: the number of cores), which also writes the sparse grids and computes the raster statistics. 
+            Only the meta-data is transformed in this process, the TRMMLoader reads a bin's grid again only if one of its grid outputs needs it.
+            Without it (or with a single process), each bin is transformed in turn since the CSV to raster chain requires arcpy.
+        """
+        
+        if not self.raster_writer_config or self.batch_transform_processes == 1:
+            for trmm_data in trmm_data_list:
+                self.transform(trmm_data)
+                yield trmm_data
+            return
+        
+        # the pool's task thread pulls the jobs, so each bin is extracted while the bins before it are transformed and loaded, 
+        # imap returns the results in the order of the jobs so the pending TRMMETLData are matched to their results first in first out
+        pending_trmm_data = deque()
+        
+        def getTransformJobs():
+            for trmm_data in trmm_data_list:
+                
+                # an exception raised in the task thread would silently end imap's results, so the TRMMETLData is flagged and skipped instead
+                try:
+                    bin_to_process = trmm_data.getDataToTransform()
+                    transform_job = (bin_to_process,) + self._getRasterWriterArguments(bin_to_process, trmm_data.getLoadDir()) + \
+                                    (self._getSparseGridFullpath(bin_to_process), self.raster_statistics_config)
+                    
+                except Exception as e:
+                    
+                    self.debug_logger("transform Exception:",str(e))
+                    trmm_data.handleException(exception=("transform:",str(e)),messages="")
+                    continue
+                
+                pending_trmm_data.append(trmm_data)
+                yield transform_job
+        
+        transform_pool = multiprocessing.Pool(self.batch_transform_processes)
+        try:
+            for transform_result in transform_pool.imap(transformBinToRaster, getTransformJobs()):
+                trmm_data = pending_trmm_data.popleft()
+                self._finishBatchTransform(trmm_data, transform_result)
+                yield trmm_data
+                
+            transform_pool.close()
+            
+        finally:
+            transform_pool.terminate()
+            transform_pool.join()
+            
+    def _finishBatchTransform(self, trmm_data, transform_result):
+        
+        raster, header_string, band_statistics, exception = transform_result
+        if exception:
+            
+            self.debug_logger("transform Exception:",exception)
+            trmm_data.handleException(exception=("transform:",exception),messages="")
+            return
+        
+        try:
+            self.debug_logger("raster",raster)
+            trmm_data.setDataToLoad(raster)
+            trmm_data.setMetaDataToTransform(header_string)
+            trmm_data.setRasterStatistics(band_statistics)
+            
+            # the TRMMLoader's optional time cube, daily accumulator, zonal statistics and quick-look are single writer stores updated in this process, 
+            # so the bin is read again on their first getPrecipitationGrid() instead of sending every grid back from the worker
+            trmm_data.setPrecipitationGridSource(trmm_data.getDataToTransform())
+            
+            self.decoratee.transform(trmm_data) # call the meta-transformer to transform the header into a dictonary
+            
+        except Exception as e:
+            
+            self.debug_logger("transform Exception:",str(e))
+            trmm_data.handleException(exception=("transform:",str(e)),messages="")
 
 
 class TRMMMetaDataTransformer(object):
@@ -295,6 +554,22 @@ class TRMMLoader(object):
         
             1)    inserts the given raster into the given raster catalog
             2)    updates the fields associated with the inserted raster in the given raster catalog
+            3)    optionally appends the bin's precipitation grid to the given TRMMTimeCube ('time_cube')
+            4)    optionally renders the bin's precipitation grid with a .clr color map into a PNG quick-look ('color_map_renderer_config'), the parsed
+                  color map is also written as a .clr sidecar of the raster so it is copied into the raster catalog without AddColormap_management
+            5)    optionally adds the bin's precipitation grid to the partial sum of its UTC day in the given TRMMDailyAccumulator ('daily_accumulator')
+            6)    optionally updates the per-zone rainfall statistics of the bin's precipitation grid in the given TRMMZonalStatistics ('zonal_statistics')
+            7)    writes the RasterStatistics computed by the TRMMTransformer as the statistics of the catalog's copy of the raster and into the stats_ fields 
+                  of the catalog row, so ArcGIS does not calculate them when the raster is copied or drawn
+            
+        color_map_renderer_config <dict>:
+        
+            'input_CLR_file' <str>: the .clr color map, parsed once per run by ColorMap
+            'quick_look_directory' <str>: directory of the <raster name>.png quick-looks, created if it does not exist
+            'precip_min' <float>: cells below this value are transparent, same as the TRMMTransformer's precip_min
+            'quick_look_archive_days' <int>: optional, the quick-looks older than this many days are deleted when the loader is created, default the raster catalog's archive_days
+            'quick_look_name_format' <str>: optional, the datetime format of the raster names, default "T_%Y%m%d%H". Only the quick-looks whose name parses are deleted,
+            so other PNGs in the quick_look_directory (ex: the custom raster quick-looks TRMM30Day.png) are kept
     """
 
     def __init__(self, loader_config):
@@ -302,45 +577,185 @@ class TRMMLoader(object):
         self.raster_catalog = loader_config['raster_catalog']
         self.copy_raster_config = loader_config.get('CopyRaster_management_config',{})
         self.add_color_map_config = loader_config.get('AddColormap_management_config', None)
+        self.time_cube = loader_config.get('time_cube', None)
+        self.daily_accumulator = loader_config.get('daily_accumulator', None)
+        self.zonal_statistics = loader_config.get('zonal_statistics', None)
+        self.color_map_renderer_config = loader_config.get('color_map_renderer_config', None)
         self.debug_logger = loader_config.get('debug_logger',lambda*a,**kwa:None)
+        
+        self.raster_statistics_utils = ArcRasterStatisticsUtils()
+        
+        if self.color_map_renderer_config and not os.path.isdir(self.color_map_renderer_config['quick_look_directory']):
+            os.makedirs(self.color_map_renderer_config['quick_look_directory'])
+            
+        if self.color_map_renderer_config:
+            self._deleteOutdatedQuickLooks()
                                         
     def load(self, trmm_data):
         
         try:
             trmm_raster = trmm_data.getDataToLoad()
             meta_data = trmm_data.getMetaDataToLoad()
+            band_statistics = trmm_data.getRasterStatistics()
             
-            # optionally add a color map
-            if self.add_color_map_config:
+            # optionally add a color map, the .clr sidecar replaces AddColormap_management when the color map renderer is configured
+            if self.color_map_renderer_config:
+                self._writeColorMapSidecar(trmm_raster)
+            elif self.add_color_map_config:
                 self._addColorMap(trmm_raster)
-                
-            self._copyRaster(trmm_raster)
             
-            raster_name = os.path.basename(trmm_raster)
+            self._copyRaster(trmm_raster, calculate_statistics=not band_statistics)
+            
+            # rasters written by the direct raster writer have a file extension that is not part of the catalog name
+            raster_name = os.path.splitext(os.path.basename(trmm_raster))[0]
+            
+            if band_statistics:
+                self._setRasterStatistics(raster_name, band_statistics)
+                meta_data.update(band_statistics[0].getFieldValues())
+                
             self.raster_catalog.updateFieldsForInput(raster_name, meta_data)
             
+            if self.time_cube:
+                self.time_cube.append(meta_data['datetime'], trmm_data.getPrecipitationGrid())
+                
+            if self.daily_accumulator:
+                self.daily_accumulator.addGrid(meta_data['datetime'], trmm_data.getPrecipitationGrid())
+                
+            if self.zonal_statistics:
+                self.zonal_statistics.updateZonalStatistics(meta_data['datetime'], trmm_data.getPrecipitationGrid())
+                
+            if self.color_map_renderer_config:
+                self._writeQuickLook(raster_name, trmm_data.getPrecipitationGrid())
+            
         except Exception as e:
             
             self.debug_logger("Load Exception:",str(e),str(arcpy.GetMessages(2)))
             trmm_data.handleException(exception=("Load:",str(e)),messages=arcpy.GetMessages(2))
             
+        finally:
+            trmm_data.setPrecipitationGrid(None) # the ETLData is kept until the end of the run, release the grid
+            
     def _addColorMap(self, trmm_raster):
         
         cmc = self.add_color_map_config
         color_map_result = arcpy.AddColormap_management(trmm_raster, cmc.get('in_template_raster',''), cmc['input_CLR_file'])
         self.debug_logger("AddColormap_management result", color_map_result.status)              
     
-    def _copyRaster(self, trmm_raster):
-        
-        crc = self.copy_raster_config
-        copy_result = arcpy.CopyRaster_management(
-            trmm_raster, 
-            self.raster_catalog.fullpath, 
-            crc.get('config_keyword',''), 
-            crc.get('background_value',''), 
-            crc.get('nodata_value',''), 
-            crc.get('onebit_to_eightbit',''), 
-            crc.get('colormap_to_RGB',''), 
-            crc.get('pixel_type','')
-        )
-        self.debug_logger("CopyRaster_management status",copy_result.status)
+    def _writeColorMapSidecar(self, trmm_raster):
+        
+        color_map = ColorMap.fromCLRFile(self.color_map_renderer_config['input_CLR_file'])
+        self.debug_logger("clr_sidecar_fullpath", color_map.writeCLRSidecar(trmm_raster))
+    
+    def _writeQuickLook(self, raster_name, precip):
+        
+        cmrc = self.color_map_renderer_config
+        color_map = ColorMap.fromCLRFile(cmrc['input_CLR_file'])
+        
+        west_east_precip = TRMMGridUtils.toWestEastGrid(precip, cmrc.get('precip_min', 0), np.nan)
+        quick_look_fullpath = os.path.join(cmrc['quick_look_directory'], raster_name + ".png")
+        PNGWriter.writePaletted(quick_look_fullpath, *color_map.toPaletted(west_east_precip))
+        self.debug_logger("quick_look_fullpath", quick_look_fullpath)
+    
+    def _deleteOutdatedQuickLooks(self):
+        
+        cmrc = self.color_map_renderer_config
+        quick_look_archive_days = cmrc.get('quick_look_archive_days', self.raster_catalog.options['archive_days'])
+        quick_look_name_format = cmrc.get('quick_look_name_format', "T_" + TRMMFTPDirectoryPlanner.BIN_DATETIME_FORMAT)
+        archive_date = datetime.utcnow() - timedelta(days=quick_look_archive_days)
+        
+        deleted_quick_looks = 0
+        for quick_look_file in os.listdir(cmrc['quick_look_directory']):
+            
+            quick_look_name, extension = os.path.splitext(quick_look_file)
+            if extension.lower() != ".png":
+                continue
+            
+            try:
+                quick_look_datetime = datetime.strptime(quick_look_name, quick_look_name_format)
+            except ValueError:
+                continue # not a bin's quick-look
+                
+            if quick_look_datetime < archive_date:
+                os.remove(os.path.join(cmrc['quick_look_directory'], quick_look_file))
+                deleted_quick_looks += 1
+                
+        self.debug_logger("Deleted quick-looks", deleted_quick_looks)
+    
+    def _setRasterStatistics(self, raster_name, band_statistics):
+        
+        # the statistics are set on the catalog's copy of the raster, the copy is what ArcGIS draws
+        catalog_raster_fullpath = self.raster_catalog.getRasterFullpath(raster_name)
+        self.raster_statistics_utils.setRasterStatistics(catalog_raster_fullpath, band_statistics)
+        self.debug_logger("set raster statistics", catalog_raster_fullpath)
+    
+    def _copyRaster(self, trmm_raster, calculate_statistics=True):
+        
+        # the statistics computed at transform time are set on the catalog's copy of the raster after the copy
+        raster_statistics_environment = arcpy.env.rasterStatistics
+        if not calculate_statistics:
+            arcpy.env.rasterStatistics = "NONE"
+        
+        try:
+            crc = self.copy_raster_config
+            copy_result = arcpy.CopyRaster_management(
+                trmm_raster, 
+                self.raster_catalog.fullpath, 
+                crc.get('config_keyword',''), 
+                crc.get('background_value',''), 
+                crc.get('nodata_value',''), 
+                crc.get('onebit_to_eightbit',''), 
+                crc.get('colormap_to_RGB',''), 
+                crc.get('pixel_type','')
+            )
+            self.debug_logger("CopyRaster_management status",copy_result.status)
+            
+        finally:
+            arcpy.env.rasterStatistics = raster_statistics_environment
+
+
+class TRMMZoneRasterizer(object):
+    
+    """
+        Class TRMMZoneRasterizer rasterizes zone polygons (ex: admin units) onto the 0.25 degree TRMM grid with arcpy.PolygonToRaster_conversion.
+        Its getZoneLabels method is meant to be the zone_labels_loader of a TRMMZonalStatistics, which caches the labels so the polygons are only rasterized once.
+        
+        rasterizer_config <dict>:
+        
+            'zone_feature_class' <str>: fullpath to the zone polygons
+            'zone_field' <str>: the integer field that identifies each zone, values must be >= 0
+            'workspace_fullpath' <str>: workspace of the temporary zone raster
+            'cell_assignment' <str>: optional, the cell_assignment of arcpy.PolygonToRaster_conversion, default 'CELL_CENTER'
+        
+        public interface:
+        
+            getZoneLabels() <ndarray>: returns the zone of each cell as a 480x1440 int32 array in the bin layout, -1 outside of every zone
+    """
+    
+    def __init__(self, rasterizer_config):
+        
+        self.rasterizer_config = rasterizer_config
+        self.debug_logger = rasterizer_config.get('debug_logger',lambda*a,**kwa:None)
+        
+    def getZoneLabels(self):
+        
+        rc = self.rasterizer_config
+        zone_raster_fullpath = os.path.join(rc['workspace_fullpath'], "trmm_zones")
+        lower_left_x, lower_left_y, cellsize = TRMMGridUtils.WEST_EAST_GEOREFERENCE
+        
+        previous_extent = arcpy.env.extent
+        try:
+            # the extent of the grid returned by TRMMGridUtils.toWestEastGrid so the zone cells line up with the TRMM cells
+            arcpy.env.extent = arcpy.Extent(lower_left_x, lower_left_y, lower_left_x + TRMMGridUtils.COLS * cellsize, lower_left_y + TRMMGridUtils.ROWS * cellsize)
+            
+            result = arcpy.PolygonToRaster_conversion(rc['zone_feature_class'], rc['zone_field'], zone_raster_fullpath, rc.get('cell_assignment', 'CELL_CENTER'), 'NONE', cellsize)
+            self.debug_logger("PolygonToRaster_conversion status", result.status)
+            
+            zone_labels = arcpy.RasterToNumPyArray(zone_raster_fullpath, arcpy.Point(lower_left_x, lower_left_y), TRMMGridUtils.COLS, TRMMGridUtils.ROWS, -1)
+            
+        finally:
+            arcpy.env.extent = previous_extent
+            if arcpy.Exists(zone_raster_fullpath):
+                arcpy.Delete_management(zone_raster_fullpath)
+                
+        # roll 180 W back to the middle of the grid, the first column of the bin layout is 0.125 E
+        return np.roll(np.asarray(zone_labels, np.int32), -(TRMMGridUtils.COLS // 2), axis=1)
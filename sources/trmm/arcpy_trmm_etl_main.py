@@ -21,18 +21,21 @@ import arcpy
 sys.path.append("PATH TO ETL\\ReferenceNode\\ETL\\ETLScripts\\ETLBaseModules\\")
 
 # ETL framework
-from etl_controller import ETLController
-from etl_delegate import FTPETLDelegate
+from etl_controller import ETLController, ParallelTransformController
+from trmm_etl_delegate import TRMMETLDelegate
 
 # arcpy ETL framework
-from arcpy_trmm_etl_core import TRMMLoader, TRMMTransformer, TRMMExtractor, TRMMMetaDataTransformer, TRMMExtractValidator
+from arcpy_trmm_etl_core import TRMMLoader, TRMMTransformer, TRMMExtractor, TRMMMetaDataTransformer, TRMMExtractValidator, TRMMFTPDirectoryPlanner, TRMMZoneRasterizer
 
 # ETL utils 
 from etl_utils import ETLDebugLogger, ETLExceptionManager, ExceptionManager
-from arcpy_utils import FileGeoDatabase, RasterCatalog, ArcGISServiceManager
+from arcpy_utils import FileGeoDatabase, RasterCatalog, ArcGISServiceManager, ArcRasterStatisticsUtils, service_refresh_coalescer
 
 # custom modules
 from arcpy_trmm_custom_raster import TRMMCustomRasterRequest, TRMMCustomRasterCreator
+from trmm_time_cube import TRMMTimeCube
+from trmm_accumulations import TRMMDailyAccumulator
+from trmm_zonal_stats import TRMMZonalStatistics
 
 
 def getRasterCatalog(output_basepath, spatial_projection):
@@ -96,6 +99,10 @@ def getRasterCatalog(output_basepath, spatial_projection):
 #    arcpy.AddField_management(raster_catalog.fullpath, "contact_facsimile", 'TEXT', '', '', 25)
 #    arcpy.AddField_management(raster_catalog.fullpath, "contact_email", 'TEXT', '', '', 50)
 #    arcpy.AddField_management(raster_catalog.fullpath, "run_latency", 'TEXT', '', '', 50)
+    
+    # raster statistics fields, written when the TRMMTransformer has a raster_statistics_config. Unlike the fields above they are 
+    # added to an existing raster catalog as well, since the raster_statistics_config is on by default -------------------------------------
+    ArcRasterStatisticsUtils().addStatisticsFields(raster_catalog.fullpath)
 
     return raster_catalog
 
@@ -119,6 +126,19 @@ def executeETL(raster_catalog, spatial_projection, start_datetime, end_datetime,
         'debug_logger':update_debug_log    
     })
     
+    # The directories of the bins to process are planned from the bins missing in the raster catalog within the given start and end datetimes
+    trmm_ftp_directory_planner = TRMMFTPDirectoryPlanner({
+                                                          
+        "raster_catalog":raster_catalog,
+        "ftp_file_name_field":"ftp_file_name",
+        "ftp_base_directory":"pub/merged/mergeIRMicro/", # base directory where recent bins for the current year are stored.
+        "start_datetime":start_datetime,
+        "end_datetime":end_datetime,
+        "absent_bins_fullpath":os.path.join(sys.path[0], "TRMMAbsentBins.json"), # optional, comment out/delete entire key to list a year directory on every run it has a missing bin
+        "absent_bin_recheck_days":7, # a year directory whose missing bins were confirmed absent is listed again after this many days
+        'debug_logger':update_debug_log
+    })
+    
     trmm_extractor = TRMMExtractor({
                                     
         "target_file_extn":"bin.gz", # extension of the bin file in the FTP directory
@@ -127,6 +147,7 @@ def executeETL(raster_catalog, spatial_projection, start_datetime, end_datetime,
             "ftp_user":"anonymous", 
             "ftp_pswrd":"anonymous"
         },
+        'ftp_directory_planner':trmm_ftp_directory_planner, # remembers the bins absent from the listing of a year directory
         'debug_logger':update_debug_log                                    
     })
     
@@ -140,6 +161,17 @@ def executeETL(raster_catalog, spatial_projection, start_datetime, end_datetime,
         "raster_name_prefix":"T_",  # prefix to append to the rasters ex: "T_2012010112"
         "precip_min":1, # minimum percipitation value to write out from the bin into the CSV
         "raster_catalog":raster_catalog,
+        "sparse_grid_directory":os.path.join(sys.path[0], "TRMMSparseGrids"), # optional, comment out/delete entire key if no sparse grids are needed
+        "sparse_grid_archive_days":35, # optional, deletes the older sparse grids on every run, default the raster catalog's archive_days
+        "batch_transform_processes":None, # number of processes transforming bins in backfill mode, None for the number of cores
+        "raster_statistics_config":{ # optional, comment out/delete entire key to let ArcGIS calculate the statistics, requires the stats_ fields in the raster catalog
+            'histogram_bins':256,
+            'truncate_values':True # the TRMMLoader copies the rasters as 16_BIT_UNSIGNED
+        },
+        "raster_writer_config":{ # optional, comment out/delete entire key to create the rasters with the CSV, xy event layer and PointToRaster chain
+            'raster_format':'FLT', # 'FLT' (ESRI float grid with a .prj of the catalog's spatial reference) or 'TIF' (GeoTIFF, only for a WGS84 catalog)
+            'nodata_value':-9999
+        },
         "MakeXYEventLayer_management_config":{
             'in_x_field':'long', 
             'in_y_field':'lat', 
@@ -158,8 +190,39 @@ def executeETL(raster_catalog, spatial_projection, start_datetime, end_datetime,
     trmm_loader = TRMMLoader({
                               
         "raster_catalog":raster_catalog,
-        "AddColormap_management_config":{ # optional, comment out/delete entire key if no color map is needed  
-            "input_CLR_file":color_map
+        "time_cube":TRMMTimeCube({ # optional, comment out/delete entire key if no time cube is needed
+            'cube_directory':os.path.join(sys.path[0], "TRMMTimeCube"),
+            'archive_days':35, # keep the grids of the 30-day composite, the oldest grid is overwritten once the cube is full
+            'debug_logger':update_debug_log
+        }),
+        "daily_accumulator":TRMMDailyAccumulator({ # optional, comment out/delete entire key together with the TRMMCustomRasterCreator's daily_accumulator_options
+            'state_directory':os.path.join(sys.path[0], "TRMMDailyPartials"),
+            'precip_min':1, # same as the TRMMTransformer's precip_min
+            'archive_days':35, # keep the daily partials of the 30-day composite
+            'truncate_grids':True, # same as the 16_BIT_UNSIGNED catalog rasters, keep in sync with the TRMMCustomRasterCreator's daily_accumulator_options
+            'debug_logger':update_debug_log
+        }),
+        # "zonal_statistics":TRMMZonalStatistics({ # optional, per-zone rainfall statistics of every bin
+        #     'zone_labels_fullpath':os.path.join(sys.path[0], "TRMMZoneLabels.npy"),
+        #     'zone_labels_loader':TRMMZoneRasterizer({ # only called to create the zone labels if they are not cached yet
+        #         'zone_feature_class':"PATH TO ADMIN BOUNDARIES FEATURE CLASS",
+        #         'zone_field':"ZONE_ID",
+        #         'workspace_fullpath':sys.path[0],
+        #         'debug_logger':update_debug_log
+        #     }).getZoneLabels,
+        #     'database_fullpath':os.path.join(sys.path[0], "TRMMZonalStatistics.sqlite"),
+        #     'precip_min':1, # same as the TRMMTransformer's precip_min
+        #     'debug_logger':update_debug_log
+        # }),
+        # "AddColormap_management_config":{ # optional, not used with a color_map_renderer_config, which copies the color map with a .clr sidecar of the raster
+        #     "input_CLR_file":color_map
+        # },
+        "color_map_renderer_config":{ # optional, comment out/delete entire key if no PNG quick-looks and color map are needed
+            "input_CLR_file":color_map,
+            "quick_look_directory":os.path.join(sys.path[0], "TRMMQuickLooks"),
+            "precip_min":1,
+            "quick_look_archive_days":35, # optional, deletes the older quick-looks on every run, default the raster catalog's archive_days
+            "quick_look_name_format":"T_%Y%m%d%H" # the TRMMTransformer's raster_name_prefix and the bin datetime, the TRMM1Day/7Day/30Day quick-looks are kept
         },
         "CopyRaster_management_config":{  
             'config_keyword':'',
@@ -172,19 +235,21 @@ def executeETL(raster_catalog, spatial_projection, start_datetime, end_datetime,
         'debug_logger':update_debug_log
     })
     
-    etl_controller = ETLController(sys.path[0], "TRMM_etl_workspace", {
+    # plan the FTP directories to list from the missing bins
+    missing_bin_datetimes = trmm_ftp_directory_planner.getMissingBinDatetimes()
+    ftp_directories_to_process = trmm_ftp_directory_planner.getFTPDirectoriesToProcess(missing_bin_datetimes)
+    
+    # backfill mode: after an outage the bins are transformed in a process pool while a single loader loads them in timestamp order
+    backfill_bin_threshold = 16 # two days of 3-hour bins
+    etl_controller_class = ParallelTransformController if len(missing_bin_datetimes) > backfill_bin_threshold else ETLController
+    update_debug_log("etl_controller_class", etl_controller_class.__name__)
+    
+    etl_controller = etl_controller_class(sys.path[0], "TRMM_etl_workspace", {
                                   
         "remove_etl_workspace_on_finish":True
     })
     
-    # The directory for all the bins to process is dynamically created for each year based in the given start and end datetimes
-    trmm_ftp_directory = "pub/merged/mergeIRMicro/" # base directory where recent bins for the current year are stored.
-    years_between = range(1, (start_datetime.year - end_datetime.year) + 1)
-    years_between_list = [(start_datetime-timedelta(days=365 * x)).year for x in years_between]
-    ftp_directories_to_process = [trmm_ftp_directory + str(year) for year in years_between_list]
-    ftp_directories_to_process.append(trmm_ftp_directory) # append the 'recents' folder to process bins for the current year 
-    
-    trmm_etl_delegate = FTPETLDelegate({
+    trmm_etl_delegate = TRMMETLDelegate({
                                         
         "ftp_dirs":ftp_directories_to_process,
         "all_or_none_for_success":True,
@@ -230,8 +295,12 @@ def createTRMMComposities(raster_catalog, output_basepath, start_datetime, color
     # initialize request config objects -------------------------------------
     factory_specifications = {
                                               
-        "AddColormap_management_config": { # optional, comment out/delete entire key if no color map is needed          
-            "input_CLR_file":color_map
+        # "AddColormap_management_config": { # optional, not used with a color_map_renderer_config, which copies the color map with a .clr sidecar of the raster
+        #     "input_CLR_file":color_map
+        # },
+        "color_map_renderer_config": { # optional, comment out/delete entire key if no PNG quick-look and color map are needed
+            "input_CLR_file":color_map,
+            "quick_look_fullpath":""
         },
         "CopyRaster_management_config":{                              
             'config_keyword':'',
@@ -255,7 +324,9 @@ def createTRMMComposities(raster_catalog, output_basepath, start_datetime, color
     # TRMM1Day config --------------------------------------------------------------------------------
     factory_specifications_1day = deepcopy(factory_specifications)
     factory_specifications_1day['output_raster_fullpath'] = os.path.join(output_basepath, "TRMM1Day")
-    factory_specifications_1day['AddColormap_management_config']['input_CLR_file'] = "PATH TO COLORMAP\\ReferenceNode\\MapServices\\trmm_1day.clr"
+    # factory_specifications_1day['AddColormap_management_config']['input_CLR_file'] = "PATH TO COLORMAP\\ReferenceNode\\MapServices\\trmm_1day.clr"
+    factory_specifications_1day['color_map_renderer_config']['input_CLR_file'] = "PATH TO COLORMAP\\ReferenceNode\\MapServices\\trmm_1day.clr"
+    factory_specifications_1day['color_map_renderer_config']['quick_look_fullpath'] = os.path.join(sys.path[0], "TRMMQuickLooks", "TRMM1Day.png")
     input_raster_catalog_options_1day = deepcopy(input_raster_catalog_options)
     input_raster_catalog_options_1day['end_datetime'] = start_datetime - timedelta(days=1)
     trmm_1day = TRMMCustomRasterRequest({
@@ -269,7 +340,9 @@ def createTRMMComposities(raster_catalog, output_basepath, start_datetime, color
     # TRMM7Day config --------------------------------------------------------------------------------
     factory_specifications_7day = deepcopy(factory_specifications)
     factory_specifications_7day['output_raster_fullpath'] = os.path.join(output_basepath, "TRMM7Day")
-    factory_specifications_7day['AddColormap_management_config']['input_CLR_file'] = "PATH TO COLOR MAP\\ReferenceNode\\MapServices\\trmm_7day.clr"
+    # factory_specifications_7day['AddColormap_management_config']['input_CLR_file'] = "PATH TO COLOR MAP\\ReferenceNode\\MapServices\\trmm_7day.clr"
+    factory_specifications_7day['color_map_renderer_config']['input_CLR_file'] = "PATH TO COLOR MAP\\ReferenceNode\\MapServices\\trmm_7day.clr"
+    factory_specifications_7day['color_map_renderer_config']['quick_look_fullpath'] = os.path.join(sys.path[0], "TRMMQuickLooks", "TRMM7Day.png")
     input_raster_catalog_options_7day = deepcopy(input_raster_catalog_options)
     input_raster_catalog_options_7day['end_datetime'] = start_datetime - timedelta(days=7)
     trmm_7day = TRMMCustomRasterRequest({
@@ -283,7 +356,9 @@ def createTRMMComposities(raster_catalog, output_basepath, start_datetime, color
     # TRMM30Day config --------------------------------------------------------------------------------
     factory_specifications_30day = deepcopy(factory_specifications)
     factory_specifications_30day['output_raster_fullpath'] = os.path.join(output_basepath, "TRMM30Day")
-    factory_specifications_30day['AddColormap_management_config']['input_CLR_file'] = "PATH TO COLOR MAP\\ReferenceNode\\MapServices\\TRMM_30Day.clr"
+    # factory_specifications_30day['AddColormap_management_config']['input_CLR_file'] = "PATH TO COLOR MAP\\ReferenceNode\\MapServices\\TRMM_30Day.clr"
+    factory_specifications_30day['color_map_renderer_config']['input_CLR_file'] = "PATH TO COLOR MAP\\ReferenceNode\\MapServices\\TRMM_30Day.clr"
+    factory_specifications_30day['color_map_renderer_config']['quick_look_fullpath'] = os.path.join(sys.path[0], "TRMMQuickLooks", "TRMM30Day.png")
     input_raster_catalog_options_30day = deepcopy(input_raster_catalog_options)
     input_raster_catalog_options_30day['end_datetime'] = start_datetime - timedelta(days=30)
     trmm_30day = TRMMCustomRasterRequest({
@@ -304,6 +379,21 @@ def createTRMMComposities(raster_catalog, output_basepath, start_datetime, color
             'local_raster_archive_days':30, # only keep rasters local within this many days
             'raster_name_datetime_format':"t_%Y%m%d%H" # format of rasters to create a datetime object
         },
+        'rolling_accumulator_options': { # optional, comment out/delete entire key to sum every raster in each window on every run
+            'state_directory':os.path.join(sys.path[0], "TRMMRunningSums"),
+            'verify_running_sums':False # True to rebuild each running sum after updating it as a consistency check
+        },
+        # 'time_cube_options': { # optional, reads the grids from the TRMMLoader's time cube once it covers the 30-day window
+        #     'cube_directory':os.path.join(sys.path[0], "TRMMTimeCube"),
+        #     'precip_min':1
+        # },
+        'daily_accumulator_options': { # optional, comment out/delete entire key together with the TRMMLoader's daily_accumulator, sums the windows from its daily partials
+            'state_directory':os.path.join(sys.path[0], "TRMMDailyPartials"),
+            'truncate_grids':True # same as the TRMMLoader's daily_accumulator
+        },
+        # 'sparse_grid_options': { # optional, reads the grids from the TRMMTransformer's sparse grids once they cover the 30-day window
+        #     'sparse_grid_directory':os.path.join(sys.path[0], "TRMMSparseGrids")
+        # },
         'debug_logger':custom_raster_debug_logger_ref,
         'exception_handler':exception_handler_ref
     })
@@ -349,7 +439,7 @@ def main(*args, **kwargs):
 
     if is_successful_new_run:      
         
-        # refresh all services to update the data    
+        # refresh only the services that depend on the updated data    
         trmm_agsm = ArcGISServiceManager({
                                           
             'debug_logger':update_debug_log,
@@ -358,20 +448,36 @@ def main(*args, **kwargs):
             'username':'ARCGIS SERVICE MANAGER USER NAME',
             'password':'ARCGIS SERVICE MANAGER PASSWOWRD',
             'service_dir':'ReferenceNode',
-            'services':['TRMM.MapServer', 'TRMM_1DAY.MapServer', 'TRMM_7DAY.MapServer', 'TRMM_30DAY.MapServer']
+            'services':['TRMM.MapServer', 'TRMM_1DAY.MapServer', 'TRMM_7DAY.MapServer', 'TRMM_30DAY.MapServer'],
+            'service_datasets':{ # the datasets (raster catalog and N-day cumulative rasters) each service depends on
+                'TRMM.MapServer':['TRMM'],
+                'TRMM_1DAY.MapServer':['TRMM1Day'],
+                'TRMM_7DAY.MapServer':['TRMM7Day'],
+                'TRMM_30DAY.MapServer':['TRMM30Day']
+            },
+            'refresh_window_seconds':30 # refresh requests from other sources in this process within this window are coalesced
          })
         
-        update_debug_log("stopping services...")
-        trmm_agsm.stopServices()  
+        # the composite services must be stopped while their rasters are re-created
+        composite_services = trmm_agsm.getServicesForDatasets(['TRMM1Day', 'TRMM7Day', 'TRMM30Day'])
+        
+        update_debug_log("stopping services...", composite_services)
+        trmm_agsm.stopServices(composite_services)  
         
         createTRMMComposities(raster_catalog, output_basepath, start_datetime, color_map)
         
-        update_debug_log("starting services...")
-        trmm_agsm.startServices()
+        update_debug_log("starting services...", composite_services)
+        trmm_agsm.startServices(composite_services)
+        
+        trmm_agsm.refreshServicesForDatasets(['TRMM'])
         
     # delete outdated debug logs
     etl_debug_logger.deleteOutdatedDebugLogs()
+    
+    # this run is done, refresh the coalesced services now instead of waiting for the refresh window to close
+    service_refresh_coalescer.flush()
 
 
-# method called upon module execution to start the ETL process 
-main()
+# method called upon module execution to start the ETL process, guarded so the processes of the backfill pool can import this module
+if __name__ == '__main__':
+    main()
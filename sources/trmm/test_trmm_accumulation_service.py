@@ -0,0 +1,68 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+# usage: python test_trmm_accumulation_service.py
+# the ETL utils directory (grid_utils) must be on the PYTHONPATH
+
+
+# standard library
+from datetime import datetime, timedelta
+import shutil
+import tempfile
+import unittest
+
+# third-party
+import numpy as np
+
+# TRMM numpy utils
+from trmm_accumulations import TRMMDailyAccumulator
+from trmm_accumulation_service import TRMMAccumulationService
+from trmm_grid_utils import TRMMGridUtils
+
+
+class TRMMAccumulationServiceTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.state_directory = tempfile.mkdtemp()
+        random_state = np.random.RandomState(0)
+
+        # two whole days of 3-hour grids with fractional rain rates, the window starts and ends in the middle of a third and fourth day
+        first_datetime = datetime(2012, 1, 1, 0)
+        self.grids = {}
+        for grid_index in range(32):
+            grid = random_state.uniform(0, 10, (TRMMGridUtils.ROWS, TRMMGridUtils.COLS)).astype(np.float32)
+            grid[random_state.random_sample(grid.shape) < 0.5] = -319.99 # missing values
+            self.grids[first_datetime + timedelta(hours=3 * grid_index)] = grid
+
+        self.daily_accumulator = TRMMDailyAccumulator({'state_directory':self.state_directory, 'precip_min':1, 'truncate_grids':True})
+        for grid_datetime, grid in sorted(self.grids.items()):
+            self.daily_accumulator.addGrid(grid_datetime, grid)
+
+        self.accumulation_service = TRMMAccumulationService({
+            'daily_accumulator':self.daily_accumulator,
+            'grid_lister':lambda start_datetime, end_datetime: [dt for dt in sorted(self.grids) if start_datetime <= dt <= end_datetime],
+            'grid_loader':lambda grid_datetime: self.grids[grid_datetime],
+            'precip_min':1
+        })
+
+    def tearDown(self):
+
+        shutil.rmtree(self.state_directory)
+
+    def testPartialEdgeDaysEqualTruncatedGrids(self):
+
+        start_datetime, end_datetime = datetime(2012, 1, 1, 12), datetime(2012, 1, 4, 9)
+        accumulation, georeference = self.accumulation_service.getAccumulation(start_datetime, end_datetime)
+
+        window_grids = [grid for grid_datetime, grid in self.grids.items() if start_datetime <= grid_datetime < end_datetime]
+        expected_sum = sum(TRMMGridUtils.toAccumulationGrid(grid, 1, True) for grid in window_grids)
+        expected_accumulation = TRMMGridUtils.toWestEastGrid(expected_sum, 0, 0) * 3
+
+        self.assertEqual(georeference, TRMMGridUtils.WEST_EAST_GEOREFERENCE)
+        np.testing.assert_allclose(accumulation, expected_accumulation, rtol=0, atol=1e-3)
+        self.assertTrue(np.all(np.equal(np.mod(accumulation, 3), 0))) # every 3-hour grid was truncated
+
+
+if __name__ == '__main__':
+    unittest.main()
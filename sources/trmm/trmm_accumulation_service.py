@@ -0,0 +1,144 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+
+# standard library
+from collections import OrderedDict
+
+# third-party
+import numpy as np
+
+# ETL numpy utils
+from grid_utils import RasterGridWriter
+
+# TRMM numpy utils
+from trmm_grid_utils import TRMMGridUtils
+
+
+class TRMMAccumulationService(object):
+
+    """
+        Class TRMMAccumulationService computes the rainfall accumulation of any [start_datetime, end_datetime) window on demand (ex: 3-day, 14-day or event totals)
+        without a hard-coded TRMMCustomRasterRequest. This module does not depend on arcpy.
+
+        The high-level steps to compute an accumulation include:
+
+            1) list the 3-hour grids within the window
+            2) sum the TRMMDailyAccumulator's partial of every UTC day whose grids are all within the window and whose partial contains exactly those grids
+            3) add the 3-hour grids of the remaining days (the window's edges and days with an incomplete partial), truncated the same as the daily partials
+            4) multiply by 3 since each 3-hour grid is an average rate in mm/hr, then clip to the requested region
+
+        Results are kept in a least recently used cache bounded by 'max_cache_bytes' and keyed by the window, the clip region and the grids in the window,
+        so a window is recomputed once a new grid arrives within it.
+
+        service_options <dict>:
+
+            'daily_accumulator' <TRMMDailyAccumulator>: the daily partials maintained by the TRMMLoader
+            'grid_lister' <function>: called with (start_datetime, end_datetime) and returns the datetimes of the 3-hour grids within start_datetime <= datetime <= end_datetime
+            'grid_loader' <function>: called with a grid datetime and returns its 480x1440 mm/hr grid in the bin layout, NaN and missing values are added as 0
+            (ex: a TRMMTimeCube's getDatetimes and getGrid)
+            'precip_min' <float>: optional, cells of the 3-hour grids below this value are not added, same as the TRMMTransformer's precip_min, default 0
+            'max_cache_bytes' <int>: optional, the maximum size of the cached accumulations, default 256 MB
+
+        public interface:
+
+            getAccumulation(start_datetime, end_datetime, clip_extent=None) <tuple>: returns (accumulation, georeference) where accumulation is a float32 array of the rainfall in mm
+            spanning 180 W to 180 E (60 N to 60 S) and georeference is its (lower_left_x, lower_left_y, cellsize). clip_extent is an optional (min_lng, min_lat, max_lng, max_lat)
+            tuple with longitudes from -180 to 180, the accumulation is clipped to the rows and columns of the cells that intersect it. Returns (None, None) if the window has no grids.
+            writeAccumulation(start_datetime, end_datetime, raster_fullpath, raster_format='TIF', clip_extent=None, nodata_value=-9999) <str>: writes the accumulation with
+            RasterGridWriter, cells without rain are nodata_value. Returns the fullpath of the raster, None if the window has no grids.
+    """
+
+    def __init__(self, service_options):
+
+        self.daily_accumulator = service_options['daily_accumulator']
+        self.grid_lister = service_options['grid_lister']
+        self.grid_loader = service_options['grid_loader']
+        self.precip_min = service_options.get('precip_min', 0)
+        self.max_cache_bytes = service_options.get('max_cache_bytes', 256 * 1024 * 1024)
+        self.debug_logger = service_options.get('debug_logger',lambda*a,**kwa:None)
+
+        self.accumulation_cache = OrderedDict() # cache key: (accumulation, georeference) from the least to the most recently used
+        self.cache_bytes = 0
+
+    def getAccumulation(self, start_datetime, end_datetime, clip_extent=None):
+
+        grid_datetimes = [dt for dt in self.grid_lister(start_datetime, end_datetime) if start_datetime <= dt < end_datetime]
+        if not grid_datetimes:
+            return (None, None)
+
+        cache_key = (start_datetime, end_datetime, tuple(clip_extent) if clip_extent else None, tuple(sorted(grid_datetimes)))
+        if cache_key in self.accumulation_cache:
+
+            self.debug_logger("accumulation cache hit", start_datetime, end_datetime, clip_extent)
+            accumulation, georeference = self.accumulation_cache.pop(cache_key)
+            self.accumulation_cache[cache_key] = (accumulation, georeference) # most recently used
+
+            return (accumulation.copy(), georeference)
+
+        accumulation, georeference = self._clipAccumulation(self._sumWindow(grid_datetimes) * 3, clip_extent)
+        self._cacheAccumulation(cache_key, accumulation, georeference)
+
+        return (accumulation.copy(), georeference)
+
+    def writeAccumulation(self, start_datetime, end_datetime, raster_fullpath, raster_format='TIF', clip_extent=None, nodata_value=-9999):
+
+        accumulation, georeference = self.getAccumulation(start_datetime, end_datetime, clip_extent)
+        if accumulation is None:
+            return None
+
+        accumulation[accumulation == 0] = nodata_value
+
+        return RasterGridWriter.writeRaster(accumulation, raster_fullpath, raster_format, georeference, nodata_value)
+
+    def _sumWindow(self, grid_datetimes):
+
+        grid_datetimes_by_day = {}
+        for grid_datetime in grid_datetimes:
+            grid_datetimes_by_day.setdefault(grid_datetime.date(), set()).add(grid_datetime)
+
+        window_sum = np.zeros((TRMMGridUtils.ROWS, TRMMGridUtils.COLS), np.float64)
+        number_of_daily_partials, number_of_edge_grids = 0, 0
+
+        for day, day_grid_datetimes in sorted(grid_datetimes_by_day.items()):
+
+            # a partial that matches the window's grids of the day also means the whole day is within the window
+            if self.daily_accumulator.getGridDatetimes(day) == day_grid_datetimes:
+
+                window_sum += self.daily_accumulator.getDailyPartial(day)
+                number_of_daily_partials += 1
+                continue
+
+            for grid_datetime in day_grid_datetimes:
+
+                # the edge grids are truncated the same as the grids of the daily partials, so a total does not depend on which days had a partial
+                window_sum += TRMMGridUtils.toAccumulationGrid(self.grid_loader(grid_datetime), self.precip_min, self.daily_accumulator.truncate_grids)
+                number_of_edge_grids += 1
+
+        self.debug_logger("accumulation daily partials:", number_of_daily_partials, "edge grids:", number_of_edge_grids)
+
+        return TRMMGridUtils.toWestEastGrid(window_sum, 0, 0)
+
+    def _clipAccumulation(self, accumulation, clip_extent):
+
+        if not clip_extent:
+            return (accumulation, TRMMGridUtils.WEST_EAST_GEOREFERENCE)
+
+        row_slice, col_slice, georeference = TRMMGridUtils.getClipExtentSlices(clip_extent, TRMMGridUtils.WEST_EAST_GEOREFERENCE, accumulation.shape)
+
+        # copy the slice so the cache does not keep the whole grid alive
+        return (accumulation[row_slice, col_slice].copy(), georeference)
+
+    def _cacheAccumulation(self, cache_key, accumulation, georeference):
+
+        if accumulation.nbytes > self.max_cache_bytes:
+            return
+
+        self.accumulation_cache[cache_key] = (accumulation, georeference)
+        self.cache_bytes += accumulation.nbytes
+
+        while self.cache_bytes > self.max_cache_bytes:
+
+            evicted_key, (evicted_accumulation, evicted_georeference) = self.accumulation_cache.popitem(last=False)
+            self.cache_bytes -= evicted_accumulation.nbytes
+            self.debug_logger("accumulation cache evicted", evicted_key[0], evicted_key[1], evicted_key[2])
@@ -0,0 +1,343 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+
+# standard library
+from datetime import datetime, timedelta
+import os
+
+# third-party
+import numpy as np
+
+# TRMM numpy utils
+from trmm_grid_utils import TRMMGridUtils
+
+
+class TRMMRollingAccumulator(object):
+
+    """
+        Class TRMMRollingAccumulator maintains a persistent running sum of the 3-hour TRMM grids inside a named window (ex: TRMM1Day, TRMM7Day, TRMM30Day).
+        This module does not depend on arcpy, the grids are read through the given grid_loader.
+
+        The high-level steps to update a window include:
+
+            1) load the window's running sum and the names of the grids it contains from its .npz state file
+            2) add the grids that entered the window and subtract the grids that left it, so each run costs O(new + expired) instead of O(window)
+            3) save the new running sum and grid names back to the state file
+
+        A window is rebuilt from scratch when it has no state, when rebuilding is cheaper than the update or when an expired grid can no longer be loaded.
+
+        accumulator_options <dict>:
+
+            'state_directory' <str>: directory that contains a <window_name>.npz state file for each window
+            'grid_loader' <function>: called with a grid name and returns its 2D precipitation array, NoData may be returned as NaN
+
+        public interface:
+
+            updateWindow(window_name, window_grid_names) <ndarray>: updates the window to contain exactly the given grid names and returns its running sum
+            rebuildWindow(window_name, window_grid_names) <ndarray>: sums every given grid from scratch, saves it as the window's state and returns the sum (None if no grids are given)
+            verifyWindow(window_name, tolerance=0.001) <bool>: rebuilds the window's current grids in memory and returns True if the running sum matches within tolerance
+    """
+
+    def __init__(self, accumulator_options):
+
+        self.state_directory = accumulator_options['state_directory']
+        self.grid_loader = accumulator_options['grid_loader']
+        self.debug_logger = accumulator_options.get('debug_logger',lambda*a,**kwa:None)
+
+        if not os.path.isdir(self.state_directory):
+            os.makedirs(self.state_directory)
+
+    def updateWindow(self, window_name, window_grid_names):
+
+        running_sum, current_grid_names = self._loadState(window_name)
+        window_grid_names = set(window_grid_names)
+
+        new_grid_names = window_grid_names - current_grid_names
+        expired_grid_names = current_grid_names - window_grid_names
+        self.debug_logger(window_name, "new grids:", len(new_grid_names), "expired grids:", len(expired_grid_names))
+
+        if running_sum is None or (len(new_grid_names) + len(expired_grid_names)) >= len(window_grid_names):
+            return self.rebuildWindow(window_name, window_grid_names)
+
+        try:
+            for grid_name in expired_grid_names:
+                running_sum -= self._loadGrid(grid_name)
+
+        except Exception as e:
+
+            self.debug_logger(window_name, "could not subtract an expired grid, rebuilding...", str(e))
+            return self.rebuildWindow(window_name, window_grid_names)
+
+        for grid_name in new_grid_names:
+            running_sum += self._loadGrid(grid_name)
+
+        self._saveState(window_name, running_sum, window_grid_names)
+
+        return running_sum
+
+    def rebuildWindow(self, window_name, window_grid_names):
+
+        self.debug_logger(window_name, "rebuilding running sum from", len(window_grid_names), "grids")
+        running_sum = self._sumGrids(window_grid_names)
+        if running_sum is not None: # an empty window keeps its previous state
+            self._saveState(window_name, running_sum, set(window_grid_names))
+
+        return running_sum
+
+    def verifyWindow(self, window_name, tolerance=0.001):
+
+        running_sum, current_grid_names = self._loadState(window_name)
+        if running_sum is None:
+            return False
+
+        is_consistent = bool(np.allclose(running_sum, self._sumGrids(current_grid_names), rtol=0, atol=tolerance))
+        self.debug_logger(window_name, "running sum is consistent:", is_consistent)
+
+        return is_consistent
+
+    def _sumGrids(self, grid_names):
+
+        running_sum = None
+        for grid_name in grid_names:
+
+            grid = self._loadGrid(grid_name)
+            if running_sum is None:
+                running_sum = grid
+            else:
+                running_sum += grid
+
+        return running_sum
+
+    def _loadGrid(self, grid_name):
+
+        grid = np.array(self.grid_loader(grid_name), np.float64) # accumulate in float64 so repeated add/subtract does not drift
+        grid[np.isnan(grid)] = 0
+
+        return grid
+
+    def _getStateFullpath(self, window_name):
+
+        return os.path.join(self.state_directory, window_name + ".npz")
+
+    def _loadState(self, window_name):
+
+        state_fullpath = self._getStateFullpath(window_name)
+        if not os.path.isfile(state_fullpath):
+            return (None, set())
+
+        state = np.load(state_fullpath)
+        try:
+            return (state['running_sum'], set(str(grid_name) for grid_name in state['grid_names']))
+        finally:
+            state.close()
+
+    def _saveState(self, window_name, running_sum, grid_names):
+
+        _saveStateFile(self._getStateFullpath(window_name), running_sum=running_sum, grid_names=np.array(sorted(grid_names), dtype=str))
+
+
+class TRMMDailyAccumulator(object):
+
+    """
+        Class TRMMDailyAccumulator maintains a partial sum of the 3-hour TRMM grids of each UTC day, updated as each grid is loaded.
+        A multi-day window can then be summed from one daily partial per day (ex: 30 instead of 240 grids for 30 days) plus the 3-hour grids of the days at its edges.
+
+        Each day has a <YYYYMMDD>.npz state file in the state directory that contains the float64 sum of the day's grids (in the layout they were given in)
+        and the UTC seconds since 1970-01-01 of each grid in the sum, so a grid that is loaded twice is only added once. Cells below precip_min, NaN and missing
+        values are added as 0, same as the NoData cells of the catalog rasters. With 'truncate_grids' each grid is truncated to whole mm/hr before it is added,
+        same as the integer (ex: 16_BIT_UNSIGNED) catalog rasters the window edges are read from, so a window sum does not depend on which days had a partial.
+
+        accumulator_options <dict>:
+
+            'state_directory' <str>: directory of the daily partial state files, created if it does not exist
+            'precip_min' <float>: optional, cells below this value are not added to the daily partials, default 0
+            'archive_days' <int>: optional, daily partials older than this number of days are deleted whenever a new day is started
+            'truncate_grids' <bool>: optional, truncates the grids to integers before they are added, default False
+
+        public interface:
+
+            addGrid(grid_datetime, precip) <bool>: adds the grid to the partial of its UTC day, returns False if the grid is already in the partial
+            getGridDatetimes(day) <set>: returns the datetimes of the grids in the partial of the given date, an empty set if the day has no partial
+            getDailyPartial(day) <ndarray>: returns the float64 sum of the grids of the given date, None if the day has no partial
+    """
+
+    EPOCH = datetime(1970, 1, 1)
+    DAY_FORMAT = "%Y%m%d"
+
+    def __init__(self, accumulator_options):
+
+        self.state_directory = accumulator_options['state_directory']
+        self.precip_min = accumulator_options.get('precip_min', 0)
+        self.archive_days = accumulator_options.get('archive_days', None)
+        self.truncate_grids = accumulator_options.get('truncate_grids', False)
+        self.debug_logger = accumulator_options.get('debug_logger',lambda*a,**kwa:None)
+
+        if not os.path.isdir(self.state_directory):
+            os.makedirs(self.state_directory)
+
+    def addGrid(self, grid_datetime, precip):
+
+        day = grid_datetime.date()
+        timestamps = self._loadTimestamps(day)
+        timestamp = self._toTimestamp(grid_datetime)
+
+        if timestamp in timestamps:
+            self.debug_logger("grid is already in the daily partial", grid_datetime)
+            return False
+
+        grid = TRMMGridUtils.toAccumulationGrid(precip, self.precip_min, self.truncate_grids)
+
+        daily_sum = self.getDailyPartial(day)
+        if daily_sum is None:
+            daily_sum = grid
+            self._deleteOutdatedDailyPartials(day)
+        else:
+            daily_sum += grid
+
+        timestamps = np.append(timestamps, timestamp)
+        _saveStateFile(self._getStateFullpath(day), daily_sum=daily_sum, grid_timestamps=np.sort(timestamps))
+        self.debug_logger("daily partial", day, "grids:", len(timestamps))
+
+        return True
+
+    def getGridDatetimes(self, day):
+
+        return set(self.EPOCH + timedelta(seconds=int(t)) for t in self._loadTimestamps(day))
+
+    def getDailyPartial(self, day):
+
+        return self._loadStateArray(day, 'daily_sum')
+
+    def _loadTimestamps(self, day):
+
+        timestamps = self._loadStateArray(day, 'grid_timestamps')
+
+        return np.zeros(0, np.int64) if timestamps is None else timestamps
+
+    def _loadStateArray(self, day, array_name):
+
+        state_fullpath = self._getStateFullpath(day)
+        if not os.path.isfile(state_fullpath):
+            return None
+
+        # the arrays of a .npz are read on access, reading the timestamps does not read the daily sum
+        state = np.load(state_fullpath)
+        try:
+            return state[array_name]
+        finally:
+            state.close()
+
+    def _deleteOutdatedDailyPartials(self, day):
+
+        if not self.archive_days:
+            return
+
+        archive_day_name = (day - timedelta(days=self.archive_days)).strftime(self.DAY_FORMAT)
+        for state_file in os.listdir(self.state_directory):
+
+            day_name, extension = os.path.splitext(state_file)
+            if extension == ".npz" and len(day_name) == 8 and day_name.isdigit() and day_name < archive_day_name:
+
+                self.debug_logger("deleting daily partial", state_file)
+                os.remove(os.path.join(self.state_directory, state_file))
+
+    def _getStateFullpath(self, day):
+
+        return os.path.join(self.state_directory, day.strftime(self.DAY_FORMAT) + ".npz")
+
+    def _toTimestamp(self, grid_datetime):
+
+        time_delta = grid_datetime - self.EPOCH
+
+        return time_delta.days * 86400 + time_delta.seconds
+
+
+class TRMMWindowAccumulator(object):
+
+    """
+        Class TRMMWindowAccumulator sums the 3-hour TRMM grids of several windows (ex: nested 1, 7 and 30-day windows) in a single pass.
+
+        The high-level steps to accomplish this task include:
+
+            1) sort the grids from newest to oldest
+            2) add each grid once to a prefix sum and copy the prefix sum at every window boundary it crosses
+            3) return each window's sum as the difference of the prefix sums at its boundaries
+
+        Since windows that end at the newest grid have a zero prefix sum at their newer boundary, nested windows cost one grid load each plus a copy per window.
+
+        public interface:
+
+            sumWindows(grid_names_with_datetimes, windows, grid_loader) <dict>: returns {window_name: sum} for the given list of (window_name, start_datetime, end_datetime) windows.
+            The window contains every grid whose datetime is <= start_datetime and >= end_datetime, a window without grids has a sum of None.
+            grid_loader is called once with each grid name and returns its 2D precipitation array, NoData may be returned as NaN.
+    """
+
+    @staticmethod
+    def sumWindows(grid_names_with_datetimes, windows, grid_loader):
+
+        # boundaries are (datetime, is_inclusive, window_name) where the prefix sum is taken before adding the first grid older than
+        # the boundary (inclusive) or older than or equal to it (exclusive)
+        boundaries = [(end_datetime, True, window_name) for window_name, start_datetime, end_datetime in windows]
+        boundaries += [(start_datetime, False, window_name) for window_name, start_datetime, end_datetime in windows]
+        boundaries.sort(key=lambda b: b[0], reverse=True)
+
+        prefix_sum, prefix_count = None, 0
+        prefix_sums = {} # (window_name, is_inclusive): (number of grids, prefix sum) at the boundary
+        boundary_index = 0
+
+        for grid_name, grid_datetime in sorted(grid_names_with_datetimes, key=lambda g: g[1], reverse=True):
+
+            while boundary_index < len(boundaries) and TRMMWindowAccumulator._isBoundaryCrossed(boundaries[boundary_index], grid_datetime):
+
+                boundary_datetime, is_inclusive, window_name = boundaries[boundary_index]
+                prefix_sums[(window_name, is_inclusive)] = (prefix_count, None if prefix_sum is None else prefix_sum.copy())
+                boundary_index += 1
+
+            if boundary_index == len(boundaries):
+                break # the remaining grids are older than every window
+
+            grid = np.array(grid_loader(grid_name), np.float64)
+            grid[np.isnan(grid)] = 0
+
+            if prefix_sum is None:
+                prefix_sum = grid
+            else:
+                prefix_sum += grid
+            prefix_count += 1
+
+        for boundary_datetime, is_inclusive, window_name in boundaries[boundary_index:]:
+            prefix_sums[(window_name, is_inclusive)] = (prefix_count, prefix_sum) # no copy is needed since the prefix sum does not change anymore
+
+        window_sums = {}
+        for window_name, start_datetime, end_datetime in windows:
+
+            older_count, older_prefix_sum = prefix_sums[(window_name, True)]
+            newer_count, newer_prefix_sum = prefix_sums[(window_name, False)]
+
+            if older_count == newer_count:
+                window_sums[window_name] = None
+            elif newer_count == 0:
+                window_sums[window_name] = older_prefix_sum
+            else:
+                window_sums[window_name] = older_prefix_sum - newer_prefix_sum
+
+        return window_sums
+
+    @staticmethod
+    def _isBoundaryCrossed(boundary, grid_datetime):
+
+        boundary_datetime, is_inclusive, window_name = boundary
+
+        return (grid_datetime < boundary_datetime) if is_inclusive else (grid_datetime <= boundary_datetime)
+
+
+def _saveStateFile(state_fullpath, **state_arrays):
+
+    # write to a temp file first so an interrupted run never leaves a partially written state behind
+    temp_state_fullpath = state_fullpath + ".tmp.npz"
+    np.savez(temp_state_fullpath, **state_arrays)
+
+    if os.path.isfile(state_fullpath):
+        os.remove(state_fullpath)
+    os.rename(temp_state_fullpath, state_fullpath)
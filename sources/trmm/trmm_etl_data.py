@@ -0,0 +1,41 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+
+# ETL framework
+from etl_data import FTPETLData
+
+# TRMM numpy utils
+from trmm_grid_utils import TRMMGridUtils
+
+
+class TRMMETLData(FTPETLData):
+    
+    """
+        TRMMETLData overrides ETLData so that the additional property precipitation_grid can be
+        shared between the TRMMTransformer and TRMMLoader. This property is the bin's 480x1440 
+        float32 precipitation grid (mm/hr) and is used to append the bin to the TRMMTimeCube.
+        
+        A bin transformed in another process sets its bin file as the source of the grid instead, the grid is read from it on the first getPrecipitationGrid().
+    """
+
+    def __init__(self):
+        FTPETLData.__init__(self)
+        
+        self.precipitation_grid = None
+        self.precipitation_grid_source = None
+    
+    def setPrecipitationGrid(self, precipitation_grid):
+        self.precipitation_grid = precipitation_grid
+        self.precipitation_grid_source = None
+        
+    def setPrecipitationGridSource(self, bin_fullpath):
+        self.precipitation_grid = None
+        self.precipitation_grid_source = bin_fullpath
+    
+    def getPrecipitationGrid(self):
+        
+        if self.precipitation_grid is None and self.precipitation_grid_source:
+            self.precipitation_grid = TRMMGridUtils.readBinFile(self.precipitation_grid_source)[1]
+            
+        return self.precipitation_grid
@@ -0,0 +1,30 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+# ETL framework
+from etl_delegate import FTPETLDelegate
+from trmm_etl_data import TRMMETLData
+
+
+class TRMMETLDelegate(FTPETLDelegate):
+    
+    """
+        Class TRMMETLDelegate overrides FTPETLDelegate._createFTPETLDataToProcessList 
+        in order to create a TRMMETLData for each bin
+    """
+                
+    def __init__(self, etl_config):
+        FTPETLDelegate.__init__(self, etl_config)
+        
+    def _createFTPETLDataToProcessList(self, validated_bin_list, ftp_directory):
+        
+        trmm_etl_data_to_process_list = []
+        for bin_file in validated_bin_list:  
+
+            trmm_data = TRMMETLData()
+            trmm_data.setFTPDirectory(ftp_directory)
+            trmm_data.setETLDataName(bin_file)            
+            trmm_data.setDataToExtract(bin_file)  
+            trmm_etl_data_to_process_list.append(trmm_data)
+            
+        return trmm_etl_data_to_process_list
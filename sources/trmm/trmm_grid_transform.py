@@ -0,0 +1,67 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+
+# standard library
+import os
+
+# third-party
+import numpy as np
+
+# ETL numpy utils
+from grid_utils import RasterStatistics
+
+# TRMM numpy utils
+from trmm_grid_utils import TRMMGridUtils
+from trmm_sparse_grid import TRMMSparseGrid
+
+
+def transformGridOutputs(precip, precip_min, sparse_grid_fullpath=None, raster_statistics_config=None):
+
+    """
+        Writes the optional outputs of a transformed TRMM grid and returns its band statistics, shared by the TRMMTransformer and transformBinToRaster
+        so a bin transformed in a multiprocessing.Pool worker gets the same outputs as one transformed in the ETL process. This module does not depend on arcpy.
+
+            1) saves the cells >= precip_min as a TRMMSparseGrid if a sparse_grid_fullpath is given
+            2) computes the RasterStatistics of the raster's cells (the cells >= precip_min) if a raster_statistics_config is given, with 'truncate_values'
+               the cells are truncated to integers first, same as the values of a raster catalog with an integer pixel_type (ex: 16_BIT_UNSIGNED)
+
+        Returns the list of RasterStatistics of the raster's band, None without a raster_statistics_config.
+    """
+
+    if sparse_grid_fullpath:
+        TRMMSparseGrid.fromGrid(precip, precip_min).save(sparse_grid_fullpath)
+
+    if not raster_statistics_config:
+        return None
+
+    # the raster only has the cells >= precip_min, which also leaves out the missing cells
+    rsc = raster_statistics_config
+    raster_values = precip[precip >= precip_min]
+    if rsc.get('truncate_values', False):
+        raster_values = np.trunc(raster_values)
+
+    return [RasterStatistics.fromArray(raster_values, None, rsc.get('histogram_bins', 256), rsc.get('histogram_range', None))]
+
+
+def transformBinToRaster(transform_job):
+
+    """
+        transform_job is a tuple of (bin_to_process, raster_fullpath, raster_format, precip_min, nodata_value, spatial_reference, sparse_grid_fullpath, raster_statistics_config),
+        the last two are None if the outputs of transformGridOutputs are not needed. Returns a tuple of (raster, header_string, band_statistics, exception) where exception
+        is None if the bin was transformed. Only these are returned since sending the grid back to the ETL process costs more than reading the bin again where it is needed.
+        Exceptions are returned instead of raised so a single bad bin does not stop the other jobs of a multiprocessing.Pool.
+    """
+
+    bin_to_process, raster_fullpath, raster_format, precip_min, nodata_value, spatial_reference, sparse_grid_fullpath, raster_statistics_config = transform_job
+
+    try:
+        header_string, precip = TRMMGridUtils.readBinFile(bin_to_process)
+        raster = TRMMGridUtils.writeRaster(precip, raster_fullpath, raster_format, precip_min, nodata_value, spatial_reference)
+        band_statistics = transformGridOutputs(precip, precip_min, sparse_grid_fullpath, raster_statistics_config)
+
+        return (raster, header_string, band_statistics, None)
+
+    except Exception as e:
+
+        return (None, None, None, "%s: %s" % (os.path.basename(bin_to_process), e))
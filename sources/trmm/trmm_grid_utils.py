@@ -0,0 +1,151 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+# For more information on the TRMM bin format visit:
+# ftp://trmmopen.gsfc.nasa.gov/pub/merged/3B4XRT_doc.pdf
+
+
+# third-party
+import numpy as np
+
+# ETL numpy utils
+from grid_utils import RasterGridWriter
+
+
+class TRMMGridUtils(object):
+
+    """
+        Class TRMMGridUtils contains the numpy operations performed on a TRMM 3-hour bin and its 0.25 degree precipitation grid.
+        This module does not depend on arcpy so it can be used (and benchmarked) outside of an ArcGIS environment.
+
+        The grid has 480 rows (59.875 N to 59.875 S) and 1440 columns (0.125 E to 359.875 E), each value is the cell center.
+
+        public interface:
+
+            readBinFile(bin_to_process) <tuple>: returns the (header_string, precip) of the given bin where precip is a 480x1440 float32 array in mm/hr
+            getCellCenterCoordinates() <tuple>: returns the (lat, lng) cell center vectors of the grid rows and columns
+            writePrecipitationCSV(precip, precip_min, csv_fullpath) <str>: writes a lat,long,precipitation row for every cell >= precip_min to the given csv_fullpath
+            toWestEastGrid(precip, precip_min, nodata_value) <ndarray>: returns a float32 copy of the grid spanning 180 W to 180 E with every cell < precip_min set to nodata_value
+            writeRaster(precip, raster_fullpath, raster_format, precip_min, nodata_value, spatial_reference=None) <str>: writes the toWestEastGrid of precip with RasterGridWriter
+            toAccumulationGrid(precip, precip_min=0, truncate=False) <ndarray>: returns a float64 copy of the grid to add to a sum, every cell < precip_min (including NaN
+            and missing values) set to 0 and, with truncate, the other cells truncated to integers the same as the cells of an integer (ex: 16_BIT_UNSIGNED) catalog raster
+            getClipExtentSlices(clip_extent, georeference, shape) <tuple>: returns the (row_slice, col_slice, clipped_georeference) of the cells of a grid with the given
+            (lower_left_x, lower_left_y, cellsize) georeference and (rows, cols) shape that intersect clip_extent, a (min_lng, min_lat, max_lng, max_lat) sequence
+    """
+
+    ROWS, COLS, CELLSIZE = 480, 1440, 0.25
+    HEADER_BYTE_LENGTH = 2880
+    PRECIP_SCALE_FACTOR = 100.0
+
+    # (lower_left_x, lower_left_y, cellsize) of the grid returned by toWestEastGrid
+    WEST_EAST_GEOREFERENCE = (-180.0, -60.0, CELLSIZE)
+
+    @staticmethod
+    def readBinFile(bin_to_process):
+
+        """
+            This method reads the header from the first HEADER_BYTE_LENGTH bytes of the bin and maps the big-endian int16
+            payload behind it with np.memmap, so the payload is never copied into a string. The int16 to float32 conversion
+            and the scaling to mm/hr happen in a single ufunc call that produces the only in-memory copy of the grid.
+        """
+
+        header_byte_length = TRMMGridUtils.HEADER_BYTE_LENGTH
+
+        with open(bin_to_process,'rb') as bin_file:
+
+            # split by the last key's value to remove the padding, then re-concat the value
+            header_string = str(bin_file.read(header_byte_length).split("=LAST")[0]+"=LAST")
+
+        raw_precip = np.memmap(bin_to_process, dtype='>i2', mode='r', offset=header_byte_length, shape=(TRMMGridUtils.ROWS, TRMMGridUtils.COLS))
+        precip = np.divide(raw_precip, np.float32(TRMMGridUtils.PRECIP_SCALE_FACTOR), dtype=np.float32)
+        del raw_precip # release the file mapping so the bin can be removed from the workspace
+
+        return (header_string, np.asarray(precip))
+
+    @staticmethod
+    def getCellCenterCoordinates():
+
+        cellsize = TRMMGridUtils.CELLSIZE
+        lat = 59.875 - cellsize * np.arange(TRMMGridUtils.ROWS, dtype=float) # north-south extent
+        lng = 0.125 + cellsize * np.arange(TRMMGridUtils.COLS, dtype=float) # east-west extent
+
+        return (lat, lng)
+
+    @staticmethod
+    def writePrecipitationCSV(precip, precip_min, csv_fullpath):
+
+        """
+            This method writes the cells of the given precip grid that are >= precip_min to the given csv_fullpath.
+
+            Every coordinate and precipitation value is written with the '%g' format. Since the grid only has 480 latitudes,
+            1440 longitudes and a few thousand distinct precipitation values, each distinct value is formatted once and the
+            rows are assembled with vectorized string operations before a single bulk write.
+        """
+
+        row_index, col_index = np.nonzero(precip >= precip_min) # row-major order, same as iterating with np.ndindex
+        precip_values, precip_value_index = np.unique(precip[row_index, col_index], return_inverse=True)
+
+        formatValues = lambda values: np.array(['%g' % v for v in values] or [''])
+        lat, lng = TRMMGridUtils.getCellCenterCoordinates()
+        lat_strings, lng_strings, precip_strings = formatValues(lat), formatValues(lng), formatValues(precip_values)
+
+        csv_rows = np.char.add(np.char.add(lat_strings[row_index], ','), lng_strings[col_index])
+        csv_rows = np.char.add(np.char.add(csv_rows, ','), precip_strings[precip_value_index])
+
+        csv_rows = csv_rows.tolist()
+        with open(csv_fullpath, "w") as out_csv:
+            out_csv.write('lat,long,precipitation\n')
+            if csv_rows:
+                out_csv.write('\n'.join(csv_rows) + '\n')
+
+        return csv_fullpath
+
+    @staticmethod
+    def toWestEastGrid(precip, precip_min, nodata_value):
+
+        # the bin's first column is 0.125 E, rolling by half the columns moves 180.125 E (179.875 W) to the first column
+        west_east_precip = np.roll(precip, TRMMGridUtils.COLS // 2, axis=1).astype(np.float32)
+
+        # cells below precip_min (including the -319.99 missing data flag) had no point in the CSV and were NoData in the raster
+        west_east_precip[west_east_precip < precip_min] = nodata_value
+
+        return west_east_precip
+
+    @staticmethod
+    def writeRaster(precip, raster_fullpath, raster_format, precip_min, nodata_value, spatial_reference=None):
+
+        west_east_precip = TRMMGridUtils.toWestEastGrid(precip, precip_min, nodata_value)
+
+        return RasterGridWriter.writeRaster(west_east_precip, raster_fullpath, raster_format, TRMMGridUtils.WEST_EAST_GEOREFERENCE, nodata_value, spatial_reference)
+
+    @staticmethod
+    def toAccumulationGrid(precip, precip_min=0, truncate=False):
+
+        accumulation_grid = np.array(precip, np.float64)
+        accumulation_grid[~(accumulation_grid >= precip_min)] = 0 # also sets NaN to 0
+        if truncate:
+            np.trunc(accumulation_grid, accumulation_grid)
+
+        return accumulation_grid
+
+    @staticmethod
+    def getClipExtentSlices(clip_extent, georeference, shape):
+
+        min_lng, min_lat, max_lng, max_lat = [float(v) for v in clip_extent]
+        lower_left_x, lower_left_y, cellsize = georeference
+        rows, cols = shape
+        upper_left_y = lower_left_y + rows * cellsize
+
+        # the rows and columns of every cell that intersects the extent, rounded so a coordinate on a cell edge does not add a cell
+        toCell = lambda distance: round(distance / cellsize, 6)
+        col_start = max(int(np.floor(toCell(min_lng - lower_left_x))), 0)
+        col_stop = min(int(np.ceil(toCell(max_lng - lower_left_x))), cols)
+        row_start = max(int(np.floor(toCell(upper_left_y - max_lat))), 0)
+        row_stop = min(int(np.ceil(toCell(upper_left_y - min_lat))), rows)
+
+        if col_start >= col_stop or row_start >= row_stop:
+            raise ValueError("clip_extent %s is outside of the TRMM grid" % " ".join(str(v) for v in clip_extent))
+
+        clipped_georeference = (lower_left_x + col_start * cellsize, lower_left_y + (rows - row_stop) * cellsize, cellsize)
+
+        return (slice(row_start, row_stop), slice(col_start, col_stop), clipped_georeference)
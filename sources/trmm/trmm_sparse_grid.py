@@ -0,0 +1,94 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+
+# standard library
+import os
+from datetime import datetime
+
+# third-party
+import numpy as np
+
+# TRMM numpy utils
+from trmm_grid_utils import TRMMGridUtils
+
+
+class TRMMSparseGrid(object):
+
+    """
+        Class TRMMSparseGrid stores only the raining cells of a TRMM grid: the flat (row-major) indices of the cells >= precip_min
+        and their values in hundredths of mm/hr as int16, saved to a compressed .npz. Since most of the globe has no rain in a 3-hour
+        window, a sparse grid is typically an order of magnitude smaller than the raster. This module does not depend on arcpy.
+
+        The grid keeps the layout it was created from (the bin layout for grids created at transform time).
+
+        public interface:
+
+            fromGrid(precip, precip_min) <TRMMSparseGrid>: creates a sparse grid of the cells of the given mm/hr grid that are >= precip_min
+            load(sparse_grid_fullpath) <TRMMSparseGrid>: loads a sparse grid saved with save()
+            save(sparse_grid_fullpath) <str>: saves the sparse grid as a compressed .npz and returns its fullpath
+            densify(fill_value=0) <ndarray>: returns the float32 mm/hr grid with every dry cell set to fill_value
+            deleteOutdatedGrids(sparse_grid_directory, sparse_grid_name_format, archive_date) <list>: deletes the .npz files whose name parses with the given datetime
+            format (in any case) to a datetime before archive_date and returns their fullpaths, the other files of the directory are left untouched
+    """
+
+    def __init__(self, flat_indices, values, shape):
+
+        self.flat_indices = flat_indices
+        self.values = values
+        self.shape = tuple(shape)
+
+    @staticmethod
+    def fromGrid(precip, precip_min):
+
+        precip = np.asarray(precip)
+        flat_indices = np.flatnonzero(precip >= precip_min).astype(np.int32)
+        values = np.rint(precip.ravel()[flat_indices] * TRMMGridUtils.PRECIP_SCALE_FACTOR).astype(np.int16)
+
+        return TRMMSparseGrid(flat_indices, values, precip.shape)
+
+    @staticmethod
+    def load(sparse_grid_fullpath):
+
+        sparse_grid_file = np.load(sparse_grid_fullpath)
+        try:
+            return TRMMSparseGrid(sparse_grid_file['flat_indices'], sparse_grid_file['values'], sparse_grid_file['shape'])
+        finally:
+            sparse_grid_file.close()
+
+    def save(self, sparse_grid_fullpath):
+
+        np.savez_compressed(sparse_grid_fullpath, flat_indices=self.flat_indices, values=self.values, shape=np.array(self.shape))
+
+        return sparse_grid_fullpath
+
+    def densify(self, fill_value=0):
+
+        precip = np.empty(self.shape, np.float32)
+        precip.fill(fill_value)
+        precip.ravel()[self.flat_indices] = self.values / np.float32(TRMMGridUtils.PRECIP_SCALE_FACTOR)
+
+        return precip
+
+    @staticmethod
+    def deleteOutdatedGrids(sparse_grid_directory, sparse_grid_name_format, archive_date):
+
+        deleted_sparse_grids = []
+        for sparse_grid_file in os.listdir(sparse_grid_directory):
+
+            sparse_grid_name, extension = os.path.splitext(sparse_grid_file)
+            if extension != ".npz":
+                continue
+
+            try:
+                sparse_grid_datetime = datetime.strptime(sparse_grid_name, sparse_grid_name_format) # strptime matches the literal characters in any case
+            except ValueError:
+                continue
+
+            if sparse_grid_datetime < archive_date:
+
+                sparse_grid_fullpath = os.path.join(sparse_grid_directory, sparse_grid_file)
+                os.remove(sparse_grid_fullpath)
+                deleted_sparse_grids.append(sparse_grid_fullpath)
+
+        return deleted_sparse_grids
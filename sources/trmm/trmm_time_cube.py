@@ -0,0 +1,207 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+
+# standard library
+from datetime import datetime, timedelta
+import os
+
+# third-party
+import numpy as np
+
+# TRMM numpy utils
+from trmm_grid_utils import TRMMGridUtils
+
+
+class TRMMTimeCube(object):
+
+    """
+        Class TRMMTimeCube is a store of the loaded TRMM 3-hour grids, memory-mapped as a (time x 480 x 1440) int16 cube.
+        This module does not depend on arcpy so the cube can be queried outside of an ArcGIS environment.
+
+        Without 'archive_days' every grid is appended. With 'archive_days' the cube is a ring buffer of archive_days * 8 grids: once it is full,
+        the oldest grid is overwritten by each new grid so the cube files stop growing (about 11 MB per day of grids).
+
+        The cube directory contains two files:
+
+            precipitation.dat: the grids in their native bin layout (59.875 N to 59.875 S, 0.125 E to 359.875 E), in hundredths of mm/hr as little-endian int16
+            timestamps.dat: the little-endian int64 UTC seconds since 1970-01-01 of each grid, in the order of the grids in precipitation.dat
+
+        A grid is written before its timestamp, so a run that is interrupted mid-append leaves no partial grid in the cube. The timestamp of an overwritten
+        grid is set to EMPTY_TIMESTAMP before the grid is overwritten, so an interrupted overwrite leaves an empty slot that the next append reuses.
+        Missing values (the bin's -31999 flag) are returned as NaN.
+
+        cube_options <dict>:
+
+            'cube_directory' <str>: directory of the cube files, created if it does not exist
+            'archive_days' <int>: optional, the number of days of 3-hour grids kept in the cube, default None (every grid is kept)
+
+        public interface:
+
+            append(grid_datetime, precip) <bool>: appends the given 480x1440 mm/hr grid, returns False if a grid with the same datetime is already in the cube
+            or if the cube is full and the grid is older than every grid in it
+            getDatetimes(start_datetime, end_datetime) <list>: returns the sorted datetimes of the grids within start_datetime <= datetime <= end_datetime
+            getGrid(grid_datetime) <ndarray>: returns the 480x1440 float32 mm/hr grid of the given datetime
+            getPixelSeries(lat, lng, start_datetime, end_datetime) <tuple>: returns (datetimes, values) of the cell containing the given point
+            getBoundingBoxSeries(min_lng, min_lat, max_lng, max_lat, start_datetime, end_datetime) <tuple>: returns (datetimes, grids) where grids
+            is a (time x rows x cols) float32 array of the cells intersecting the bounding box. Longitudes are given from -180 to 180 or 0 to 360,
+            a bounding box that crosses the antimeridian or the prime meridian is supported.
+    """
+
+    MISSING_VALUE = -31999
+    EMPTY_TIMESTAMP = -1 # the timestamp of a slot whose grid is being overwritten
+    GRIDS_PER_DAY = 8
+    EPOCH = datetime(1970, 1, 1)
+
+    def __init__(self, cube_options):
+
+        self.cube_directory = cube_options['cube_directory']
+        self.archive_days = cube_options.get('archive_days', None)
+        self.debug_logger = cube_options.get('debug_logger',lambda*a,**kwa:None)
+
+        self.precipitation_fullpath = os.path.join(self.cube_directory, "precipitation.dat")
+        self.timestamps_fullpath = os.path.join(self.cube_directory, "timestamps.dat")
+        self.grid_shape = (TRMMGridUtils.ROWS, TRMMGridUtils.COLS)
+
+        if not os.path.isdir(self.cube_directory):
+            os.makedirs(self.cube_directory)
+
+    def append(self, grid_datetime, precip):
+
+        timestamps = self._getTimestamps()
+        timestamp = self._toTimestamp(grid_datetime)
+
+        if timestamp in timestamps:
+            self.debug_logger("grid is already in the time cube", grid_datetime)
+            return False
+
+        raw_precip = np.asarray(np.rint(np.asarray(precip, np.float64) * TRMMGridUtils.PRECIP_SCALE_FACTOR), '<i2')
+        capacity = self.archive_days * self.GRIDS_PER_DAY if self.archive_days else None
+
+        if capacity is None or len(timestamps) < capacity:
+
+            self._writeAt(self.precipitation_fullpath, len(timestamps) * raw_precip.nbytes, raw_precip.tostring())
+            self._writeAt(self.timestamps_fullpath, len(timestamps) * 8, np.array([timestamp], '<i8').tostring())
+
+            return True
+
+        # the cube is full, overwrite the slot of the oldest grid (or a slot left empty by an interrupted overwrite)
+        slot = int(np.argmin(timestamps))
+        if timestamps[slot] != self.EMPTY_TIMESTAMP and timestamp < timestamps[slot]:
+            self.debug_logger("grid is older than every grid in the full time cube", grid_datetime)
+            return False
+
+        self.debug_logger("overwriting time cube grid", self._toDatetime(timestamps[slot]), "with", grid_datetime)
+        self._writeAt(self.timestamps_fullpath, slot * 8, np.array([self.EMPTY_TIMESTAMP], '<i8').tostring(), truncate=False)
+        self._writeAt(self.precipitation_fullpath, slot * raw_precip.nbytes, raw_precip.tostring(), truncate=False)
+        self._writeAt(self.timestamps_fullpath, slot * 8, np.array([timestamp], '<i8').tostring(), truncate=False)
+
+        return True
+
+    def getDatetimes(self, start_datetime, end_datetime):
+
+        cube_indices, timestamps = self._getCubeIndices(start_datetime, end_datetime)
+
+        return [self._toDatetime(t) for t in timestamps]
+
+    def getGrid(self, grid_datetime):
+
+        timestamps = self._getTimestamps()
+        cube_index = np.nonzero(timestamps == self._toTimestamp(grid_datetime))[0]
+        if not len(cube_index):
+            raise KeyError("no grid in the time cube for %s" % grid_datetime)
+
+        return self._toPrecipitation(self._getCube(len(timestamps))[cube_index[0]])
+
+    def getPixelSeries(self, lat, lng, start_datetime, end_datetime):
+
+        datetimes, grids = self.getBoundingBoxSeries(lng, lat, lng, lat, start_datetime, end_datetime)
+
+        return (datetimes, grids[:, 0, 0])
+
+    def getBoundingBoxSeries(self, min_lng, min_lat, max_lng, max_lat, start_datetime, end_datetime):
+
+        row_slice = self._getRowSlice(min_lat, max_lat)
+        col_indices = self._getColIndices(min_lng, max_lng)
+        cube_indices, timestamps = self._getCubeIndices(start_datetime, end_datetime)
+
+        if len(cube_indices):
+            # fancy indexing the time axis of the memory map only reads the selected rows of the selected grids
+            grids = self._getCube(len(self._getTimestamps()))[cube_indices, row_slice][:, :, col_indices]
+        else:
+            grids = np.zeros((0, row_slice.stop - row_slice.start, len(col_indices)), '<i2')
+
+        return ([self._toDatetime(t) for t in timestamps], self._toPrecipitation(grids))
+
+    def _getRowSlice(self, min_lat, max_lat):
+
+        max_extent = TRMMGridUtils.ROWS * TRMMGridUtils.CELLSIZE / 2
+        if not (-max_extent <= min_lat <= max_lat <= max_extent):
+            raise ValueError("latitudes must be within %s and %s with min_lat <= max_lat" % (-max_extent, max_extent))
+
+        getRow = lambda lat: min(int((max_extent - lat) // TRMMGridUtils.CELLSIZE), TRMMGridUtils.ROWS - 1)
+
+        return slice(getRow(max_lat), getRow(min_lat) + 1)
+
+    def _getColIndices(self, min_lng, max_lng):
+
+        getCol = lambda lng: int((lng % 360.0) // TRMMGridUtils.CELLSIZE)
+        min_col, max_col = getCol(min_lng), getCol(max_lng)
+
+        if max_col < min_col: # the bounding box crosses the first column of the grid
+            max_col += TRMMGridUtils.COLS
+
+        return np.arange(min_col, max_col + 1) % TRMMGridUtils.COLS
+
+    def _getCubeIndices(self, start_datetime, end_datetime):
+
+        # returns the cube indices and timestamps of the grids in the datetime range sorted by time
+        timestamps = self._getTimestamps()
+        start_timestamp, end_timestamp = self._toTimestamp(start_datetime), self._toTimestamp(end_datetime)
+
+        cube_indices = np.nonzero((timestamps >= start_timestamp) & (timestamps <= end_timestamp) & (timestamps != self.EMPTY_TIMESTAMP))[0]
+        cube_indices = cube_indices[np.argsort(timestamps[cube_indices], kind='mergesort')]
+
+        return (cube_indices, timestamps[cube_indices])
+
+    def _getTimestamps(self):
+
+        if not os.path.isfile(self.timestamps_fullpath):
+            return np.zeros(0, '<i8')
+
+        # ignore a trailing partial timestamp left by an interrupted append
+        number_of_timestamps = os.path.getsize(self.timestamps_fullpath) // 8
+
+        return np.fromfile(self.timestamps_fullpath, '<i8', number_of_timestamps)
+
+    def _getCube(self, number_of_grids):
+
+        return np.memmap(self.precipitation_fullpath, '<i2', 'r', shape=(number_of_grids,) + self.grid_shape)
+
+    def _toPrecipitation(self, raw_precip):
+
+        precip = np.divide(raw_precip, np.float32(TRMMGridUtils.PRECIP_SCALE_FACTOR), dtype=np.float32)
+        precip[raw_precip == self.MISSING_VALUE] = np.nan
+
+        return precip
+
+    def _toTimestamp(self, grid_datetime):
+
+        time_delta = grid_datetime - self.EPOCH
+
+        return time_delta.days * 86400 + time_delta.seconds
+
+    def _toDatetime(self, timestamp):
+
+        return self.EPOCH + timedelta(seconds=int(timestamp))
+
+    def _writeAt(self, file_fullpath, offset, data_string, truncate=True):
+
+        with open(file_fullpath, 'r+b' if os.path.isfile(file_fullpath) else 'wb') as cube_file:
+
+            cube_file.seek(offset)
+            cube_file.write(data_string)
+
+            # an append overwrites anything after the offset that was left by an interrupted append, an overwrite of a slot keeps the following slots
+            if truncate:
+                cube_file.truncate()
@@ -0,0 +1,146 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+# Benchmarks the TRMM bin transform on synthetic bins. It does not depend on arcpy.
+#
+# usage: python trmm_transform_benchmark.py [number_of_bins] [rain_fraction]
+# the ETL utils directory (grid_utils) must be on the PYTHONPATH
+
+
+# --------------- Imports -------------------------------------
+# standard-library
+from datetime import datetime, timedelta
+import tempfile
+import shutil
+import time
+import os
+import sys
+
+# third-party
+import numpy as np
+
+# ETL numpy utils
+from grid_utils import RasterGridWriter
+
+# TRMM numpy utils
+from trmm_grid_utils import TRMMGridUtils
+
+
+def createSyntheticBin(bin_fullpath, bin_datetime, rain_fraction, random_state):
+
+    rows, cols = TRMMGridUtils.ROWS, TRMMGridUtils.COLS
+
+    # header of key=value pairs padded to the fixed header length, terminated by the last key's value
+    header_string = " ".join([
+        "algorithm_ID=3B42RT", "algorithm_version=7", "granule_ID=%s" % os.path.basename(bin_fullpath),
+        "header_byte_length=%s" % TRMMGridUtils.HEADER_BYTE_LENGTH, "file_byte_length=%s" % (TRMMGridUtils.HEADER_BYTE_LENGTH + rows * cols * 2),
+        "nominal_YYYYMMDD=%s" % bin_datetime.strftime('%Y%m%d'), "nominal_HHMMSS=%s" % bin_datetime.strftime('%H%M%S'),
+        "begin_YYYYMMDD=%s" % bin_datetime.strftime('%Y%m%d'), "begin_HHMMSS=%s" % (bin_datetime - timedelta(minutes=90)).strftime('%H%M%S'),
+        "end_YYYYMMDD=%s" % bin_datetime.strftime('%Y%m%d'), "end_HHMMSS=%s" % (bin_datetime + timedelta(minutes=89)).strftime('%H%M%S'),
+        "flag_value=-31999", "byte_order=big_endian", "run_latency=LAST"
+    ])
+
+    # precipitation is stored as big-endian int16 scaled by 100, most of the grid is dry and a few cells are flagged as missing
+    precip = np.zeros((rows, cols), np.int16)
+    is_raining = random_state.random_sample((rows, cols)) < rain_fraction
+    precip[is_raining] = random_state.randint(1, 5000, is_raining.sum())
+    precip[random_state.random_sample((rows, cols)) < 0.01] = -31999
+
+    with open(bin_fullpath, "wb") as bin_file:
+        bin_file.write(header_string.ljust(TRMMGridUtils.HEADER_BYTE_LENGTH))
+        bin_file.write(precip.astype('>i2').tostring())
+
+    return bin_fullpath
+
+
+def legacyBinToCSV(bin_to_process, csv_fullpath, precip_min):
+
+    # the original TRMMTransformer._transformBinToCSV grid and CSV loops, kept as the benchmark baseline
+    header_string, precip = TRMMGridUtils.readBinFile(bin_to_process)
+    rows, cols = precip.shape
+
+    vstack = np.vstack
+    arange = np.arange
+
+    lat = arange(59.875, -60.125, -0.25, dtype=float)
+    z = arange(59.875, -60.125, -0.25, dtype=float)
+    for i in range(1, cols):
+        lat = vstack((lat, z))
+    lat = lat.transpose()
+
+    lng = arange(0.125, 360.125, +0.25, dtype=float)
+    z = arange(0.125, 360.125, +0.25, dtype=float)
+    for i in range(1, rows):
+        lng = vstack((lng, z))
+
+    with open(csv_fullpath, "w") as out_csv:
+        out_csv.write('lat,long,precipitation\n')
+        for i in np.ndindex(precip.shape):
+            if precip[i] >= precip_min:
+                out_csv.write('%g,%g,%g\n' % (lat[i], lng[i], precip[i]))
+
+    return csv_fullpath
+
+
+def vectorizedBinToCSV(bin_to_process, csv_fullpath, precip_min):
+
+    header_string, precip = TRMMGridUtils.readBinFile(bin_to_process)
+
+    return TRMMGridUtils.writePrecipitationCSV(precip, precip_min, csv_fullpath)
+
+
+def directBinToRaster(bin_to_process, raster_fullpath, precip_min):
+
+    header_string, precip = TRMMGridUtils.readBinFile(bin_to_process)
+    west_east_precip = TRMMGridUtils.toWestEastGrid(precip, precip_min, -9999)
+
+    return RasterGridWriter.writeFloatGrid(west_east_precip, os.path.splitext(raster_fullpath)[0], TRMMGridUtils.WEST_EAST_GEOREFERENCE, -9999)
+
+
+def timeTransform(transform_function, bin_list, output_dir, precip_min):
+
+    csv_list = []
+    start_time = time.time()
+    for bin_to_process in bin_list:
+        csv_fullpath = os.path.join(output_dir, "%s_%s.csv" % (os.path.basename(bin_to_process), transform_function.__name__))
+        csv_list.append(transform_function(bin_to_process, csv_fullpath, precip_min))
+
+    return ((time.time() - start_time) / len(bin_list), csv_list)
+
+
+def main(*args, **kwargs):
+
+    number_of_bins = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    rain_fraction = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    precip_min = 1
+
+    benchmark_dir = tempfile.mkdtemp(prefix="trmm_benchmark_")
+    try:
+        random_state = np.random.RandomState(0)
+        first_bin_datetime = datetime(2012, 1, 1)
+        bin_list = [
+            createSyntheticBin(os.path.join(benchmark_dir, "3B42RT.%s.7R2.bin" % (first_bin_datetime + timedelta(hours=3 * i)).strftime('%Y%m%d%H')),
+                               first_bin_datetime + timedelta(hours=3 * i), rain_fraction, random_state)
+            for i in range(number_of_bins)
+        ]
+
+        legacy_seconds, legacy_csv_list = timeTransform(legacyBinToCSV, bin_list, benchmark_dir, precip_min)
+        vectorized_seconds, vectorized_csv_list = timeTransform(vectorizedBinToCSV, bin_list, benchmark_dir, precip_min)
+        direct_raster_seconds = timeTransform(directBinToRaster, bin_list, benchmark_dir, precip_min)[0]
+
+        readFile = lambda f: open(f, "rb").read()
+        outputs_match = all(readFile(l) == readFile(v) for l, v in zip(legacy_csv_list, vectorized_csv_list))
+
+        print "bins: %s, rain fraction: %s" % (number_of_bins, rain_fraction)
+        print "legacy bin to CSV:     %.3f seconds per bin" % legacy_seconds
+        print "vectorized bin to CSV: %.3f seconds per bin" % vectorized_seconds
+        print "speedup: %.1fx, identical CSV output: %s" % (legacy_seconds / vectorized_seconds, outputs_match)
+        print "direct bin to raster:  %.3f seconds per bin (no CSV, xy event layer or PointToRaster)" % direct_raster_seconds
+
+    finally:
+        shutil.rmtree(benchmark_dir)
+
+
+# method called upon module execution to start the benchmark
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+
+# standard library
+from datetime import datetime, timedelta
+import sqlite3
+import os
+
+# third-party
+import numpy as np
+
+# TRMM numpy utils
+from trmm_grid_utils import TRMMGridUtils
+
+
+class TRMMZonalStatistics(object):
+
+    """
+        Class TRMMZonalStatistics updates the rainfall statistics of every zone (ex: country or province) with each new 3-hour TRMM grid.
+        This module does not depend on arcpy, the zones are read from a cached label array that is created once by the given zone_labels_loader
+        (ex: TRMMZoneRasterizer.getZoneLabels).
+
+        The high-level steps to update the statistics of a grid include:
+
+            1) load the zone labels once: a 480x1440 integer array in the bin layout with the zone of each cell and -1 outside of every zone
+            2) sum the cells of each zone and their cell area weighted mean with np.bincount, and take each zone's max with np.maximum.reduceat
+            3) write one (zone, timestamp) row per zone into the statistics table of a sqlite database
+
+        Cells below precip_min are counted as dry (0 mm/hr), missing cells are left out of every statistic.
+
+        zonal_options <dict>:
+
+            'zone_labels_fullpath' <str>: the .npy cache of the zone labels
+            'zone_labels_loader' <function>: optional, called without arguments to create the zone labels if the cache does not exist
+            'database_fullpath' <str>: the sqlite database of the statistics table, created if it does not exist
+            'precip_min' <float>: optional, same as the TRMMTransformer's precip_min, default 0
+
+        public interface:
+
+            updateZonalStatistics(grid_datetime, precip) <int>: writes the statistics of every zone for the given 480x1440 mm/hr grid and returns the number of zones,
+            the statistics of a grid that is updated twice are replaced
+            getZoneSeries(zone, start_datetime, end_datetime) <list>: returns the (datetime, precip_sum, precip_mean, precip_max) rows of the given zone sorted by datetime
+            getZoneTotals(start_datetime, end_datetime) <dict>: returns {zone: rainfall depth in mm} of the grids within start_datetime <= datetime <= end_datetime
+    """
+
+    EPOCH = datetime(1970, 1, 1)
+    TABLE_NAME = "trmm_zonal_statistics"
+
+    def __init__(self, zonal_options):
+
+        self.zone_labels_fullpath = zonal_options['zone_labels_fullpath']
+        self.zone_labels_loader = zonal_options.get('zone_labels_loader', None)
+        self.database_fullpath = zonal_options['database_fullpath']
+        self.precip_min = zonal_options.get('precip_min', 0)
+        self.debug_logger = zonal_options.get('debug_logger',lambda*a,**kwa:None)
+
+        self.zones = None # loaded on the first update
+
+        connection = sqlite3.connect(self.database_fullpath)
+        try:
+            connection.execute("""CREATE TABLE IF NOT EXISTS %s (
+                zone INTEGER NOT NULL, timestamp INTEGER NOT NULL, precip_sum REAL, precip_mean REAL, precip_max REAL,
+                PRIMARY KEY (zone, timestamp))""" % self.TABLE_NAME)
+            connection.commit()
+        finally:
+            connection.close()
+
+    def updateZonalStatistics(self, grid_datetime, precip):
+
+        zone_ids, zone_cell_indices, zone_cell_inverse, zone_cell_areas, zone_cell_order, zone_starts = self._getZones()
+        number_of_zones = len(zone_ids)
+        if not number_of_zones:
+            return 0
+
+        values = np.asarray(precip, np.float64).ravel()[zone_cell_indices]
+        is_valid = values >= 0 # NaN and the -319.99 missing flag are not valid
+        values[is_valid & (values < self.precip_min)] = 0
+        values[~is_valid] = 0
+
+        valid_areas = zone_cell_areas * is_valid
+        precip_sums = np.bincount(zone_cell_inverse, weights=values, minlength=number_of_zones)
+        weighted_sums = np.bincount(zone_cell_inverse, weights=values * valid_areas, minlength=number_of_zones)
+        area_sums = np.bincount(zone_cell_inverse, weights=valid_areas, minlength=number_of_zones)
+
+        # every zone has at least one cell so each reduceat segment is non-empty
+        precip_maxes = np.maximum.reduceat(np.where(is_valid, values, -np.inf)[zone_cell_order], zone_starts)
+
+        timestamp = self._toTimestamp(grid_datetime)
+        rows = []
+        for zone_id, precip_sum, weighted_sum, area_sum, precip_max in zip(zone_ids, precip_sums, weighted_sums, area_sums, precip_maxes):
+
+            if area_sum > 0:
+                rows.append((int(zone_id), timestamp, float(precip_sum), float(weighted_sum / area_sum), float(precip_max)))
+            else: # every cell of the zone is missing
+                rows.append((int(zone_id), timestamp, None, None, None))
+
+        connection = sqlite3.connect(self.database_fullpath)
+        try:
+            connection.executemany("INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?, ?)" % self.TABLE_NAME, rows)
+            connection.commit()
+        finally:
+            connection.close()
+
+        self.debug_logger("zonal statistics", grid_datetime, "zones:", number_of_zones)
+
+        return number_of_zones
+
+    def getZoneSeries(self, zone, start_datetime, end_datetime):
+
+        rows = self._query(
+            "SELECT timestamp, precip_sum, precip_mean, precip_max FROM %s WHERE zone = ? AND timestamp >= ? AND timestamp <= ? ORDER BY timestamp" % self.TABLE_NAME,
+            (zone, self._toTimestamp(start_datetime), self._toTimestamp(end_datetime))
+        )
+
+        return [(self.EPOCH + timedelta(seconds=row[0]),) + tuple(row[1:]) for row in rows]
+
+    def getZoneTotals(self, start_datetime, end_datetime):
+
+        # multiply by 3 since each TRMM 3-hour grid is an average rate in mm/hr, not a sum
+        rows = self._query(
+            "SELECT zone, SUM(precip_mean) * 3 FROM %s WHERE timestamp >= ? AND timestamp <= ? GROUP BY zone" % self.TABLE_NAME,
+            (self._toTimestamp(start_datetime), self._toTimestamp(end_datetime))
+        )
+
+        return dict(rows)
+
+    def _query(self, sql, parameters):
+
+        connection = sqlite3.connect(self.database_fullpath)
+        try:
+            return connection.execute(sql, parameters).fetchall()
+        finally:
+            connection.close()
+
+    def _getZones(self):
+
+        if self.zones is None:
+            self.zones = self._createZones(self._loadZoneLabels())
+
+        return self.zones
+
+    def _loadZoneLabels(self):
+
+        if os.path.isfile(self.zone_labels_fullpath):
+            return np.load(self.zone_labels_fullpath)
+
+        if not self.zone_labels_loader:
+            raise IOError("no zone labels at %s and no zone_labels_loader to create them" % self.zone_labels_fullpath)
+
+        self.debug_logger("creating zone labels", self.zone_labels_fullpath)
+        zone_labels = np.asarray(self.zone_labels_loader(), np.int32)
+        np.save(self.zone_labels_fullpath, zone_labels)
+
+        return zone_labels
+
+    def _createZones(self, zone_labels):
+
+        if zone_labels.shape != (TRMMGridUtils.ROWS, TRMMGridUtils.COLS):
+            raise ValueError("zone labels must be a %sx%s array in the bin layout" % (TRMMGridUtils.ROWS, TRMMGridUtils.COLS))
+
+        # cell areas shrink with the cosine of the latitude of the cell centers
+        lat, lng = TRMMGridUtils.getCellCenterCoordinates()
+        cell_areas = np.repeat(np.cos(np.radians(lat)), TRMMGridUtils.COLS)
+
+        zone_cell_indices = np.flatnonzero(zone_labels.ravel() >= 0)
+        zone_ids, zone_cell_inverse = np.unique(zone_labels.ravel()[zone_cell_indices], return_inverse=True)
+
+        # the cells sorted by zone and the position of each zone's first cell for np.maximum.reduceat
+        zone_cell_order = np.argsort(zone_cell_inverse, kind='mergesort')
+        zone_starts = np.searchsorted(zone_cell_inverse[zone_cell_order], np.arange(len(zone_ids)))
+        self.debug_logger("zones:", len(zone_ids), "zone cells:", len(zone_cell_indices))
+
+        return (zone_ids, zone_cell_indices, zone_cell_inverse, cell_areas[zone_cell_indices], zone_cell_order, zone_starts)
+
+    def _toTimestamp(self, grid_datetime):
+
+        time_delta = grid_datetime - self.EPOCH
+
+        return time_delta.days * 86400 + time_delta.seconds
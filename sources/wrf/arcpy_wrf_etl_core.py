@@ -4,13 +4,21 @@
 
 # standard library
 import os
+import threading
 from datetime import datetime, timedelta
 
 # third-party
+import numpy as np
 import arcpy
 
 # ETL utils
 from etl_utils import FTPDownloadManager, UnzipUtils
+from grid_utils import ASCIIGridReader, RasterStatistics
+from arcpy_utils import ArcRasterStatisticsUtils
+
+# WRF utils
+from wrf_ascii_selector import WRFASCIISelector
+from wrf_ftp_listing import WRFASCIIRecord
 
 
 class WRFExtractValidator(object):
@@ -25,6 +33,10 @@ class WRFExtractValidator(object):
             3) Compare the ASCII files from the FTP with the current rasters processed in the raster mosaic dataset.
             4) Filter the difference from step 3 by the correct frame.
             5) Return a list containing only the new ASCII files to process for the current ETL run.
+            
+        Each file name is parsed once into a WRFASCIIRecord and steps 1, 3 and 4 are computed over the records by a WRFASCIISelector. If validateExtract receives
+        the WRFASCIIRecords of a WRFFTPListing (already of the variable and domain, without duplicates and sorted) they are used as they are, a list of file names is parsed.
+        Deleting the overlap frames from the raster mosaic dataset holds the optional 'fgdb_lock', same as the WRFLoader's fgdb_lock.
     """
     
     def __init__(self, extract_validator_config):
@@ -38,7 +50,14 @@ class WRFExtractValidator(object):
         self.wrf_variable = extract_validator_config['wrf_variable']
         self.domain = extract_validator_config['domain']
         self.ftp_ascii_datetime_format = extract_validator_config['ftp_ascii_datetime_format']
+        self.fgdb_lock = extract_validator_config.get('fgdb_lock', None) or threading.Lock() # an uncontended lock if the file geodatabase is not shared
         self.debug_logger = extract_validator_config.get('debug_logger',lambda*a,**kwa:None)
+        
+        self.ascii_selector = WRFASCIISelector({
+            'wrf_variable':self.wrf_variable,
+            'domain':self.domain,
+            'ftp_ascii_datetime_format':self.ftp_ascii_datetime_format
+        })
                 
     def validateExtract(self, ftp_ascii_list):
         
@@ -46,123 +65,56 @@ class WRFExtractValidator(object):
         start_dt = self.start_datetime
         end_dt = self.end_datetime
             
-        # retrieve all ASCII files from the ftp_ascii_list for the given variable and domain
-        filtered_ftp_ascii_list = self._getFilteredDomainVariableASCIIList(ftp_ascii_list)
-        self.debug_logger("len(filtered_ftp_ascii_list)", len(filtered_ftp_ascii_list))
+        # the records of a WRFFTPListing are used as they are, the ASCII file names of the ftp_ascii_list are parsed for the given variable and domain into sorted records
+        records = ftp_ascii_list if ftp_ascii_list and isinstance(ftp_ascii_list[0], WRFASCIIRecord) else self.ascii_selector.getRecords(ftp_ascii_list)
+        self.debug_logger("len(records)", len(records))
         
         # retrieve a list of the current ASCII files processed for the given datetime range
         current_asciis_processed_list = self.raster_mosaic_dataset.getValuesFromDatetimeRange(self.ftp_file_name_field, start_dt, end_dt)
         self.debug_logger("len(current_asciis_processed_list)", len(current_asciis_processed_list))
         
-        # retrieve a list of all new ASCII files to process based on the difference between the filtered_ftp_ascii_list and current_asciis_processed_list
-        missing_ascii_list = self._getUnprocessedASCIIsWithinDatetimeRange(filtered_ftp_ascii_list, current_asciis_processed_list, start_dt, end_dt)
-        self.debug_logger("len(missing_ascii_list)", len(missing_ascii_list))
-        
-        # retrieve a filtered list of new ASCII files to process based on the hourly frame and archive constraints
-        asciis_to_process_list = self._getCorrectHourlyFramesFromASCIIList(missing_ascii_list)
-        self.debug_logger("len(asciis_to_process_list)", len(asciis_to_process_list))
-        
-        return asciis_to_process_list
-    
-    def _getFilteredDomainVariableASCIIList(self, ftp_ascii_list):
-        
-        # cache instance/module variables as local variables
-        wrf_var = self.wrf_variable
-        domain = self.domain
-        
-        # create helper functions
-        startsWithVariable = lambda f:f.split("_")[0] == wrf_var
-        endsWithDomain = lambda f:f.split(".")[0].endswith(domain)
-        isTargetVariableAndDomain = lambda f:startsWithVariable(f) and endsWithDomain(f)
+        # retrieve the records of all new ASCII files to process based on the difference between the records and current_asciis_processed_list
+        missing_records = self.ascii_selector.getUnprocessedRecordsWithinDatetimeRange(records, current_asciis_processed_list, start_dt, end_dt)
+        self.debug_logger("len(missing_records)", len(missing_records))
         
-        # create the filtered_ftp_ascii_list
-        filtered_ftp_ascii_list = [f for f in ftp_ascii_list if isTargetVariableAndDomain(f)]
-        filtered_ftp_ascii_list = list(set(filtered_ftp_ascii_list)) # remove all possible duplicates from the list (if duplicates exists on the FTP)
+        # retrieve the records of the new ASCII files to process based on the hourly frame and archive constraints
+        records_to_process = self._getCorrectHourlyFrameRecords(missing_records)
+        self.debug_logger("len(records_to_process)", len(records_to_process))
         
-        return filtered_ftp_ascii_list
-    
-    def _getUnprocessedASCIIsWithinDatetimeRange(self, filtered_ftp_ascii_list, current_asciis_processed_list, start_dt, end_dt):
+        return [r.file_name for r in records_to_process]
         
-        # create helper functions
-        getDatetimeFromASCII = self._getDatetimeFromASCII # cache function as local variable
-        isWithinDatetimeRange = lambda f:getDatetimeFromASCII(f) >= end_dt and getDatetimeFromASCII(f) <= start_dt
-
-        # retrieve all ASCII files within the given datetime range
-        asciis_within_datetime_range_list = [f for f in filtered_ftp_ascii_list if isWithinDatetimeRange(f)]
-        self.debug_logger("len(asciis_within_datetime_range_list)", len(asciis_within_datetime_range_list))
-        
-        # retrieve all ASCII files that are not currenlty processed in the raster mosaic dataset
-        missing_ascii_list = [ascii for ascii in asciis_within_datetime_range_list if ascii not in current_asciis_processed_list]
-        sortByDateAndHour = lambda x:x.split("_")[1]+"_"+x.split("_")[2] # (apcp10h_2012082006_10_d01.asc.gz)
-        missing_ascii_list.sort(key=sortByDateAndHour) # sort so that the OLDEST ASCII files are processed first
-
-        return missing_ascii_list
-    
-    def _getDatetimeFromASCII(self, asciiFile):
+    def _getCorrectHourlyFrameRecords(self, missing_records):
         
-        # apcp10h_2012082006_10_d01.asc.gz --> 2012-AUG-20 6:00AM
-        ascii_datetime = datetime.strptime (asciiFile.split("_")[1],  self.ftp_ascii_datetime_format )
-        
-        return ascii_datetime
-        
-    def _getCorrectHourlyFramesFromASCIIList(self, missing_ascii_list):
-        
-        # create a datetime object precise to the day
-        createWholeDayDatetime = lambda d :datetime(d.year, d.month, d.day)
-        
-        # retrieve the last processed ASCII and convert it to a datetime object
+        # retrieve the last processed ASCII datetime
         lastASCIIProcessedDatetime = self.raster_mosaic_dataset.getMaxValueFromField(self.model_runtime_field)
         lastASCIIProcessedDatetime = lastASCIIProcessedDatetime if isinstance(lastASCIIProcessedDatetime, datetime) else self.start_datetime
-        onlyDaylastASCIIProcessedDatetime = createWholeDayDatetime(lastASCIIProcessedDatetime)
         self.debug_logger("lastASCIIProcessedDatetime",lastASCIIProcessedDatetime)
         
-        # retrieve the greatest datetime from the missing ASCII files
-        greatestDatetimeFromMissingASCIIList = self._getMaxDatimeObjectFromStringList(missing_ascii_list)        
-        onlyDaygreatestDatetimeFromMissingASCIIList = createWholeDayDatetime(greatestDatetimeFromMissingASCIIList)
-        self.debug_logger("greatestDatetimeFromMissingASCIIList",greatestDatetimeFromMissingASCIIList)
+        # retrieve the greatest datetime from the missing ASCII files. If there are no missing ASCII files then it is assumed that this is the first time 
+        # the ETL is being run, therefore retrieve the latest ASCII files for the given start datetime.
+        greatestDatetimeFromMissingRecords = self.ascii_selector.getMaxModelRuntime(missing_records, self.start_datetime)
+        self.debug_logger("greatestDatetimeFromMissingRecords",greatestDatetimeFromMissingRecords)
         
-        # if the datetime of the last ASCII processed is less than the greatest datetime of the missing ASCIIs, then delete frames 25-48 of the last ASCII processed. 
-        greaterASCIIFileIsAvailable = onlyDaylastASCIIProcessedDatetime < onlyDaygreatestDatetimeFromMissingASCIIList
-        if greaterASCIIFileIsAvailable:
+        # if the day of the last ASCII processed is less than the day of the greatest missing ASCII, then delete frames 25-48 of the last ASCII processed. 
+        if lastASCIIProcessedDatetime.date() < greatestDatetimeFromMissingRecords.date():
         
             # remove the frame overlap from the last ASCII processed
             self._deleteLastACSIIProcessedOverlapFrames(lastASCIIProcessedDatetime)
         
-        # create helper functions to filter out the correct ASCII files to download based on the frame overlap and archive constaints
-        createASCIIDatetime = lambda x: createWholeDayDatetime(datetime.strptime(x.split("_")[1][:-2], self.ftp_ascii_datetime_format[:-2]))
-        differenceInDaysFromLastASCIIProcess = lambda x: (lastASCIIProcessedDatetime - x).days
-        isCorrectFrameForGreaterThanADay = lambda x: int(x.split("_")[2]) < 24
-        withinOneDayRangePositive = lambda x: abs(differenceInDaysFromLastASCIIProcess(createASCIIDatetime(x))) < 1
-        isLatestASCIIFileAvailable = lambda x : greaterASCIIFileIsAvailable and createASCIIDatetime(x) == onlyDaygreatestDatetimeFromMissingASCIIList        
-        isValidGreaterThan24HourFrame = lambda x: withinOneDayRangePositive(x) or isLatestASCIIFileAvailable(x)
-        isValidLessThan24HourFrame = lambda x: not withinOneDayRangePositive(x) and isCorrectFrameForGreaterThanADay(x)
-
-        # filter the missing_ascii_list by the frame overlap contstraints        
-        asciiIsValidToDownload = lambda ascii_to_check: isValidGreaterThan24HourFrame(ascii_to_check) or isValidLessThan24HourFrame(ascii_to_check)
-        asciis_to_process_list = [ascii for ascii in missing_ascii_list if asciiIsValidToDownload(ascii)]
-
-        return asciis_to_process_list
-            
-    def _getMaxDatimeObjectFromStringList(self, missing_ascii_list):
-        
-        # If there are no missing ASCII files then it is assumed that this is the first time the ETL is being run, 
-        # therefore retrieve the latest ASCII files for the given start datetime.
-        if len(missing_ascii_list) == 0:
-            
-            self.debug_logger("Returning current start_datetime")
-            return self.start_datetime
-        
-        max_datetime_string = max(missing_ascii_list)
-        max_datetime_object = datetime.strptime(max_datetime_string.split("_")[1], self.ftp_ascii_datetime_format)
-        
-        return max_datetime_object
+        # filter the missing records by the frame overlap and archive constraints
+        return self.ascii_selector.getCorrectHourlyFrameRecords(missing_records, lastASCIIProcessedDatetime, greatestDatetimeFromMissingRecords)
                 
     def _deleteLastACSIIProcessedOverlapFrames(self, lastASCIIProcessedDatetime):
         
         where_clause = "%s = date \'%s\' AND %s >= 24" % (self.model_runtime_field, lastASCIIProcessedDatetime, self.forecast_end_hour_field)
         self.debug_logger("where_clause",where_clause)
         
-        self.raster_mosaic_dataset.deleteRows(where_clause)
+        self.fgdb_lock.acquire()
+        try:
+            self.raster_mosaic_dataset.deleteRows(where_clause)
+        finally:
+            self.fgdb_lock.release()
+            
         self.debug_logger("deleted last ASCII processed frame 24-48 overlap.")
 
 
@@ -173,17 +125,32 @@ class WRFExtractor(FTPDownloadManager):
         
             1) Retrieves a list of all ASCII raster files from a given FTP directory. (This list is sent to a WRFExtractValidator).
             2) Downloads an ASCII raster file from the given FTP directory.
+            
+        If an 'ftp_listing' is given (a WRFFTPListing shared by the WRF ETL jobs of a run), step 1 returns only the listing's WRFASCIIRecords of the extractor's 
+        'wrf_variable' and 'domain' instead of listing the FTP directory again, so the WRFExtractValidator does not parse the file names again.
+        
+        If a 'download_semaphore' is given (ex: a multiprocessing.Manager().BoundedSemaphore shared by the WRF ETL jobs of a process pool), 
+        each download waits for the semaphore so the jobs together stay within the FTP's download budget.
     """
     
     def __init__(self, extractor_config):
         FTPDownloadManager.__init__(self, extractor_config['ftp_options'])
 
         self.target_file_extn = extractor_config.get('target_file_extn', None)
+        self.download_semaphore = extractor_config.get('download_semaphore', None)
+        self.ftp_listing = extractor_config.get('ftp_listing', None)
+        self.wrf_variable = extractor_config.get('wrf_variable', None) # required with an ftp_listing
+        self.domain = extractor_config.get('domain', None) # required with an ftp_listing
         self.debug_logger = extractor_config.get('debug_logger',lambda*a,**kwa:None)
                                                     
     def getDataToExtract(self, ftp_directory):
         
         self.openConnection()
+        
+        if self.ftp_listing:
+            
+            self.changeDirectory(ftp_directory) # the ASCII files are downloaded from the current working FTP directory
+            return self.ftp_listing.getRecords(ftp_directory, self.wrf_variable, self.domain)
 
         return self.getFileNamesFromDirectory(ftp_directory, self.target_file_extn)
 
@@ -194,7 +161,7 @@ class WRFExtractor(FTPDownloadManager):
             
             extract_dir = wrf_data.getExtractDir()
             
-            downloaded_zipped_ascii_fullpath = self.downloadFileFromFTP(ascii_to_download, extract_dir)
+            downloaded_zipped_ascii_fullpath = self._downloadFileFromFTP(ascii_to_download, extract_dir)
             self.debug_logger("downloaded_zipped_ascii_fullpath",downloaded_zipped_ascii_fullpath)
     
             unzipped_ascii_fullpath = UnzipUtils.unzipGZip(downloaded_zipped_ascii_fullpath, extract_dir)
@@ -206,19 +173,56 @@ class WRFExtractor(FTPDownloadManager):
             
             self.debug_logger("extract Exception:",str(e),str(arcpy.GetMessages(2)))
             wrf_data.handleException(exception=("extract:",str(e)),messages=arcpy.GetMessages(2))
+            
+    def _downloadFileFromFTP(self, ascii_to_download, extract_dir):
+        
+        if not self.download_semaphore:
+            return self.downloadFileFromFTP(ascii_to_download, extract_dir)
+        
+        self.download_semaphore.acquire()
+        try:
+            return self.downloadFileFromFTP(ascii_to_download, extract_dir)
+        finally:
+            self.download_semaphore.release()
   
 
 class WRFTransformer(object):
     
     """
-        Class WRFTransformer converts an ASCII file into an ESRI raster grid.
+        Class WRFTransformer converts an ASCII file into an ESRI raster grid. If a 'raster_statistics_config' is given, the RasterStatistics of the grid
+        are computed for the WRFLoader.
+        
+        If a 'raster_writer_config' is given, the ASCII file is decoded once without arcpy and written straight to its final raster in the file geodatabase,
+        so neither ASCIIToRaster_conversion nor the WRFLoader's CopyRaster_management are needed:
+        
+            1) read the ASCII grid's header and values with ASCIIGridReader (numpy)
+            2) cast the grid to the 'pixel_type' of the file geodatabase raster
+            3) write the grid with arcpy.NumPyArrayToRaster to <fgdb_fullpath>/<wrf_var>_<runtime><forecast hour> and define its spatial reference
+        
+        raster_writer_config <dict>:
+        
+            'fgdb_fullpath' <str>: the file geodatabase of the raster mosaic dataset, same as the WRFLoader's fgdb_fullpath
+            'wrf_variable' <str>: used to create the raster name, same as the WRFLoader's wrf_variable
+            'pixel_type' <str>: optional, the numpy dtype of the raster ex: 'int32' for 32_BIT_SIGNED, default 'float32'
+            'spatial_reference' <str>: optional, the .prj file or spatial reference string defined on the raster
+            'fgdb_lock' <Lock>: optional, held while the raster is written when other processes write to the same file geodatabase, same as the WRFLoader's fgdb_lock
+        
+        raster_statistics_config <dict>:
+        
+            'histogram_bins' <int>: optional, the number of histogram bins, default 256
+            'histogram_range' <tuple>: optional, the (min, max) range of the histogram bins, default the grid's minimum and maximum
     """
     
     def __init__(self, transformer_config, decoratee):
                 
         self.ascii_to_raster_config = transformer_config.get('ASCIIToRaster_conversion_config', {})
+        self.raster_writer_config = transformer_config.get('raster_writer_config', None)
+        self.fgdb_lock = (self.raster_writer_config or {}).get('fgdb_lock', None) or threading.Lock() # an uncontended lock if the file geodatabase is not shared
+        self.raster_statistics_config = transformer_config.get('raster_statistics_config', None)
         self.debug_logger = transformer_config.get('debug_logger',lambda*a,**kwa:None)
         
+        self.raster_statistics_utils = ArcRasterStatisticsUtils()
+        
         self.decoratee = decoratee # this is the WRFMetaDataTransformer
                 
     def transform(self, wrf_data):
@@ -227,15 +231,11 @@ class WRFTransformer(object):
             ascii_file = wrf_data.getDataToTransform()
             self.debug_logger("ascii_file",ascii_file)
             
-            raster_base_name = os.path.basename(ascii_file) # apcp10h_2012082006_10_d01.asc
-            raster_name_parts = raster_base_name.split("_") # [apcp10h, 2012082006, 10, d01.asc]
-            raster_name = "w" + raster_name_parts[1] + raster_name_parts[2] # w201208200610
-            out_raster = os.path.join(wrf_data.getTransformDir(), raster_name)
-            self.debug_logger("out_raster",out_raster)
-            
-            arcpy.env.overwriteOutput = True
-            result = arcpy.ASCIIToRaster_conversion(ascii_file, out_raster, self.ascii_to_raster_config.get('data_type', ''))
-            self.debug_logger("ASCIIToRaster_conversion status: ", result.status)
+            if self.raster_writer_config:
+                out_raster = self._transformGridToRaster(wrf_data, ascii_file)
+                
+            else:
+                out_raster = self._transformASCIIToRaster(wrf_data, ascii_file)
             
             wrf_data.setDataToLoad(out_raster)
             self.decoratee.transform(wrf_data)
@@ -244,6 +244,65 @@ class WRFTransformer(object):
             
             self.debug_logger("transform Exception:",str(e),str(arcpy.GetMessages(2)))
             wrf_data.handleException(exception=("transform:",str(e)),messages=arcpy.GetMessages(2))
+            
+    def _transformASCIIToRaster(self, wrf_data, ascii_file):
+        
+        raster_name = "w" + self._getRasterNameDatetime(ascii_file) # w201208200610
+        out_raster = os.path.join(wrf_data.getTransformDir(), raster_name)
+        self.debug_logger("out_raster",out_raster)
+        
+        arcpy.env.overwriteOutput = True
+        result = arcpy.ASCIIToRaster_conversion(ascii_file, out_raster, self.ascii_to_raster_config.get('data_type', ''))
+        self.debug_logger("ASCIIToRaster_conversion status: ", result.status)
+        
+        if self.raster_statistics_config:
+            wrf_data.setRasterStatistics(self.raster_statistics_utils.getBandStatistics(out_raster, self.raster_statistics_config))
+            
+        return out_raster
+    
+    def _transformGridToRaster(self, wrf_data, ascii_file):
+        
+        rwc = self.raster_writer_config
+        grid, (lower_left_x, lower_left_y, cellsize), nodata_value = ASCIIGridReader.readGrid(ascii_file)
+        
+        # cast the grid to the pixel type of the raster, ex: 32_BIT_SIGNED truncates the values like CopyRaster_management
+        pixel_type = np.dtype(rwc.get('pixel_type', 'float32'))
+        grid = grid.astype(pixel_type)
+        nodata_value = pixel_type.type(nodata_value) if nodata_value is not None else None
+        
+        # <wrf_var>_201208200610, the name of the raster in the file geodatabase
+        out_raster = os.path.join(rwc['fgdb_fullpath'], rwc['wrf_variable'] + "_" + self._getRasterNameDatetime(ascii_file))
+        self.debug_logger("out_raster",out_raster)
+        
+        if self.raster_statistics_config:
+            rsc = self.raster_statistics_config
+            wrf_data.setRasterStatistics([RasterStatistics.fromArray(grid, nodata_value, rsc.get('histogram_bins', 256), rsc.get('histogram_range', None))])
+        
+        # the statistics computed above are set by the WRFLoader instead of being calculated when the raster is saved
+        raster_statistics_environment = arcpy.env.rasterStatistics
+        if self.raster_statistics_config:
+            arcpy.env.rasterStatistics = "NONE"
+        
+        self.fgdb_lock.acquire()
+        try:
+            arcpy.env.overwriteOutput = True
+            arcpy.NumPyArrayToRaster(grid, arcpy.Point(lower_left_x, lower_left_y), cellsize, cellsize, nodata_value).save(out_raster)
+            
+            if rwc.get('spatial_reference', None):
+                arcpy.DefineProjection_management(out_raster, rwc['spatial_reference'])
+            
+        finally:
+            self.fgdb_lock.release()
+            arcpy.env.rasterStatistics = raster_statistics_environment
+            
+        return out_raster
+    
+    def _getRasterNameDatetime(self, ascii_file):
+        
+        raster_base_name = os.path.basename(ascii_file) # apcp10h_2012082006_10_d01.asc
+        raster_name_parts = raster_base_name.split("_") # [apcp10h, 2012082006, 10, d01.asc]
+        
+        return raster_name_parts[1] + raster_name_parts[2] # 201208200610
         
 
 class WRFMetaDataTransformer(object):
@@ -328,66 +387,106 @@ class WRFLoader(object):
     """
         Class WRFLoader:
         
-            1) Copies the raster created from the ASCII into the given file geodatabase
+            1) Copies the raster created from the ASCII into the given file geodatabase (unless the WRFTransformer already wrote it there)
             2) Adds the raster in file geodatabasegiven to the given raster mosaic dataset.
             3) Updates the fields associated with the added raster in the given raster mosaic dataset.
+            
+        If the WRFTransformer computed the raster's RasterStatistics, they are set on the file geodatabase raster instead of being calculated
+        by CopyRaster and are written into the stats_ fields of the raster mosaic dataset.
+        
+        Steps 1) to 3) hold the optional 'fgdb_lock' (ex: a multiprocessing.Manager().Lock per domain) so the WRF ETL jobs of other variables
+        that write to the same file geodatabase in a process pool are serialized.
     """
 
     def __init__(self, loader_config):
         
         self.raster_mosaic_dataset = loader_config['raster_mosaic_dataset']
         self.wrf_variable = loader_config['wrf_variable']
-        self.copy_raster_config = loader_config['CopyRaster_management_config']
+        self.copy_raster_config = loader_config.get('CopyRaster_management_config', {})
         self.add_raster_to_mosaic_config = loader_config['AddRastersToMosaicDataset_management_config']
         self.fgdb_fullpath = loader_config['fgdb_fullpath']
+        self.fgdb_lock = loader_config.get('fgdb_lock', None) or threading.Lock() # an uncontended lock if the file geodatabase is not shared
         self.debug_logger = loader_config.get('debug_logger',lambda*a,**kwa:None)
+        
+        self.raster_statistics_utils = ArcRasterStatisticsUtils()
                                         
     def load(self, wrf_data):
         
         try:           
-            # retrieve a reference to the raster in the transform directory 
+            # retrieve a reference to the raster in the transform directory (or the file geodatabase)
             wrf_raster = wrf_data.getDataToLoad()
             self.debug_logger("wrf_raster",wrf_raster)
             meta_data = wrf_data.getMetaDataToLoad()
+            band_statistics = wrf_data.getRasterStatistics()
+            
+            # other processes may write to the same file geodatabase
+            self.fgdb_lock.acquire()
+            try:
+                self._loadRaster(wrf_raster, meta_data, band_statistics)
+            finally:
+                self.fgdb_lock.release()
             
-            # retrieve the basename from the raster
-            raster_name = os.path.basename(wrf_raster)
-            self.debug_logger("raster_name", raster_name)
+        except Exception as e:
+            
+            self.debug_logger("Load Exception:",str(e),str(arcpy.GetMessages(2)))
+            wrf_data.handleException(exception=("Load:",str(e)),messages=arcpy.GetMessages(2))
             
+    def _loadRaster(self, wrf_raster, meta_data, band_statistics):
+        
+        # retrieve the basename from the raster
+        raster_name = os.path.basename(wrf_raster)
+        self.debug_logger("raster_name", raster_name)
+        
+        # rasters written by the WRFTransformer's raster writer are already in the file geodatabase
+        if os.path.normcase(os.path.dirname(wrf_raster)) == os.path.normcase(self.fgdb_fullpath):
+            
+            fgdb_raster_name = raster_name
+            fgdb_raster_fullpath = wrf_raster
+            
+        else:
             # create the output raster fullpath
             # w201208200610 --> 201208200610 --> <wrf_var>_201208200610
             fgdb_raster_name = self.wrf_variable + "_" +raster_name[1:]
             fgdb_raster_fullpath = os.path.join(self.fgdb_fullpath, fgdb_raster_name)
-            self.debug_logger("fgdb_raster_fullpath", fgdb_raster_fullpath)
             
             # copy the transfrom directory raster into the file geodatabase
-            self._copyRaster(wrf_raster, fgdb_raster_fullpath)
-            
-            # add the file geodatabase raster into the raster mosaic dataset (which is also located in the same file geodatabase)
-            self._addRasterToMosaicDataset(fgdb_raster_fullpath)
+            self._copyRaster(wrf_raster, fgdb_raster_fullpath, calculate_statistics=not band_statistics)
             
-            self.raster_mosaic_dataset.updateFieldsForInput(fgdb_raster_name, meta_data)
-            self.debug_logger("updated raster mosaic dataset fields")
-            
-        except Exception as e:
+        self.debug_logger("fgdb_raster_fullpath", fgdb_raster_fullpath)
+        
+        if band_statistics:
+            self.raster_statistics_utils.setRasterStatistics(fgdb_raster_fullpath, band_statistics)
+            meta_data.update(band_statistics[0].getFieldValues())
+        
+        # add the file geodatabase raster into the raster mosaic dataset (which is also located in the same file geodatabase)
+        self._addRasterToMosaicDataset(fgdb_raster_fullpath)
+        
+        self.raster_mosaic_dataset.updateFieldsForInput(fgdb_raster_name, meta_data)
+        self.debug_logger("updated raster mosaic dataset fields")
             
-            self.debug_logger("Load Exception:",str(e),str(arcpy.GetMessages(2)))
-            wrf_data.handleException(exception=("Load:",str(e)),messages=arcpy.GetMessages(2))
+    def _copyRaster(self, in_raster, out_raster, calculate_statistics=True):
+        
+        # the statistics computed at transform time are set on the output raster after the copy
+        raster_statistics_environment = arcpy.env.rasterStatistics
+        if not calculate_statistics:
+            arcpy.env.rasterStatistics = "NONE"
+        
+        try:
+            crc = self.copy_raster_config
+            copy_result = arcpy.CopyRaster_management(
+                in_raster, 
+                out_raster, 
+                crc.get('config_keyword',''), 
+                crc.get('background_value',''), 
+                crc.get('nodata_value',''), 
+                crc.get('onebit_to_eightbit',''), 
+                crc.get('colormap_to_RGB',''), 
+                crc.get('pixel_type','')
+            )
+            self.debug_logger("CopyRaster_management status",copy_result.status)
             
-    def _copyRaster(self, in_raster, out_raster):
-                
-        crc = self.copy_raster_config
-        copy_result = arcpy.CopyRaster_management(
-            in_raster, 
-            out_raster, 
-            crc.get('config_keyword',''), 
-            crc.get('background_value',''), 
-            crc.get('nodata_value',''), 
-            crc.get('onebit_to_eightbit',''), 
-            crc.get('colormap_to_RGB',''), 
-            crc.get('pixel_type','')
-        )
-        self.debug_logger("CopyRaster_management status",copy_result.status)
+        finally:
+            arcpy.env.rasterStatistics = raster_statistics_environment
              
     def _addRasterToMosaicDataset(self, in_raster):
         
@@ -5,6 +5,8 @@
 
 # standard-library
 from datetime import datetime, timedelta
+import multiprocessing
+import threading
 import os
 import sys
 
@@ -22,10 +24,11 @@ from etl_delegate import FTPETLDelegate
 
 # arcpy ETL framework
 from arcpy_wrf_etl_core import WRFLoader, WRFTransformer, WRFMetaDataTransformer, WRFExtractor, WRFExtractValidator
+from wrf_ftp_listing import WRFFTPListing
 
 # ETL utils 
 from etl_utils import ETLDebugLogger, ETLExceptionManager, ExceptionManager
-from arcpy_utils import FileGeoDatabase, RasterMosaicDataset, ArcGISServiceManager
+from arcpy_utils import FileGeoDatabase, RasterMosaicDataset, ArcGISServiceManager, ArcRasterStatisticsUtils, service_refresh_coalescer
 
 
 def getRasterMosaicDataset(dataset_name, output_basepath, spatial_projection, archive_days):
@@ -60,11 +63,14 @@ def getRasterMosaicDataset(dataset_name, output_basepath, spatial_projection, ar
         arcpy.AddField_management(raster_mosaic_dataset.fullpath, 'end_hour', 'SHORT', '', '', 2)
         
         arcpy.AddField_management(raster_mosaic_dataset.fullpath, 'forecast_end_hour', 'SHORT', '', '', 2)
+        
+    # raster statistics fields, written when the WRFTransformer has a raster_statistics_config, also added to a raster mosaic dataset created before them
+    ArcRasterStatisticsUtils().addStatisticsFields(raster_mosaic_dataset.fullpath)
 
     return raster_mosaic_dataset
 
 
-def executeETL(raster_mosaic_dataset, spatial_projection, start_datetime, end_datetime, wrf_variable, domain, fgdb):
+def executeETL(raster_mosaic_dataset, spatial_projection, start_datetime, end_datetime, wrf_variable, domain, fgdb, wrf_ftp_listing, download_semaphore, fgdb_lock):
     
     # this variable is used in the debug log and exception report file names in order to make them distinct
     domainVariable = domain + "_" + wrf_variable
@@ -99,17 +105,18 @@ def executeETL(raster_mosaic_dataset, spatial_projection, start_datetime, end_da
         'forecast_end_hour_field':'forecast_end_hour',
         "start_datetime":start_datetime,
         "end_datetime":end_datetime,   
+        'fgdb_lock':fgdb_lock, # serializes the writes of the parallel jobs of the same domain, None when the jobs run one at a time
         'debug_logger':update_debug_log    
     })
     
     wrf_extractor = WRFExtractor({
-             #MAY NEED TO UPDATE URL                       
+                                   
         "target_file_extn":"gz",
-        "ftp_options": {          
-            "ftp_host":"ftp.nsstc.org", 
-            "ftp_user":"anonymous", 
-            "ftp_pswrd":"anonymous"
-        },
+        "ftp_options":wrf_ftp_listing.ftp_options,
+        'ftp_listing':wrf_ftp_listing, # the FTP directory is listed once per run, the extractor receives only the files of its variable and domain
+        'wrf_variable':wrf_variable,
+        'domain':domain,
+        'download_semaphore':download_semaphore, # shared by the parallel jobs to bound the concurrent downloads, None when the jobs run one at a time
         'debug_logger':update_debug_log                                    
     })
         
@@ -122,9 +129,19 @@ def executeETL(raster_mosaic_dataset, spatial_projection, start_datetime, end_da
     wrf_transformer = WRFTransformer({
                                         
         "raster_mosaic_dataset":raster_mosaic_dataset,
+        "raster_writer_config":{ # optional, comment out/delete entire key to create the rasters with ASCIIToRaster_conversion and copy them into the FGDB with CopyRaster_management
+            'fgdb_fullpath':fgdb.fullpath,
+            'wrf_variable':wrf_variable, # used to create the raster name --> <wrf_var>_201210070612
+            'pixel_type':'int32', # same as the WRFLoader's CopyRaster_management pixel_type 32_BIT_SIGNED
+            'spatial_reference':spatial_projection,
+            'fgdb_lock':fgdb_lock
+        },
         'ASCIIToRaster_conversion_config': {
             'data_type':"FLOAT"
         },
+        "raster_statistics_config":{ # optional, comment out/delete entire key to let ArcGIS calculate the statistics, requires the stats_ fields in the raster mosaic dataset
+            'histogram_bins':256
+        },
         'debug_logger':update_debug_log
     }, decoratee=wrf_meta_data_transformer)
     
@@ -133,6 +150,7 @@ def executeETL(raster_mosaic_dataset, spatial_projection, start_datetime, end_da
         "raster_mosaic_dataset":raster_mosaic_dataset,
         'wrf_variable':wrf_variable, # used to create the new raster name --> <wrf_var>_2012100706 from w2012100706
         "fgdb_fullpath":fgdb.fullpath,
+        'fgdb_lock':fgdb_lock,
         "CopyRaster_management_config":{  
             'config_keyword':'',
             'background_value':'',
@@ -161,7 +179,8 @@ def executeETL(raster_mosaic_dataset, spatial_projection, start_datetime, end_da
         'debug_logger':update_debug_log
     })
     
-    etl_controller = ETLController(sys.path[0], "wrf_etl_workspace", {
+    # each variable and domain has its own workspace since the parallel jobs remove their workspace on finish
+    etl_controller = ETLController(sys.path[0], "wrf_etl_workspace_" + domainVariable, {
                                                                       
         'debug_logger':update_debug_log,
         "remove_etl_workspace_on_finish":True
@@ -169,7 +188,7 @@ def executeETL(raster_mosaic_dataset, spatial_projection, start_datetime, end_da
     
     wrf_etl_delegate = FTPETLDelegate({
                                         
-        "ftp_dirs":['/outgoing/casejl/servir/'],
+        "ftp_dirs":wrf_ftp_listing.ftp_directories,
         "all_or_none_for_success":True,
         'debug_logger':update_debug_log,
         'exception_handler':etl_exception_manager.handleException
@@ -186,71 +205,160 @@ def executeETL(raster_mosaic_dataset, spatial_projection, start_datetime, end_da
     is_successful_new_run = wrf_etl_delegate.startETLProcess()
     
     # execute post-ETL operations -------------------------------------
-    raster_mosaic_dataset.deleteOutdatedRows(start_datetime)
-    fgdb.deleteRastersOutsideDatetimeRange(start_datetime, end_datetime, {
-        'raster_name_prefix':wrf_variable, # <wrf_var>_201210070612
-        'raster_name_datetime_format':wrf_variable+"_"+ascii_raster_datetime_format, # <wrf_var>_2012100706 -> <wrf_var>_%Y%m%d%H (ignore the last two chars)
-        'raster_name_parser_function':lambda r:r[:-2], # return raster name minus the last two chars to convert to correct datetime object
-        'raster_name_validator_function':lambda r:r.split("_")[0] == wrf_variable # determines the correct raster to check in the FGDB, <wrf_var> == <wrf_var>
-    })
+    fgdb_lock = fgdb_lock or threading.Lock()
+    with fgdb_lock:
+        
+        raster_mosaic_dataset.deleteOutdatedRows(start_datetime)
+        fgdb.deleteRastersOutsideDatetimeRange(start_datetime, end_datetime, {
+            'raster_name_prefix':wrf_variable, # <wrf_var>_201210070612
+            'raster_name_datetime_format':wrf_variable+"_"+ascii_raster_datetime_format, # <wrf_var>_2012100706 -> <wrf_var>_%Y%m%d%H (ignore the last two chars)
+            'raster_name_parser_function':lambda r:r[:-2], # return raster name minus the last two chars to convert to correct datetime object
+            'raster_name_validator_function':lambda r:r.split("_")[0] == wrf_variable # determines the correct raster to check in the FGDB, <wrf_var> == <wrf_var>
+        })
+        
     etl_exception_manager.finalizeExceptionXMLLog()
     
     return is_successful_new_run
 
 
-def executeWRFETL(domain, wrf_variable, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath):
-    
-    # output location for the raster catalog, creates the FileGeoDatabase if it does not exist 
-    wrf_fgdb = FileGeoDatabase(output_fgdb_basepath, domain+".gdb")
+def executeWRFETL(domain, wrf_variable, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath, wrf_ftp_listing, download_semaphore=None, fgdb_lock=None):
     
-    # get a reference to the raster mosaic dataset, create one if it does not exist
-    raster_mosaic_dataset = getRasterMosaicDataset(wrf_variable, wrf_fgdb.fullpath, spatial_projection, archive_days)
+    # creating the FileGeoDatabase and raster mosaic dataset is also a write to the FGDB shared by the parallel jobs of the domain
+    with (fgdb_lock or threading.Lock()):
+        
+        # output location for the raster catalog, creates the FileGeoDatabase if it does not exist 
+        wrf_fgdb = FileGeoDatabase(output_fgdb_basepath, domain+".gdb")
+        
+        # get a reference to the raster mosaic dataset, create one if it does not exist
+        raster_mosaic_dataset = getRasterMosaicDataset(wrf_variable, wrf_fgdb.fullpath, spatial_projection, archive_days)
         
     # execute the main ETL operation
-    is_successful_new_run = executeETL(raster_mosaic_dataset, spatial_projection, start_datetime, end_datetime, wrf_variable, domain, wrf_fgdb)
+    is_successful_new_run = executeETL(raster_mosaic_dataset, spatial_projection, start_datetime, end_datetime, wrf_variable, domain, wrf_fgdb, wrf_ftp_listing, download_semaphore, fgdb_lock)
     
     return is_successful_new_run
 
+
+def executeWRFETLJob(wrf_etl_job):
+    
+    """
+        This function runs a single (domain, wrf_variable) job of executeWRFETLParallel in a process of its multiprocessing.Pool. wrf_etl_job is a tuple of 
+        (domain, wrf_variable, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath, wrf_ftp_listing, download_semaphore, fgdb_lock).
+        Returns a tuple of (domain, wrf_variable, is_successful_new_run, exception) where exception is None if the job finished, exceptions are returned
+        instead of raised so a single failed job does not stop the other jobs of the pool.
+    """
     
-def executeWRFETLMain(domain, wrf_variable_list, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath):
+    domain, wrf_variable = wrf_etl_job[:2]
     
-    had_successfull_new_run_list = []
+    try:
+        return (domain, wrf_variable, executeWRFETL(*wrf_etl_job), None)
+    
+    except Exception as e:
+        
+        return (domain, wrf_variable, False, "%s_%s: %s" % (domain, wrf_variable, e))
+
+
+def refreshWRFMapService(domain, wrf_variable_list, updated_wrf_variable_list):
+    
+    # initialize debug logger instance 
+    debug_log_output_directory = os.path.join(sys.path[0], "wrf_map_service_logs", domain+"_Logs")
+    etl_debug_logger = ETLDebugLogger(debug_log_output_directory, domain+"_log", {
+                                                                                      
+        "debug_log_archive_days":7        
+    })
+    update_debug_log = etl_debug_logger.updateDebugLog
+    
+    # refresh the map service associated with the updated raster mosaic dataset(s)
+    map_service_name = "wrf_" + domain + ".MapServer"
+    agsm = ArcGISServiceManager({
+                                          
+        'debug_logger':update_debug_log,
+        'server_name':'localhost',
+        'server_port':'6080',
+        'username':'',
+        'password':'',
+        'service_dir':'',
+        'services':[map_service_name],
+        'service_datasets':{map_service_name:wrf_variable_list}, # each domain map service contains a raster mosaic dataset per variable
+        'refresh_window_seconds':30 # refresh requests for the other domains within this window are coalesced
+    })
+        
+    update_debug_log("Requesting map service refresh...", updated_wrf_variable_list)
+    agsm.refreshServicesForDatasets(updated_wrf_variable_list)  
+
+    
+def executeWRFETLMain(domain, wrf_variable_list, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath, wrf_ftp_listing):
+    
+    updated_wrf_variable_list = []
     
     # for each variable, execute the WRF ETL procedure
     for wrf_variable in wrf_variable_list:
         
-        had_successfull_new_run = executeWRFETL(domain, wrf_variable, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath)
-        had_successfull_new_run_list.append(had_successfull_new_run) # append a boolean flag if the raster mosaic dataset was updated with new data
+        had_successfull_new_run = executeWRFETL(domain, wrf_variable, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath, wrf_ftp_listing)
+        if had_successfull_new_run: # keep track of each raster mosaic dataset that was updated with new data
+            updated_wrf_variable_list.append(wrf_variable)
+    
+    if updated_wrf_variable_list:
+        refreshWRFMapService(domain, wrf_variable_list, updated_wrf_variable_list)
+        
 
-    # function 'any' return True if a single True value exists within the given list
-    atLeastOneDomainRasterMosaicDatasetWasUpdated = any(had_successfull_new_run_list)
+def executeWRFETLParallel(domain_list, wrf_variable_list, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath, wrf_ftp_listing, parallel_options):
     
-    if atLeastOneDomainRasterMosaicDatasetWasUpdated:
+    """
+        This function runs the WRF ETL of every variable and domain combination as a job in a multiprocessing.Pool of parallel_options['processes'] processes
+        (default: the number of cores). Each variable has its own raster mosaic dataset, but the variables of a domain share the domain's FGDB, so the writes
+        of the jobs of a domain are serialized by a lock per FGDB. The downloads of all jobs share a semaphore of parallel_options['max_concurrent_downloads']
+        (default 4) so the FTP is not sent more requests than in its download budget. The map service of each domain is refreshed once its jobs are finished.
+        The FTP directory is listed once before the jobs start, each job receives the subset of wrf_ftp_listing of its variable and domain.
+    """
+    
+    debug_log_output_directory = os.path.join(sys.path[0], "wrf_etl_logs", "parallel_Logs")
+    etl_debug_logger = ETLDebugLogger(debug_log_output_directory, "parallel_log", {
+                                                                                    
+        "debug_log_archive_days":7
+    })
+    update_debug_log = etl_debug_logger.updateDebugLog
+    
+    update_debug_log("indexed WRF ASCII files", wrf_ftp_listing.listDirectories())
+    
+    # the semaphore and locks are shared with the pool processes through a manager since they are passed as job arguments
+    manager = multiprocessing.Manager()
+    updated_wrf_variables_by_domain = dict((domain, []) for domain in domain_list)
+    
+    try:
+        download_semaphore = manager.BoundedSemaphore(parallel_options.get('max_concurrent_downloads', 4))
+        fgdb_locks = dict((domain, manager.Lock()) for domain in domain_list)
         
-        # initialize debug logger instance 
-        debug_log_output_directory = os.path.join(sys.path[0], "wrf_map_service_logs", domain+"_Logs")
-        etl_debug_logger = ETLDebugLogger(debug_log_output_directory, domain+"_log", {
-                                                                                          
-            "debug_log_archive_days":7        
-        })
-        update_debug_log = etl_debug_logger.updateDebugLog
+        wrf_etl_jobs = [
+            (domain, wrf_variable, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath, wrf_ftp_listing.getSubset(wrf_variable, domain), 
+             download_semaphore, fgdb_locks[domain])
+            for domain in domain_list
+            for wrf_variable in wrf_variable_list
+        ]
+        update_debug_log("len(wrf_etl_jobs)", len(wrf_etl_jobs))
         
-        # refresh the map service associated with the given raster mosaic dataset(s)
-        map_service_name = "wrf_" + domain + ".MapServer"
-        agsm = ArcGISServiceManager({
-                                              
-            'debug_logger':update_debug_log,
-            'server_name':'localhost',
-            'server_port':'6080',
-            'username':'',
-            'password':'',
-            'service_dir':'',
-            'services':[map_service_name]
-        })
+        wrf_etl_pool = multiprocessing.Pool(parallel_options.get('processes', None))
+        try:
+            for domain, wrf_variable, had_successfull_new_run, exception in wrf_etl_pool.imap_unordered(executeWRFETLJob, wrf_etl_jobs):
+                
+                update_debug_log("finished WRF ETL job", domain, wrf_variable, had_successfull_new_run, exception)
+                if had_successfull_new_run: # keep track of each raster mosaic dataset that was updated with new data
+                    updated_wrf_variables_by_domain[domain].append(wrf_variable)
+                    
+            wrf_etl_pool.close()
+            
+        finally:
+            wrf_etl_pool.terminate()
+            wrf_etl_pool.join()
             
-        update_debug_log("Refreshing map services...")
-        agsm.refreshServices()  
-        update_debug_log("finished refreshing map services.")
+    finally:
+        manager.shutdown()
+    
+    for domain in domain_list:
+        if updated_wrf_variables_by_domain[domain]:
+            refreshWRFMapService(domain, wrf_variable_list, updated_wrf_variables_by_domain[domain])
+    
+    etl_debug_logger.deleteOutdatedDebugLogs()
+
 
 def main():
         
@@ -270,9 +378,36 @@ def main():
     # 'mhws10m', 'elev', 'soilw0-10cm', 'soilw10-40cm', 'soilw40-100cm',
     # 'soilw100-200cm', 'apcp24h', 'prate', 'refc', 'mhrefc' 
     
-    executeWRFETLMain("d01", wrf_variable_list, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath)
-    #executeWRFETLMain("d02", wrf_variable_list, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath)
-    #executeWRFETLMain("d03", wrf_variable_list, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath)
+    # the FTP directories are listed once per run and shared by every variable and domain
+    wrf_ftp_listing = WRFFTPListing({
+                                     #MAY NEED TO UPDATE URL
+        "ftp_options": {          
+            "ftp_host":"ftp.nsstc.org", 
+            "ftp_user":"anonymous", 
+            "ftp_pswrd":"anonymous"
+        },
+        "ftp_directories":['/outgoing/casejl/servir/'],
+        "target_file_extn":"gz",
+        "ftp_ascii_datetime_format":'%Y%m%d%H' # same as the WRFExtractValidator's ftp_ascii_datetime_format
+    })
+    
+    # optional, set to None to process the variables of each domain one at a time
+    parallel_options = {
+        'processes':4, # number of variable and domain jobs running at the same time, None for the number of cores
+        'max_concurrent_downloads':4 # number of ASCII downloads from the FTP at the same time across all jobs
+    }
+    
+    if parallel_options:
+        executeWRFETLParallel(["d01", "d02", "d03"], wrf_variable_list, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath, wrf_ftp_listing, parallel_options)
+        
+    else:
+        executeWRFETLMain("d01", wrf_variable_list, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath, wrf_ftp_listing)
+        #executeWRFETLMain("d02", wrf_variable_list, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath, wrf_ftp_listing)
+        #executeWRFETLMain("d03", wrf_variable_list, start_datetime, end_datetime, archive_days, spatial_projection, output_fgdb_basepath, wrf_ftp_listing)
+        
+    # every domain is done, refresh the coalesced map services now instead of waiting for the refresh window to close
+    service_refresh_coalescer.flush()
 
-# method called upon module execution to start the ETL process 
-main()
\ No newline at end of file
+# method called upon module execution to start the ETL process, guarded so the processes of the parallel pool can import this module
+if __name__ == '__main__':
+    main()
\ No newline at end of file
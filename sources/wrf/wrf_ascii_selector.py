@@ -0,0 +1,80 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+
+# standard library
+from bisect import bisect_left, bisect_right
+
+# WRF utils
+from wrf_ftp_listing import WRFFTPListing
+
+
+class WRFASCIISelector(object):
+
+    """
+        Class WRFASCIISelector selects the WRF ASCII files of a variable and domain to process from an FTP listing. It is used by the WRFExtractValidator,
+        which reads the processed files from the raster mosaic dataset. This module does not depend on arcpy so it can be benchmarked outside of an ArcGIS environment.
+
+        Every file name of the variable is parsed once into a WRFASCIIRecord (each model runtime string once), the records are kept sorted by (model_runtime, forecast_hour)
+        so the datetime range is a bisect of the sorted model runtimes and the processed files are looked up in a set.
+
+        selector_options <dict>:
+
+            'wrf_variable' <str>: the variable of the files to select (ex: apcp)
+            'domain' <str>: the domain of the files to select (ex: d01)
+            'ftp_ascii_datetime_format' <str>: optional, the datetime format of the model runtime in the file names, default '%Y%m%d%H'
+
+        public interface:
+
+            getRecords(ftp_ascii_list) <list>: returns the records of the variable and domain's file names without duplicates, sorted so the OLDEST ASCII files come first
+            getUnprocessedRecordsWithinDatetimeRange(records, processed_file_names, start_dt, end_dt) <list>: returns the sorted records with end_dt <= model_runtime <= start_dt
+            whose file name is not in processed_file_names
+            getMaxModelRuntime(records, default_datetime) <datetime>: returns the greatest model runtime of the sorted records, default_datetime if there are no records
+            getCorrectHourlyFrameRecords(records, last_processed_datetime, max_model_runtime) <list>: returns the records of the correct hourly frames, see below
+
+        Since the model runs every day and forecasts 48 hours ahead, frames 24-48 of a runtime overlap frames 0-23 of the next day's runtime. Frames 24-48 are only
+        selected for the runtime day of the last ASCII processed and, if it is a later day, the runtime day of max_model_runtime. Frames 0-23 are always selected.
+    """
+
+    def __init__(self, selector_options):
+
+        self.wrf_variable = selector_options['wrf_variable']
+        self.domain = selector_options['domain']
+        self.ftp_ascii_datetime_format = selector_options.get('ftp_ascii_datetime_format', '%Y%m%d%H')
+
+    def getRecords(self, ftp_ascii_list):
+
+        # cache instance variables as local variables
+        variable_prefix, domain, ftp_ascii_datetime_format = self.wrf_variable + "_", self.domain, self.ftp_ascii_datetime_format
+        parseFileName = WRFFTPListing.parseFileName
+        model_runtime_cache = {}
+
+        # only the names of the variable are parsed, set() removes all possible duplicates from the list (if duplicates exists on the FTP)
+        variable_file_names = set([f for f in ftp_ascii_list if f.startswith(variable_prefix)])
+        records = [parseFileName(f, ftp_ascii_datetime_format, model_runtime_cache) for f in variable_file_names]
+        records = [r for r in records if r and r.domain == domain]
+        records.sort(key=lambda r:(r.model_runtime, r.forecast_hour))
+
+        return records
+
+    def getUnprocessedRecordsWithinDatetimeRange(self, records, processed_file_names, start_dt, end_dt):
+
+        # the records are sorted by model runtime, so the range is a slice
+        model_runtimes = [r.model_runtime for r in records]
+        records_within_datetime_range = records[bisect_left(model_runtimes, end_dt):bisect_right(model_runtimes, start_dt)]
+
+        processed_file_names = set(processed_file_names)
+
+        return [r for r in records_within_datetime_range if r.file_name not in processed_file_names]
+
+    def getMaxModelRuntime(self, records, default_datetime):
+
+        return records[-1].model_runtime if records else default_datetime
+
+    def getCorrectHourlyFrameRecords(self, records, last_processed_datetime, max_model_runtime):
+
+        overlap_frame_days = set([last_processed_datetime.date()])
+        if last_processed_datetime.date() < max_model_runtime.date():
+            overlap_frame_days.add(max_model_runtime.date())
+
+        return [r for r in records if r.forecast_hour < 24 or r.model_runtime.date() in overlap_frame_days]
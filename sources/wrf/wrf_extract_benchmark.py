@@ -0,0 +1,134 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+# Benchmarks the WRF extract validation on a synthetic FTP listing. It does not depend on arcpy.
+#
+# usage: python wrf_extract_benchmark.py [number_of_files] [repeat]
+# the ETL utils directory (etl_utils) must be on the PYTHONPATH
+
+
+# --------------- Imports -------------------------------------
+# standard-library
+from datetime import datetime, timedelta
+import random
+import time
+import sys
+
+# WRF utils
+from wrf_ascii_selector import WRFASCIISelector
+
+
+WRF_VARIABLES = [
+    'apcp3h', 'apcp', 'elev', 'tmp2m', 'tsfc', 'dpt2m', 'prmsl', 'u10m', 'v10m', 'ws10m',
+    'mhws10m', 'soilw0-10cm', 'soilw10-40cm', 'soilw40-100cm', 'soilw100-200cm', 'apcp24h', 'prate', 'refc', 'mhrefc', 'apcp10h'
+]
+WRF_DOMAINS = ['d01', 'd02', 'd03']
+ASCII_DATETIME_FORMAT = '%Y%m%d%H'
+
+
+def createSyntheticListing(number_of_files, last_runtime, random_state):
+
+    # every variable and domain has a 48 hour forecast of a daily model run, from the latest runtime back in time until number_of_files are listed
+    ftp_ascii_list = []
+    runtime = last_runtime
+    while len(ftp_ascii_list) < number_of_files:
+
+        for wrf_variable in WRF_VARIABLES:
+            for domain in WRF_DOMAINS:
+                for forecast_hour in range(1, 49):
+                    ftp_ascii_list.append("%s_%s_%02d_%s.asc.gz" % (wrf_variable, runtime.strftime(ASCII_DATETIME_FORMAT), forecast_hour, domain))
+
+        runtime -= timedelta(days=1)
+
+    ftp_ascii_list = ftp_ascii_list[:number_of_files]
+    random_state.shuffle(ftp_ascii_list)
+
+    return ftp_ascii_list
+
+
+def legacyValidateExtract(ftp_ascii_list, current_asciis_processed_list, last_processed_datetime, wrf_var, domain, start_dt, end_dt):
+
+    # the original WRFExtractValidator filter, range, membership and frame lambdas, kept as the benchmark baseline
+    getDatetimeFromASCII = lambda f:datetime.strptime(f.split("_")[1], ASCII_DATETIME_FORMAT)
+
+    startsWithVariable = lambda f:f.split("_")[0] == wrf_var
+    endsWithDomain = lambda f:f.split(".")[0].endswith(domain)
+    isTargetVariableAndDomain = lambda f:startsWithVariable(f) and endsWithDomain(f)
+    filtered_ftp_ascii_list = list(set([f for f in ftp_ascii_list if isTargetVariableAndDomain(f)]))
+
+    isWithinDatetimeRange = lambda f:getDatetimeFromASCII(f) >= end_dt and getDatetimeFromASCII(f) <= start_dt
+    asciis_within_datetime_range_list = [f for f in filtered_ftp_ascii_list if isWithinDatetimeRange(f)]
+    missing_ascii_list = [ascii for ascii in asciis_within_datetime_range_list if ascii not in current_asciis_processed_list]
+    missing_ascii_list.sort(key=lambda x:x.split("_")[1]+"_"+x.split("_")[2])
+
+    createWholeDayDatetime = lambda d :datetime(d.year, d.month, d.day)
+    onlyDaylastASCIIProcessedDatetime = createWholeDayDatetime(last_processed_datetime)
+    greatestDatetimeFromMissingASCIIList = getDatetimeFromASCII(max(missing_ascii_list)) if missing_ascii_list else start_dt
+    onlyDaygreatestDatetimeFromMissingASCIIList = createWholeDayDatetime(greatestDatetimeFromMissingASCIIList)
+    greaterASCIIFileIsAvailable = onlyDaylastASCIIProcessedDatetime < onlyDaygreatestDatetimeFromMissingASCIIList
+
+    createASCIIDatetime = lambda x: createWholeDayDatetime(datetime.strptime(x.split("_")[1][:-2], ASCII_DATETIME_FORMAT[:-2]))
+    differenceInDaysFromLastASCIIProcess = lambda x: (last_processed_datetime - x).days
+    isCorrectFrameForGreaterThanADay = lambda x: int(x.split("_")[2]) < 24
+    withinOneDayRangePositive = lambda x: abs(differenceInDaysFromLastASCIIProcess(createASCIIDatetime(x))) < 1
+    isLatestASCIIFileAvailable = lambda x : greaterASCIIFileIsAvailable and createASCIIDatetime(x) == onlyDaygreatestDatetimeFromMissingASCIIList
+    isValidGreaterThan24HourFrame = lambda x: withinOneDayRangePositive(x) or isLatestASCIIFileAvailable(x)
+    isValidLessThan24HourFrame = lambda x: not withinOneDayRangePositive(x) and isCorrectFrameForGreaterThanADay(x)
+
+    asciiIsValidToDownload = lambda ascii_to_check: isValidGreaterThan24HourFrame(ascii_to_check) or isValidLessThan24HourFrame(ascii_to_check)
+
+    return [ascii for ascii in missing_ascii_list if asciiIsValidToDownload(ascii)]
+
+
+def selectorValidateExtract(ftp_ascii_list, current_asciis_processed_list, last_processed_datetime, wrf_var, domain, start_dt, end_dt):
+
+    ascii_selector = WRFASCIISelector({'wrf_variable':wrf_var, 'domain':domain, 'ftp_ascii_datetime_format':ASCII_DATETIME_FORMAT})
+
+    records = ascii_selector.getRecords(ftp_ascii_list)
+    missing_records = ascii_selector.getUnprocessedRecordsWithinDatetimeRange(records, current_asciis_processed_list, start_dt, end_dt)
+    max_model_runtime = ascii_selector.getMaxModelRuntime(missing_records, start_dt)
+
+    return [r.file_name for r in ascii_selector.getCorrectHourlyFrameRecords(missing_records, last_processed_datetime, max_model_runtime)]
+
+
+def timeValidation(validate_function, repeat, *args):
+
+    start_time = time.time()
+    for i in range(repeat):
+        asciis_to_process_list = validate_function(*args)
+
+    return ((time.time() - start_time) / repeat, asciis_to_process_list)
+
+
+def main(*args, **kwargs):
+
+    number_of_files = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    random_state = random.Random(0)
+    last_runtime = datetime(2012, 8, 20, 6)
+    start_dt, end_dt = last_runtime + timedelta(hours=6), last_runtime - timedelta(days=6)
+    wrf_var, domain = 'apcp', 'd01'
+
+    ftp_ascii_list = createSyntheticListing(number_of_files, last_runtime, random_state)
+
+    # the raster mosaic dataset has every frame of the runtimes up to two days before the latest runtime, the same as a run missed for two days
+    last_processed_datetime = last_runtime - timedelta(days=2)
+    current_asciis_processed_list = sorted(
+        f for f in set(ftp_ascii_list)
+        if f.split("_")[0] == wrf_var and f.split(".")[0].endswith(domain) and datetime.strptime(f.split("_")[1], ASCII_DATETIME_FORMAT) <= last_processed_datetime
+    )
+
+    validation_args = (ftp_ascii_list, current_asciis_processed_list, last_processed_datetime, wrf_var, domain, start_dt, end_dt)
+    legacy_seconds, legacy_asciis_to_process_list = timeValidation(legacyValidateExtract, repeat, *validation_args)
+    selector_seconds, selector_asciis_to_process_list = timeValidation(selectorValidateExtract, repeat, *validation_args)
+
+    print "files: %s, processed files: %s, files to process: %s" % (len(ftp_ascii_list), len(current_asciis_processed_list), len(selector_asciis_to_process_list))
+    print "legacy validation:   %.4f seconds" % legacy_seconds
+    print "selector validation: %.4f seconds" % selector_seconds
+    print "speedup: %.1fx, identical files to process: %s" % (legacy_seconds / selector_seconds, legacy_asciis_to_process_list == selector_asciis_to_process_list)
+
+
+# method called upon module execution to start the benchmark
+if __name__ == '__main__':
+    main()
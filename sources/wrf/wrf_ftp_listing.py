@@ -0,0 +1,156 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+
+# standard library
+from collections import namedtuple
+from datetime import datetime
+
+# ETL utils
+from etl_utils import FTPDownloadManager
+
+
+# a parsed WRF ASCII file name: apcp10h_2012082006_10_d01.asc.gz --> ('apcp10h_2012082006_10_d01.asc.gz', 'apcp10h', 2012-AUG-20 6:00AM, 10, 'd01')
+WRFASCIIRecord = namedtuple('WRFASCIIRecord', ['file_name', 'wrf_variable', 'model_runtime', 'forecast_hour', 'domain'])
+
+
+class WRFFTPListing(object):
+
+    """
+        Class WRFFTPListing lists each WRF FTP directory once per run and indexes its ASCII files by (wrf_variable, domain), so the WRFExtractor of every
+        variable and domain receives only its own files instead of listing the directory again. This module does not depend on arcpy.
+
+        The high-level steps to index a directory include:
+
+            1) list the file names of the directory with a single FTP connection the first time the directory is requested
+            2) parse every file name into a WRFASCIIRecord (<wrf_var>_<model runtime>_<forecast hour>_<domain>.asc.gz), names that do not parse are skipped
+            3) group the records by (wrf_variable, domain), without duplicates and sorted so the OLDEST ASCII files come first
+
+        A listing holds no FTP connection between calls, so a listing (or a subset of it) can be passed to the processes of a multiprocessing.Pool.
+
+        listing_options <dict>:
+
+            'ftp_options' <dict>: the FTPDownloadManager ftp_options of the FTP to list
+            'ftp_directories' <list>: the FTP directories listed by listDirectories()
+            'target_file_extn' <str>: optional, only the files that end with the given extension are indexed, default None
+            'ftp_ascii_datetime_format' <str>: optional, the datetime format of the model runtime in the file names, default '%Y%m%d%H'
+
+        public interface:
+
+            listDirectories() <int>: lists and indexes every directory of 'ftp_directories' that is not indexed yet and returns the number of indexed records
+            getRecords(ftp_directory, wrf_variable, domain) <list>: returns the WRFASCIIRecords of the given variable and domain in the given directory
+            getFileNames(ftp_directory, wrf_variable, domain) <list>: returns the file names of getRecords()
+            getSubset(wrf_variable, domain) <WRFFTPListing>: returns a listing of only the given variable and domain's records of every directory
+            parseFileName(file_name, ftp_ascii_datetime_format='%Y%m%d%H', model_runtime_cache=None) <WRFASCIIRecord>: returns the record of the given file name, None if
+            it does not parse. model_runtime_cache is an optional dict of {model runtime string: datetime} shared by the calls, since the files of a model run share a runtime
+    """
+
+    def __init__(self, listing_options):
+
+        self.ftp_options = listing_options['ftp_options']
+        self.ftp_directories = listing_options['ftp_directories']
+        self.target_file_extn = listing_options.get('target_file_extn', None)
+        self.ftp_ascii_datetime_format = listing_options.get('ftp_ascii_datetime_format', '%Y%m%d%H')
+        self.debug_logger = listing_options.get('debug_logger',lambda*a,**kwa:None)
+
+        self.directory_index = {} # ftp_directory: {(wrf_variable, domain): [WRFASCIIRecord, ...]}
+
+    def listDirectories(self):
+
+        unlisted_directories = [d for d in self.ftp_directories if d not in self.directory_index]
+        if unlisted_directories:
+
+            ftp_download_manager = FTPDownloadManager(self.ftp_options)
+            ftp_download_manager.openConnection()
+            try:
+                for ftp_directory in unlisted_directories:
+                    self._indexDirectory(ftp_directory, ftp_download_manager.getFileNamesFromDirectory(ftp_directory, self.target_file_extn))
+            finally:
+                ftp_download_manager.closeConnection()
+
+        return sum(len(records) for index in self.directory_index.values() for records in index.values())
+
+    def getRecords(self, ftp_directory, wrf_variable, domain):
+
+        if ftp_directory not in self.directory_index:
+
+            if ftp_directory not in self.ftp_directories:
+                self.ftp_directories = self.ftp_directories + [ftp_directory]
+            self.listDirectories()
+
+        return list(self.directory_index[ftp_directory].get((wrf_variable, domain), []))
+
+    def getFileNames(self, ftp_directory, wrf_variable, domain):
+
+        return [record.file_name for record in self.getRecords(ftp_directory, wrf_variable, domain)]
+
+    def getSubset(self, wrf_variable, domain):
+
+        self.listDirectories()
+
+        wrf_ftp_listing = WRFFTPListing({
+            'ftp_options':self.ftp_options,
+            'ftp_directories':list(self.ftp_directories),
+            'target_file_extn':self.target_file_extn,
+            'ftp_ascii_datetime_format':self.ftp_ascii_datetime_format
+        })
+
+        for ftp_directory, index in self.directory_index.items():
+            wrf_ftp_listing.directory_index[ftp_directory] = {(wrf_variable, domain):list(index.get((wrf_variable, domain), []))}
+
+        return wrf_ftp_listing
+
+    def __getstate__(self):
+
+        # the debug logger is left out so the listing can be pickled to the processes of a multiprocessing.Pool
+        listing_state = dict(self.__dict__)
+        del listing_state['debug_logger']
+
+        return listing_state
+
+    def __setstate__(self, listing_state):
+
+        self.__dict__.update(listing_state)
+        self.debug_logger = lambda*a,**kwa:None
+
+    def _indexDirectory(self, ftp_directory, ftp_file_names):
+
+        index = {}
+        model_runtime_cache = {}
+        skipped_file_names = 0
+
+        for file_name in set(ftp_file_names): # remove all possible duplicates from the list (if duplicates exists on the FTP)
+
+            record = WRFFTPListing.parseFileName(file_name, self.ftp_ascii_datetime_format, model_runtime_cache)
+            if record:
+                index.setdefault((record.wrf_variable, record.domain), []).append(record)
+            else:
+                skipped_file_names += 1
+
+        for records in index.values():
+            records.sort(key=lambda r:(r.model_runtime, r.forecast_hour)) # sort so that the OLDEST ASCII files are processed first
+
+        self.directory_index[ftp_directory] = index
+        self.debug_logger("indexed", ftp_directory, "files:", len(ftp_file_names), "variable and domain groups:", len(index), "skipped:", skipped_file_names)
+
+    @staticmethod
+    def parseFileName(file_name, ftp_ascii_datetime_format='%Y%m%d%H', model_runtime_cache=None):
+
+        # apcp10h_2012082006_10_d01.asc.gz --> apcp10h, 2012-AUG-20 6:00AM, 10, d01
+        name_parts = file_name.split(".")[0].split("_")
+        if len(name_parts) != 4:
+            return None
+
+        wrf_variable, model_runtime_string, forecast_hour_string, domain = name_parts
+        try:
+            if model_runtime_cache is None:
+                model_runtime = datetime.strptime(model_runtime_string, ftp_ascii_datetime_format)
+            elif model_runtime_string in model_runtime_cache:
+                model_runtime = model_runtime_cache[model_runtime_string]
+            else:
+                model_runtime = model_runtime_cache[model_runtime_string] = datetime.strptime(model_runtime_string, ftp_ascii_datetime_format)
+
+            return WRFASCIIRecord(file_name, wrf_variable, model_runtime, int(forecast_hour_string), domain)
+
+        except ValueError:
+            return None
@@ -4,13 +4,18 @@
 # standard library
 from datetime import datetime, timedelta
 import os
-import httplib
 import urllib
 import json
+import threading
+import tempfile
 
 # third-party
 import arcpy
 
+# ETL utils
+from etl_utils import HTTPConnectionPool
+from grid_utils import RasterStatistics
+
 
 class FileGeoDatabase(object):
     
@@ -270,6 +275,22 @@ class RasterCatalog(ArcTable):
                 options.get('spatial_grid_2',''), options.get('spatial_grid_3',''), options.get('raster_management_type',''), options.get('template_raster_catalog','')
             )
             
+    def getRasterFullpath(self, raster_name, input_field_name="Name"):
+        
+        """
+            This method returns the fullpath of the given raster in the raster catalog ex: <fullpath>\Raster.OBJECTID=12, so geoprocessing tools 
+            can be run on the catalog's copy of a raster. If several rows have the given raster_name, the last one added is returned. 
+        """
+        
+        oid_field = arcpy.Describe(self.fullpath).OIDFieldName
+        where_clause = "%s = \'%s\'" % (input_field_name, raster_name)
+        object_ids = [int(oid) for oid in self.arc_table_utils.getValuesFromField(self.fullpath, where_clause, oid_field)]
+        
+        if not object_ids:
+            raise ValueError("raster %s is not in the raster catalog %s" % (raster_name, self.fullpath))
+        
+        return os.path.join(self.fullpath, "Raster.%s=%s" % (oid_field, max(object_ids)))
+            
             
 class RasterMosaicDataset(ArcTable):
     
@@ -283,17 +304,157 @@ class RasterMosaicDataset(ArcTable):
         if not arcpy.Exists(self.fullpath):
             arcpy.CreateMosaicDataset_management(output_basepath, dataset_name, coordinate_system, options.get('num_bands'), options.get('pixel_type'))
 
-           
+
+
+class ArcRasterStatisticsUtils(object):
+    
+    """
+        Utility object that computes the RasterStatistics of every band of a raster with arcpy.RasterToNumPyArray and writes them
+        as the raster's statistics with arcpy.SetRasterProperties_management, so ArcGIS does not calculate them in a separate pass.
+    """
+    
+    # the fields of RasterStatistics.getFieldValues(): (name, type, length)
+    STATISTICS_FIELDS = [
+        ('stats_min', 'DOUBLE', 25),
+        ('stats_max', 'DOUBLE', 25),
+        ('stats_mean', 'DOUBLE', 25),
+        ('stats_std', 'DOUBLE', 25),
+        ('stats_count', 'LONG', 10),
+        ('stats_histogram', 'TEXT', 4000)
+    ]
+    
+    def addStatisticsFields(self, table_fullpath):
+        
+        """
+            This method adds the stats_ fields that are missing from the given table (ex: a raster catalog created before the raster statistics) 
+            and returns the names of the added fields. The fields are listed once, so it is cheap enough to call on every run.
+        """
+        
+        existing_fields = set(f.name.lower() for f in arcpy.ListFields(table_fullpath))
+        missing_fields = [f for f in self.STATISTICS_FIELDS if f[0].lower() not in existing_fields]
+        
+        for field_name, field_type, field_length in missing_fields:
+            arcpy.AddField_management(table_fullpath, field_name, field_type, '', '', field_length)
+            
+        return [f[0] for f in missing_fields]
+    
+    def getBandStatistics(self, raster_fullpath, raster_statistics_config):
+        
+        """
+            This method returns a list of the RasterStatistics of each band of the given raster.
+            
+            arguments:
+            
+                raster_fullpath <str>: fullpath to a raster dataset
+                raster_statistics_config <dict>: optional 'histogram_bins' (default 256) and 'histogram_range' (default the band's minimum and maximum)
+        """
+        
+        raster_array = arcpy.RasterToNumPyArray(raster_fullpath)
+        band_arrays = raster_array if raster_array.ndim == 3 else [raster_array] # multiband rasters are returned as bands x rows x cols
+        
+        band_statistics = []
+        for band_index, band_array in enumerate(band_arrays, 1):
+            
+            nodata_value = getattr(arcpy.Describe(os.path.join(raster_fullpath, "Band_%s" % band_index)), 'noDataValue', None)
+            band_statistics.append(RasterStatistics.fromArray(
+                band_array, nodata_value, raster_statistics_config.get('histogram_bins', 256), raster_statistics_config.get('histogram_range', None)
+            ))
+            
+        return band_statistics
+    
+    def setRasterStatistics(self, raster_fullpath, band_statistics):
+        
+        # bands without valid cells are left for ArcGIS
+        if not any(s.count for s in band_statistics):
+            return
+        
+        # the stats_file carries the histograms along with the statistics
+        xml_handle, xml_fullpath = tempfile.mkstemp(".xml")
+        os.close(xml_handle)
+        try:
+            RasterStatistics.writeStatisticsXML(xml_fullpath, band_statistics)
+            arcpy.SetRasterProperties_management(raster_fullpath, "", "", xml_fullpath)
+        finally:
+            os.remove(xml_fullpath)
+            
+
+class ArcGISServiceRefreshCoalescer(object):
+    
+    """
+        Class ArcGISServiceRefreshCoalescer merges the refresh requests made by every ArcGISServiceManager in the current process. 
+        The first request opens a window of the given number of seconds and every service requested before the window closes 
+        is refreshed exactly once when it closes. A script should call flush() once it has made its last request, otherwise the process 
+        waits for the window to close before exiting.
+        
+        public interface:
+        
+            requestRefresh(service_manager, services, window_seconds) <void>: adds the given services to the current window, opens a new window if there is none
+            flush() <void>: closes the current window and refreshes all pending services immediately
+    """
+    
+    def __init__(self):
+        
+        self._pending_services = {}
+        self._window_timer = None
+        self._lock = threading.Lock()
+        
+    def requestRefresh(self, service_manager, services, window_seconds):
+        
+        if window_seconds <= 0:
+            service_manager.refreshServices(services)
+            return
+        
+        with self._lock:
+            for service_name in services:
+                self._pending_services.setdefault(service_manager.getServiceKey(service_name), (service_manager, service_name))
+            
+            # the timer thread is not a daemon thread so pending refreshes are not lost, flush() closes the window early
+            if not self._window_timer:
+                self._window_timer = threading.Timer(window_seconds, self.flush)
+                self._window_timer.start()
+                
+    def flush(self):
+        
+        with self._lock:
+            pending_services = self._pending_services.values()
+            self._pending_services = {}
+            if self._window_timer:
+                self._window_timer.cancel()
+                self._window_timer = None
+        
+        services_by_manager = {}
+        for service_manager, service_name in pending_services:
+            services_by_manager.setdefault(service_manager, []).append(service_name)
+            
+        for service_manager, services in services_by_manager.items():
+            service_manager.refreshServices(services)
+
+
+# shared by every ArcGISServiceManager so that refresh requests from different sources in the same process are coalesced
+service_refresh_coalescer = ArcGISServiceRefreshCoalescer()
+
+
 class ArcGISServiceManager(object):
     
     """
         Class ArcGISServiceManager manages the starting and stopping of ArcGIS services
         
+        The admin token is cached until it expires and all requests are sent over keep-alive connections from a shared HTTPConnectionPool.
+        Actions for independent services are executed in parallel, one thread per service.
+        
+        service_options_dict <dict>: in addition to the server and credentials options
+        
+            'services' <list>: the names of the services to manage ex: 'TRMM.MapServer'
+            'service_datasets' <dict>: optional, maps a service name to the list of dataset names it depends on. A service without an entry depends on every dataset.
+            'refresh_window_seconds' <int>: refreshServicesForDatasets() requests arriving within this many seconds are coalesced, 0 refreshes immediately
+        
         public interface:
         
-            stopServices()
-            startServices()
-            refreshServices()
+            stopServices(services=None)
+            startServices(services=None)
+            refreshServices(services=None): stops and then starts each service, each service is refreshed independently of the others
+            getServicesForDatasets(changed_datasets) <list>: returns the services that depend on any of the given dataset names
+            refreshServicesForDatasets(changed_datasets): requests a coalesced refresh of only the services that depend on the given dataset names
     """
 
     def __init__(self, service_options_dict):
@@ -304,59 +465,97 @@ class ArcGISServiceManager(object):
         self._password = service_options_dict['password']        
         self._service_dir = service_options_dict['service_dir']
         self._services = service_options_dict['services']
+        self._service_datasets = service_options_dict.get('service_datasets', {})
+        self._refresh_window_seconds = service_options_dict.get('refresh_window_seconds', 0)
+        self._token_expiration_minutes = service_options_dict.get('token_expiration_minutes', 60)
         self.debug_logger = service_options_dict.get('debug_logger',lambda*a,**kwa:None)
         self._header = {"Content-type":"application/x-www-form-urlencoded", "Accept":"text/plain"}
+        self._admin_url = "http://%s:%s/arcgis/admin" % (self._server_name, self._server_port)
+        self._connection_pool = HTTPConnectionPool({'max_idle_connections':max(1, len(self._services))})
         
-    def _executeServiceAction(self, action):
-        self.debug_logger("_executeServiceAction()")
+        self._token = None
+        self._token_expires = None
+        self._token_lock = threading.Lock()
         
-        token = self._getToken()
-        if not token:
-            return
+    def _executeServiceActions(self, actions, services=None):
+        self.debug_logger("_executeServiceActions()", actions)
         
-        try:
-            http_conn = httplib.HTTPConnection(self._server_name, self._server_port)
-            params = urllib.urlencode({'token':token,'f':'json'})
+        service_threads = [threading.Thread(target=self._executeActionsForService, args=(s, actions)) for s in (self._services if services is None else services)]
+        for service_thread in service_threads:
+            service_thread.start()
+        for service_thread in service_threads:
+            service_thread.join()
             
-            for serivce_name in self._services:
-                self.debug_logger("processing service", serivce_name)
-                
-                service_action_url = "/arcgis/admin/services/" + self._service_dir + "/" + serivce_name + "/" + action
+    def _executeActionsForService(self, serivce_name, actions):
+        self.debug_logger("processing service", serivce_name)
+        
+        for action in actions:
+            
+            token = self._getToken()
+            if not token:
+                return
+            
+            try:
+                service_action_url = self._admin_url + "/services/" + self._service_dir + "/" + serivce_name + "/" + action
                 self.debug_logger("service_action_url",service_action_url)
-                http_conn.request("POST", service_action_url, params, self._header)
-                response = http_conn.getresponse()
                 
-                self._assertResponseSuccess(response.status, response.read(), 'success')
+                status, response_data = self._postRequest(service_action_url, {'token':token,'f':'json'})
+                if 'Invalid token' in response_data: # the cached token was invalidated on the server, retry once with a new token
+                    self._clearToken()
+                    status, response_data = self._postRequest(service_action_url, {'token':self._getToken(),'f':'json'})
+                    
+                self._assertResponseSuccess(status, response_data, 'success')
+                
+            except Exception as e:
+                self.debug_logger("Exception: ",str(e))
+                
+    def _postRequest(self, url, params):
         
-        except Exception as e:
-            self.debug_logger("Exception: ",str(e))
-            
+        http_conn, response = self._connection_pool.request("POST", url, urllib.urlencode(params), self._header)
+        try:
+            return (response.status, response.read())
         finally:
-            http_conn.close()
+            self._connection_pool.releaseConnection(http_conn, response)
             
     def _getToken(self):
-        self.debug_logger("_getToken()")
-
-        try: 
-            params = urllib.urlencode({'username':self._username, 'password':self._password, 'client':'requestip', 'f':'json'})
-            http_conn = httplib.HTTPConnection(self._server_name, self._server_port)
-            http_conn.request("POST", "/arcgis/admin/generateToken", params, self._header)
-            response = http_conn.getresponse()
-            response_data = response.read()
-            
-            if self._assertResponseSuccess(response.status, response_data, 'token'):
-                
-                self.debug_logger("successfully retrieved a token")
-                return json.loads(response_data)['token']
+        
+        with self._token_lock:
             
-            else:
-                self.debug_logger("failure retrieving a token")                                              
-                                
-        except Exception as e:
-            self.debug_logger("Exception: ",str(e))
+            if self._token and datetime.utcnow() < self._token_expires:
+                return self._token
             
-        finally:
-            http_conn.close()
+            self.debug_logger("_getToken()")
+            try: 
+                params = {'username':self._username, 'password':self._password, 'client':'requestip', 'expiration':self._token_expiration_minutes, 'f':'json'}
+                status, response_data = self._postRequest(self._admin_url + "/generateToken", params)
+                
+                if self._assertResponseSuccess(status, response_data, 'token'):
+                    
+                    self.debug_logger("successfully retrieved a token")
+                    token_json = json.loads(response_data)
+                    self._token = token_json['token']
+                    self._token_expires = self._getTokenExpiration(token_json)
+                    
+                    return self._token
+                
+                else:
+                    self.debug_logger("failure retrieving a token")                                              
+                                    
+            except Exception as e:
+                self.debug_logger("Exception: ",str(e))
+                
+    def _getTokenExpiration(self, token_json):
+        
+        # 'expires' is given in milliseconds since the epoch, renew the token one minute before it expires
+        if 'expires' in token_json:
+            return datetime.utcfromtimestamp(token_json['expires'] / 1000.0) - timedelta(minutes=1)
+        
+        return datetime.utcnow() + timedelta(minutes=self._token_expiration_minutes - 1)
+    
+    def _clearToken(self):
+        
+        with self._token_lock:
+            self._token = None
                         
     def _assertResponseSuccess(self, status, response_data, target_key):
                 
@@ -380,13 +579,32 @@ class ArcGISServiceManager(object):
             self.debug_logger("JSON FAILURE: error: ",response_data)
             return False
             
-    def stopServices(self): 
-        self._executeServiceAction("STOP")
+    def stopServices(self, services=None): 
+        self._executeServiceActions(["STOP"], services)
      
-    def startServices(self):        
-        self._executeServiceAction("START")
+    def startServices(self, services=None):        
+        self._executeServiceActions(["START"], services)
 
-    def refreshServices(self):
-                
-        self.stopServices()
-        self.startServices()
\ No newline at end of file
+    def refreshServices(self, services=None):
+        
+        # each service is stopped and then immediately started in its own thread 
+        self._executeServiceActions(["STOP", "START"], services)
+        
+    def getServicesForDatasets(self, changed_datasets):
+        
+        changed_datasets = set(changed_datasets)
+        dependsOnChangedDataset = lambda s: (s not in self._service_datasets) or bool(changed_datasets.intersection(self._service_datasets[s]))
+        
+        return [s for s in self._services if dependsOnChangedDataset(s)]
+        
+    def refreshServicesForDatasets(self, changed_datasets):
+        
+        services_to_refresh = self.getServicesForDatasets(changed_datasets)
+        self.debug_logger("refreshServicesForDatasets()", list(changed_datasets), services_to_refresh)
+        
+        if services_to_refresh:
+            service_refresh_coalescer.requestRefresh(self, services_to_refresh, self._refresh_window_seconds)
+            
+    def getServiceKey(self, service_name):
+        
+        return (self._admin_url, self._service_dir, service_name)
@@ -0,0 +1,172 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+# standard library
+import struct
+import zlib
+import os
+
+# third-party
+import numpy as np
+
+
+class ColorMap(object):
+
+    """
+        Class ColorMap applies an ESRI .clr color map ("value red green blue" per line) to a numpy grid without arcpy.
+
+        The .clr file is parsed once into a lookup table indexed by cell value, so rendering a grid is a single vectorized take().
+        Cell values are truncated to integers like the integer rasters the color maps are added to. NaN, nodata and values that
+        are not in the color map are rendered with the transparent palette index 0.
+
+        public interface:
+
+            fromCLRFile(clr_fullpath) <ColorMap>: returns the ColorMap of the given .clr file, parsed files are cached until they are modified
+            toPaletted(grid, nodata_value=None) <tuple>: returns (indices, palette) where indices is a uint8 (uint16 for more than 255 colors) array of
+            the grid's shape and palette is a (colors + 1) x 4 uint8 RGBA array whose first entry is transparent
+            toRGBA(grid, nodata_value=None) <ndarray>: returns the rows x cols x 4 uint8 RGBA rendering of the grid
+            writeCLRSidecar(raster_fullpath) <str>: writes the color map as the <raster name>.clr file next to the given file based raster (ex: .flt, .tif or a grid 
+            in a folder), which ArcGIS reads as the raster's colormap and CopyRaster copies with it, and returns its fullpath
+    """
+
+    _color_map_cache = {} # clr fullpath: (modified time, ColorMap)
+
+    def __init__(self, values, colors):
+
+        self.values = values
+        self.colors = colors
+
+        # palette index 0 is transparent, the color of values[i] is palette index i + 1
+        self.palette = np.zeros((len(values) + 1, 4), np.uint8)
+        self.palette[1:, :3] = colors
+        self.palette[1:, 3] = 255
+
+        self.min_value = int(values.min())
+        self.lookup_table = np.zeros(int(values.max()) - self.min_value + 1, np.uint8 if len(values) < 256 else np.uint16)
+        self.lookup_table[values - self.min_value] = np.arange(1, len(values) + 1)
+
+    @staticmethod
+    def fromCLRFile(clr_fullpath):
+
+        modified_time = os.path.getmtime(clr_fullpath)
+        cached_color_map = ColorMap._color_map_cache.get(clr_fullpath, None)
+
+        if cached_color_map and cached_color_map[0] == modified_time:
+            return cached_color_map[1]
+
+        color_map = ColorMap(*ColorMap._readCLRFile(clr_fullpath))
+        ColorMap._color_map_cache[clr_fullpath] = (modified_time, color_map)
+
+        return color_map
+
+    @staticmethod
+    def _readCLRFile(clr_fullpath):
+
+        color_map_entries = []
+        with open(clr_fullpath, "r") as clr_file:
+
+            for line in clr_file:
+
+                line_values = line.split('#')[0].split()
+                if len(line_values) >= 4: # skip blank and comment lines
+                    color_map_entries.append([int(float(v)) for v in line_values[:4]])
+
+        if not color_map_entries:
+            raise ValueError("no color map entries in %s" % clr_fullpath)
+
+        color_map_entries = np.array(color_map_entries, np.int64)
+
+        return (color_map_entries[:, 0], np.clip(color_map_entries[:, 1:], 0, 255))
+
+    def toPaletted(self, grid, nodata_value=None):
+
+        grid = np.asarray(grid)
+        is_colored = np.isfinite(grid)
+        if nodata_value is not None:
+            is_colored &= (grid != nodata_value)
+
+        # cells outside of the lookup table are pointed at index 0 of the table and masked below
+        lookup_indices = np.zeros(grid.shape, np.int64)
+        lookup_indices[is_colored] = np.floor(grid[is_colored]).astype(np.int64) - self.min_value
+        is_colored &= (lookup_indices >= 0) & (lookup_indices < len(self.lookup_table))
+        lookup_indices[~is_colored] = 0
+
+        indices = self.lookup_table.take(lookup_indices)
+        indices[~is_colored] = 0
+
+        return (indices, self.palette)
+
+    def toRGBA(self, grid, nodata_value=None):
+
+        indices, palette = self.toPaletted(grid, nodata_value)
+
+        return palette.take(indices, axis=0)
+
+    def writeCLRSidecar(self, raster_fullpath):
+
+        clr_fullpath = os.path.splitext(raster_fullpath)[0] + ".clr"
+        with open(clr_fullpath, "w") as clr_file:
+            clr_file.write("".join("%d %d %d %d\n" % ((value,) + tuple(color)) for value, color in zip(self.values, self.colors)))
+
+        return clr_fullpath
+
+
+class PNGWriter(object):
+
+    """
+        Class PNGWriter writes paletted or RGBA numpy images (ex: the output of a ColorMap) as PNG quick-look images with zlib.
+
+        public interface:
+
+            writePaletted(png_fullpath, indices, palette) <str>: writes an 8-bit paletted PNG with the palette's alpha as its transparency,
+            palettes of more than 256 colors are written as RGBA
+            writeRGBA(png_fullpath, rgba) <str>: writes a rows x cols x 4 uint8 array as an 8-bit RGBA PNG
+    """
+
+    PNG_SIGNATURE = "\x89PNG\r\n\x1a\n"
+    COLOR_TYPE_PALETTE, COLOR_TYPE_RGBA = 3, 6
+
+    @staticmethod
+    def writePaletted(png_fullpath, indices, palette):
+
+        if len(palette) > 256:
+            return PNGWriter.writeRGBA(png_fullpath, palette.take(indices, axis=0))
+
+        palette = np.asarray(palette, np.uint8)
+        chunks = [
+            ("PLTE", palette[:, :3].tostring()),
+            ("tRNS", palette[:, 3].tostring())
+        ]
+
+        return PNGWriter._writePNG(png_fullpath, np.asarray(indices, np.uint8), PNGWriter.COLOR_TYPE_PALETTE, chunks)
+
+    @staticmethod
+    def writeRGBA(png_fullpath, rgba):
+
+        rows, cols, bands = rgba.shape
+
+        return PNGWriter._writePNG(png_fullpath, np.asarray(rgba, np.uint8).reshape(rows, cols * bands), PNGWriter.COLOR_TYPE_RGBA, [])
+
+    @staticmethod
+    def _writePNG(png_fullpath, scanlines, color_type, chunks):
+
+        rows = scanlines.shape[0]
+        cols = scanlines.shape[1] if color_type == PNGWriter.COLOR_TYPE_PALETTE else scanlines.shape[1] // 4
+
+        # every scanline starts with filter type 0 (none)
+        filtered_scanlines = np.zeros((rows, scanlines.shape[1] + 1), np.uint8)
+        filtered_scanlines[:, 1:] = scanlines
+
+        chunks = [("IHDR", struct.pack(">IIBBBBB", cols, rows, 8, color_type, 0, 0, 0))] + chunks
+        chunks += [("IDAT", zlib.compress(filtered_scanlines.tostring(), 6)), ("IEND", "")]
+
+        with open(png_fullpath, "wb") as png_file:
+
+            png_file.write(PNGWriter.PNG_SIGNATURE)
+            for chunk_type, chunk_data in chunks:
+
+                png_file.write(struct.pack(">I", len(chunk_data)))
+                png_file.write(chunk_type + chunk_data)
+                png_file.write(struct.pack(">I", zlib.crc32(chunk_type + chunk_data) & 0xffffffff))
+
+        return png_fullpath
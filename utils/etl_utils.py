@@ -6,7 +6,11 @@ import os
 from shutil import rmtree
 from datetime import datetime
 import ftplib
-import urllib2
+import httplib
+import urlparse
+import socket
+import threading
+import time
 import gzip, zipfile
 import logging
 from logging.handlers import RotatingFileHandler
@@ -14,10 +18,131 @@ import xml.dom.minidom
 from xml.dom.minidom import Node, Document
 
 
+class HTTPConnectionPool(object):
+    
+    """
+        Class HTTPConnectionPool keeps idle keep-alive HTTP connections so that consecutive requests to the same host re-use an open 
+        socket instead of opening a new connection for every request. A single instance can be shared between threads.
+        
+        constructor arguments:
+        
+            pool_options <dict>:
+            
+                'max_idle_connections' <int>: maximum number of idle connections kept per host
+                'timeout' <int>: socket timeout in seconds for new connections
+                
+        public interface:
+        
+            request(method, url, body=None, headers=None) <tuple>: sends the request over a pooled connection and returns (connection, response)
+            releaseConnection(http_conn, response) <void>: returns the connection to the pool if the response was fully read, otherwise closes it
+            closeConnections() <void>: closes all idle connections in the pool
+    """
+    
+    def __init__(self, pool_options=None):
+        
+        if not pool_options:
+            pool_options = {}
+        
+        self.max_idle_connections = pool_options.get('max_idle_connections', 4)
+        self.timeout = pool_options.get('timeout', 60)
+        self._idle_connections = {}
+        self._lock = threading.Lock()
+        
+    def request(self, method, url, body=None, headers=None):
+        
+        scheme, host, request_path = self._splitURL(url)
+        pooled_conn = self._getIdleConnection((scheme, host))
+        http_conn = pooled_conn or self._createConnection(scheme, host)
+        
+        try:
+            return http_conn, self._sendRequest(http_conn, method, request_path, body, headers)
+        
+        except (httplib.HTTPException, socket.error):
+            http_conn.close()
+            if not pooled_conn:
+                raise
+            
+            # the server closed the idle keep-alive connection, retry once over a new connection
+            http_conn = self._createConnection(scheme, host)
+            return http_conn, self._sendRequest(http_conn, method, request_path, body, headers)
+        
+    def releaseConnection(self, http_conn, response):
+        
+        # a connection can only be re-used once its previous response has been completely read
+        is_reusable = response is not None and response.isclosed() and not response.will_close
+        
+        with self._lock:
+            idle_connections = self._idle_connections.setdefault(http_conn.pool_key, [])
+            if is_reusable and len(idle_connections) < self.max_idle_connections:
+                idle_connections.append(http_conn)
+                return
+            
+        http_conn.close()
+            
+    def closeConnections(self):
+        
+        with self._lock:
+            for idle_connections in self._idle_connections.values():
+                for http_conn in idle_connections:
+                    http_conn.close()
+            self._idle_connections = {}
+    
+    def _getIdleConnection(self, pool_key):
+        
+        with self._lock:
+            idle_connections = self._idle_connections.get(pool_key, [])
+            return idle_connections.pop() if idle_connections else None
+    
+    def _createConnection(self, scheme, host):
+        
+        connection_class = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+        http_conn = connection_class(host, timeout=self.timeout)
+        http_conn.pool_key = (scheme, host)
+        
+        return http_conn
+    
+    def _sendRequest(self, http_conn, method, request_path, body, headers):
+        
+        http_conn.request(method, request_path, body, headers or {})
+        return http_conn.getresponse()
+        
+    def _splitURL(self, url):
+        
+        url_parts = urlparse.urlsplit(url)
+        request_path = url_parts.path or "/"
+        if url_parts.query:
+            request_path += "?" + url_parts.query
+            
+        return (url_parts.scheme or 'http', url_parts.netloc, request_path)
+
+
+class HTTPStatusError(IOError):
+
+    """
+        Class HTTPStatusError is raised by the URLDownloadManager for a response with an HTTP error status (>= 400), its 'status' field is the status code.
+    """
+
+    def __init__(self, status, message):
+        IOError.__init__(self, message)
+
+        self.status = status
+
+
 class URLDownloadManager(object):
 
     """
-        Class URLDownloadManager manages URL downloading operations.
+        Class URLDownloadManager manages URL downloading operations. All requests are sent over keep-alive connections from an HTTPConnectionPool.
+        
+        constructor arguments:
+        
+            download_options <dict>:
+            
+                'connection_pool' <HTTPConnectionPool>: optional pool to share with other objects, a new pool is created if not given
+                'pool_options' <dict>: options for the new HTTPConnectionPool
+                'max_redirects' <int>: maximum number of redirects to follow for a single request
+                'max_retries' <int>: maximum number of times an interrupted file download is retried within the same run
+                'retry_backoff_seconds' <int>: seconds to wait before the first retry, doubled for each following retry
+                'max_retry_backoff_seconds' <int>: upper bound for the seconds to wait between retries
         
         public interface:
         
@@ -25,29 +150,194 @@ class URLDownloadManager(object):
             first check the response header to deteremine if the content types match before downloading.
             
             downloadResultFromURL(url, downloaded_file_path, content_types=[]) <str>: This method downloads the object returned from the given URL into the given downloaded_file_path.
+            Interrupted downloads are retried and resumed with HTTP range requests when the server supports them.
+            
+            getResultsFromURLs(url_requests) <list>: This method retrieves every request in the given url_requests list concurrently. Each request is a dictionary with the keys 
+            'url', 'content_types' and optionally 'downloaded_file_path'. As soon as one response is unavailable (its content type does not match) the other requests 
+            skip downloading their content. Returns a list of results in the same order as url_requests, None for each unavailable or skipped request.
     """
+    
+    def __init__(self, download_options=None):
+        
+        if not download_options:
+            download_options = {}
+            
+        self.connection_pool = download_options.get('connection_pool', None) or HTTPConnectionPool(download_options.get('pool_options', None))
+        self.max_redirects = download_options.get('max_redirects', 5)
+        self.max_retries = download_options.get('max_retries', 3)
+        self.retry_backoff_seconds = download_options.get('retry_backoff_seconds', 2)
+        self.max_retry_backoff_seconds = download_options.get('max_retry_backoff_seconds', 30)
                
     def getResultFromURL(self, url, content_types=[]):
+        
+        return self._getResultForURLRequest({'url':url, 'content_types':content_types}, threading.Event())
 
-        response = urllib2.urlopen(url)
+    def downloadResultFromURL(self, url, downloaded_file_path, content_types=[]):
+        
+        return self._getResultForURLRequest({'url':url, 'content_types':content_types, 'downloaded_file_path':downloaded_file_path}, threading.Event())
+    
+    def getResultsFromURLs(self, url_requests):
+        
+        results = [None] * len(url_requests)
+        exceptions = []
+        is_unavailable = threading.Event() # shared between the requests so that an unavailable result cancels the others
+        
+        def getResult(index, url_request):
+            try:
+                results[index] = self._getResultForURLRequest(url_request, is_unavailable)
+            except Exception as e:
+                is_unavailable.set()
+                exceptions.append(e)
+                
+        request_threads = [threading.Thread(target=getResult, args=(i, r)) for i, r in enumerate(url_requests)]
+        for request_thread in request_threads:
+            request_thread.start()
+        for request_thread in request_threads:
+            request_thread.join()
+            
+        if exceptions:
+            raise exceptions[0]
+        
+        return results
+    
+    def _getResultForURLRequest(self, url_request, is_unavailable):
+        
+        if url_request.get('downloaded_file_path', None):
+            return self._downloadURLRequestToFile(url_request, is_unavailable)
+        
+        http_conn, response = self._openURL(url_request['url'])
         try:
-            if content_types:
-                return response.read() if (response.info()['Content-Type'] in content_types) else None
-            else:
-                return response.read()
+            if not self._isAvailable(response, url_request, is_unavailable):
+                return None
+            
+            return response.read()
+        
         finally:
-            response.close()
-
-    def downloadResultFromURL(self, url, downloaded_file_path, content_types=[]):
+            self.connection_pool.releaseConnection(http_conn, response)
+            
+    def _downloadURLRequestToFile(self, url_request, is_unavailable):
         
-        file_to_download = self.getResultFromURL(url, content_types)
+        """
+            This method downloads the given url_request into a '.part' file and renames it to the 'downloaded_file_path' once the 
+            number of bytes written matches the Content-Length of the response. If the download is interrupted (or the server answers with a 5xx status) it is retried 
+            with a bounded exponential backoff, resuming from the bytes already written with a 'Range' request when the server advertises 'Accept-Ranges: bytes'.
+            The content type and length are validated on the first response that arrives, a 416 (range not satisfiable) restarts the download without a 'Range'.
+        """
+        
+        url = url_request['url']
+        downloaded_file_path = url_request['downloaded_file_path']
+        partial_file_path = downloaded_file_path + ".part"
+        content_length, accepts_ranges = None, False
+        is_validated = False # set once a response arrives, an attempt that fails before its response does not validate the download
+        
+        for attempt in range(self.max_retries + 1):
             
-        if file_to_download: 
-                        
-            with open(downloaded_file_path, "wb") as downloaded_image:
-                downloaded_image.write(file_to_download)
+            downloaded_bytes = os.path.getsize(partial_file_path) if os.path.isfile(partial_file_path) else 0
+            can_resume = is_validated and accepts_ranges and (downloaded_bytes > 0)
             
-            return downloaded_file_path
+            http_conn, response = None, None
+            try:
+                http_conn, response = self._openURL(url, {'Range':'bytes=%s-' % downloaded_bytes} if can_resume else None)
+                
+                if not is_validated:
+                    if not self._isAvailable(response, url_request, is_unavailable):
+                        return None
+                    
+                    content_length = int(response.getheader('Content-Length')) if response.getheader('Content-Length') else None
+                    accepts_ranges = response.getheader('Accept-Ranges', '').lower() == 'bytes'
+                    is_validated = True
+                
+                # the server may answer a range request with the full content (200) instead of a partial response (206)
+                is_resumed = can_resume and response.status == 206
+                if is_resumed and self._getContentRangeStart(response) != downloaded_bytes:
+                    
+                    os.remove(partial_file_path) # the partial response does not continue the bytes written, start again from the first byte
+                    raise httplib.IncompleteRead("Content-Range %s does not start at byte %s" % (response.getheader('Content-Range'), downloaded_bytes))
+                    
+                self._writeResponseToFile(response, partial_file_path, "ab" if is_resumed else "wb")
+                
+                downloaded_bytes = os.path.getsize(partial_file_path)
+                if content_length is None or downloaded_bytes == content_length:
+                    
+                    if os.path.isfile(downloaded_file_path):
+                        os.remove(downloaded_file_path)
+                    os.rename(partial_file_path, downloaded_file_path)
+                    
+                    return downloaded_file_path
+                
+                if downloaded_bytes > content_length:
+                    os.remove(partial_file_path) # the content changed while downloading, start again from the first byte
+                    
+                raise httplib.IncompleteRead("downloaded %s of %s bytes" % (downloaded_bytes, content_length))
+                
+            except HTTPStatusError as e:
+                
+                if attempt == self.max_retries or not (e.status == 416 or e.status >= 500):
+                    raise
+                
+                if e.status == 416 and os.path.isfile(partial_file_path):
+                    os.remove(partial_file_path) # the bytes written are not a prefix of the content anymore, the retry requests the full content
+                
+                retry_seconds = min(self.retry_backoff_seconds * (2 ** attempt), self.max_retry_backoff_seconds)
+                time.sleep(retry_seconds)
+                
+            except (httplib.HTTPException, socket.error):
+                
+                if attempt == self.max_retries:
+                    raise
+                
+                retry_seconds = min(self.retry_backoff_seconds * (2 ** attempt), self.max_retry_backoff_seconds)
+                time.sleep(retry_seconds)
+                
+            finally:
+                if http_conn:
+                    self.connection_pool.releaseConnection(http_conn, response)
+                    
+    def _getContentRangeStart(self, response):
+        
+        # Content-Range: bytes 1000-4999/5000 --> 1000
+        try:
+            return int(response.getheader('Content-Range', '').split()[1].split("-")[0])
+        except (IndexError, ValueError):
+            return None
+        
+    def _isAvailable(self, response, url_request, is_unavailable):
+        
+        content_types = url_request.get('content_types', [])
+        if content_types and (response.getheader('Content-Type') not in content_types):
+            is_unavailable.set()
+            return False
+        
+        # another concurrent request is unavailable, skip downloading the content
+        return not is_unavailable.is_set()
+    
+    def _openURL(self, url, headers=None):
+        
+        for redirect in range(self.max_redirects + 1):
+            
+            http_conn, response = self.connection_pool.request("GET", url, headers=headers)
+            
+            if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                response.read()
+                self.connection_pool.releaseConnection(http_conn, response)
+                url = urlparse.urljoin(url, response.getheader('Location'))
+                continue
+                
+            if response.status >= 400:
+                self.connection_pool.releaseConnection(http_conn, None)
+                raise HTTPStatusError(response.status, "HTTP error %s %s: %s" % (response.status, response.reason, url))
+            
+            return http_conn, response
+        
+        raise IOError("exceeded %s redirects: %s" % (self.max_redirects, url))
+    
+    def _writeResponseToFile(self, response, downloaded_file_path, file_mode="wb", chunk_size=65536):
+        
+        with open(downloaded_file_path, file_mode) as downloaded_file:
+            chunk = response.read(chunk_size)
+            while chunk:
+                downloaded_file.write(chunk)
+                chunk = response.read(chunk_size)
 
    
 class FTPDownloadManager(object):
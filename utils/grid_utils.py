@@ -0,0 +1,298 @@
+# Developer: SpatialDev
+# Company:   Spatial Development International
+
+# standard library
+import struct
+import re
+
+# third-party
+import numpy as np
+
+
+class RasterGridWriter(object):
+
+    """
+        Class RasterGridWriter writes georeferenced single band rasters from numpy arrays without arcpy.
+
+        Every writer expects a 2D array whose first row is the northern most row and georeferences it with the
+        lower left corner (lower_left_x, lower_left_y) and the square cellsize of the grid.
+
+        public interface:
+
+            writeRaster(array, raster_fullpath, raster_format, georeference, nodata_value, spatial_reference=None) <str>: This method writes the array with the given
+            raster_format ('FLT' or 'TIF') and returns the fullpath of the raster including its extension. georeference is a tuple of (lower_left_x, lower_left_y, cellsize).
+            A GeoTIFF can only be written in WGS84 geographic coordinates, a ValueError is raised for any other spatial_reference.
+
+            writeFloatGrid(array, raster_fullpath, georeference, nodata_value, spatial_reference=None) <str>: This method writes an ESRI float grid (.flt with its .hdr header). If a
+            spatial_reference WKT string is given it is written to the .prj file of the grid.
+
+            writeGeoTIFF(array, raster_fullpath, georeference, nodata_value, epsg_code=4326) <str>: This method writes an uncompressed float32 GeoTIFF in the given geographic
+            coordinate system (EPSG code) with the nodata value stored in the GDAL_NODATA tag.
+    """
+
+    WGS84_NAMES = ('GCS_WGS_1984', 'WGS 84', 'WGS84') # the GEOGCS names of the WGS84 WKT of ESRI and EPSG
+
+    @staticmethod
+    def writeRaster(array, raster_fullpath, raster_format, georeference, nodata_value, spatial_reference=None):
+
+        if raster_format.upper() == 'TIF':
+            return RasterGridWriter.writeGeoTIFF(array, raster_fullpath, georeference, nodata_value, RasterGridWriter._getGeoTIFFEPSGCode(spatial_reference))
+
+        return RasterGridWriter.writeFloatGrid(array, raster_fullpath, georeference, nodata_value, spatial_reference)
+
+    @staticmethod
+    def _getGeoTIFFEPSGCode(spatial_reference):
+
+        # the GeoTIFF GeoKeys are only written for WGS84 geographic coordinates, the default without a spatial_reference
+        if not spatial_reference:
+            return 4326
+
+        wkt = spatial_reference.strip()
+        geographic_match = re.match(r"""GEOGCS\[\s*["']([^"']*)["']""", wkt, re.IGNORECASE) # a projected (PROJCS) WKT does not match
+        if not geographic_match or geographic_match.group(1) not in RasterGridWriter.WGS84_NAMES:
+            raise ValueError("a GeoTIFF can only be written in WGS84 geographic coordinates, use the 'FLT' raster_format for: %s" % wkt[:80])
+
+        return 4326
+
+    @staticmethod
+    def writeFloatGrid(array, raster_fullpath, georeference, nodata_value, spatial_reference=None):
+
+        lower_left_x, lower_left_y, cellsize = georeference
+        rows, cols = array.shape
+        flt_fullpath = raster_fullpath + ".flt"
+
+        with open(raster_fullpath + ".hdr", "w") as hdr_file:
+            hdr_file.write("ncols %s\nnrows %s\n" % (cols, rows))
+            hdr_file.write("xllcorner %r\nyllcorner %r\ncellsize %r\n" % (float(lower_left_x), float(lower_left_y), float(cellsize)))
+            hdr_file.write("NODATA_value %r\nbyteorder LSBFIRST\n" % float(nodata_value))
+
+        np.asarray(array, '<f4').tofile(flt_fullpath)
+
+        if spatial_reference:
+            with open(raster_fullpath + ".prj", "w") as prj_file:
+                prj_file.write(spatial_reference)
+
+        return flt_fullpath
+
+    @staticmethod
+    def writeGeoTIFF(array, raster_fullpath, georeference, nodata_value, epsg_code=4326):
+
+        lower_left_x, lower_left_y, cellsize = georeference
+        rows, cols = array.shape
+        tif_fullpath = raster_fullpath + ".tif"
+        image_data = np.asarray(array, '<f4').tostring()
+
+        upper_left_y = lower_left_y + rows * cellsize
+        nodata_string = "%r\0" % float(nodata_value)
+        geo_keys = [1, 1, 0, 3,        # GeoKeyDirectory version 1.1.0 with 3 keys
+                    1024, 0, 1, 2,     # GTModelTypeGeoKey = ModelTypeGeographic
+                    1025, 0, 1, 1,     # GTRasterTypeGeoKey = RasterPixelIsArea
+                    2048, 0, 1, epsg_code] # GeographicTypeGeoKey
+
+        # (tag, type, values) sorted by tag. types: 2 ASCII, 3 SHORT, 4 LONG, 12 DOUBLE
+        tags = [
+            (256, 4, [cols]), (257, 4, [rows]), (258, 3, [32]), (259, 3, [1]), (262, 3, [1]),
+            (273, 4, [0]), (277, 3, [1]), (278, 4, [rows]), (279, 4, [len(image_data)]), (284, 3, [1]), (339, 3, [3]),
+            (33550, 12, [cellsize, cellsize, 0.0]),
+            (33922, 12, [0.0, 0.0, 0.0, lower_left_x, upper_left_y, 0.0]),
+            (34735, 3, geo_keys),
+            (42113, 2, nodata_string)
+        ]
+        type_formats = {2:'s', 3:'H', 4:'I', 12:'d'}
+        type_sizes = {2:1, 3:2, 4:4, 12:8}
+
+        ifd_offset = 8
+        extra_data_offset = ifd_offset + 2 + len(tags) * 12 + 4
+        extra_data = ""
+        ifd_entries = []
+        packValues = lambda tag_type, values: struct.pack("<%s%s" % (len(values), type_formats[tag_type]), *([values] if tag_type == 2 else values))
+
+        # the image data is written after the header, IFD and any tag values that do not fit inside a 4 byte IFD entry
+        extra_data_size = sum(len(v) * type_sizes[t] for _, t, v in tags if len(v) * type_sizes[t] > 4)
+        image_data_offset = extra_data_offset + extra_data_size
+
+        for tag, tag_type, values in tags:
+
+            if tag == 273:
+                values = [image_data_offset]
+
+            packed_values = packValues(tag_type, values)
+            if len(packed_values) <= 4:
+                ifd_entries.append(struct.pack("<HHI", tag, tag_type, len(values)) + packed_values.ljust(4, "\0"))
+            else:
+                ifd_entries.append(struct.pack("<HHII", tag, tag_type, len(values), extra_data_offset + len(extra_data)))
+                extra_data += packed_values
+
+        with open(tif_fullpath, "wb") as tif_file:
+            tif_file.write(struct.pack("<2sHI", "II", 42, ifd_offset))
+            tif_file.write(struct.pack("<H", len(tags)) + "".join(ifd_entries) + struct.pack("<I", 0))
+            tif_file.write(extra_data)
+            tif_file.write(image_data)
+
+        return tif_fullpath
+
+
+class ASCIIGridReader(object):
+
+    """
+        Class ASCIIGridReader reads ESRI ASCII grids (ex: the WRF .asc files) into numpy arrays without arcpy.
+
+        The header lines are parsed by key (ncols, nrows, xllcorner or xllcenter, yllcorner or yllcenter, cellsize and the optional NODATA_value)
+        and the body is decoded in a single vectorized np.fromstring call instead of line by line.
+
+        public interface:
+
+            readGrid(ascii_fullpath, dtype=np.float32) <tuple>: returns (array, georeference, nodata_value) where array is a nrows x ncols array whose first row
+            is the northern most row, georeference is its (lower_left_x, lower_left_y, cellsize) like the georeference of RasterGridWriter and nodata_value is None
+            if the grid has no NODATA_value.
+    """
+
+    HEADER_KEYS = ('ncols', 'nrows', 'xllcorner', 'yllcorner', 'xllcenter', 'yllcenter', 'cellsize', 'nodata_value')
+
+    @staticmethod
+    def readGrid(ascii_fullpath, dtype=np.float32):
+
+        with open(ascii_fullpath, "rb") as ascii_file:
+            ascii_text = ascii_file.read()
+
+        header, body_offset = ASCIIGridReader._readHeader(ascii_text)
+        ncols, nrows, cellsize = int(header['ncols']), int(header['nrows']), float(header['cellsize'])
+
+        # a grid registered by its lower left cell center is converted to its lower left corner
+        lower_left_x = float(header['xllcorner']) if 'xllcorner' in header else float(header['xllcenter']) - cellsize / 2
+        lower_left_y = float(header['yllcorner']) if 'yllcorner' in header else float(header['yllcenter']) - cellsize / 2
+        nodata_value = float(header['nodata_value']) if 'nodata_value' in header else None
+
+        values = np.fromstring(ascii_text[body_offset:], dtype, sep=" ")
+        if values.size != nrows * ncols:
+            raise ValueError("%s has %s values, expected %s x %s" % (ascii_fullpath, values.size, nrows, ncols))
+
+        return (values.reshape(nrows, ncols), (lower_left_x, lower_left_y, cellsize), nodata_value)
+
+    @staticmethod
+    def _readHeader(ascii_text):
+
+        header = {}
+        body_offset = 0
+
+        while True:
+
+            line_end = ascii_text.find("\n", body_offset)
+            line_tokens = ascii_text[body_offset:line_end if line_end >= 0 else len(ascii_text)].split()
+
+            # the header ends at the first line that is not a "key value" pair
+            if len(line_tokens) != 2 or line_tokens[0].lower() not in ASCIIGridReader.HEADER_KEYS:
+                break
+
+            header[line_tokens[0].lower()] = line_tokens[1]
+            body_offset = line_end + 1 if line_end >= 0 else len(ascii_text)
+
+        missing_keys = [k for k in ('ncols', 'nrows', 'cellsize') if k not in header]
+        if missing_keys or not ('xllcorner' in header or 'xllcenter' in header) or not ('yllcorner' in header or 'yllcenter' in header):
+            raise ValueError("incomplete ESRI ASCII grid header: %s" % header)
+
+        return (header, body_offset)
+
+
+class RasterStatistics(object):
+
+    """
+        Class RasterStatistics computes the statistics and fixed-bin histogram of a raster band from its numpy array at transform time,
+        so they can be stored with the raster's catalog row and written as the raster's statistics instead of ArcGIS calculating them.
+
+        NaN cells and cells equal to the nodata_value are left out of every statistic. The histogram has histogram_bins equal width bins
+        spanning histogram_range, or [minimum, maximum] without one, cells outside of histogram_range are not counted.
+
+        public interface:
+
+            fromArray(array, nodata_value=None, histogram_bins=256, histogram_range=None) <RasterStatistics>: returns the statistics of the valid cells of the given array
+            getFieldValues() <dict>: returns the stats_min, stats_max, stats_mean, stats_std, stats_count and stats_histogram (comma separated bin counts) field values,
+            the statistics of a band without valid cells are None
+            writeStatisticsXML(xml_fullpath, band_statistics) <str>: writes the histogram and statistics of each band of band_statistics to the
+            given PAMDataset XML, the stats_file of arcpy.SetRasterProperties_management, bands without valid cells are written empty
+    """
+
+    def __init__(self, minimum, maximum, mean, std, count, histogram_counts, histogram_range):
+
+        self.minimum = minimum
+        self.maximum = maximum
+        self.mean = mean
+        self.std = std
+        self.count = count
+        self.histogram_counts = histogram_counts
+        self.histogram_range = histogram_range
+
+    @staticmethod
+    def fromArray(array, nodata_value=None, histogram_bins=256, histogram_range=None):
+
+        values = np.asarray(array).ravel()
+        if values.dtype.kind == 'f':
+            values = values[np.isfinite(values)]
+        if nodata_value is not None:
+            values = values[values != nodata_value]
+
+        if not len(values):
+            return RasterStatistics(None, None, None, None, 0, np.zeros(histogram_bins, np.int64), histogram_range)
+
+        values = values.astype(np.float64)
+        minimum, maximum = float(values.min()), float(values.max())
+        mean = float(values.mean())
+        std = float(values.std()) # population standard deviation, same as ArcGIS
+
+        if not histogram_range:
+            histogram_range = (minimum, maximum) if maximum > minimum else (minimum - 0.5, maximum + 0.5)
+
+        histogram_counts = np.histogram(values, histogram_bins, histogram_range)[0]
+
+        return RasterStatistics(minimum, maximum, mean, std, len(values), histogram_counts, (float(histogram_range[0]), float(histogram_range[1])))
+
+    def getFieldValues(self):
+
+        return {
+            'stats_min':self.minimum,
+            'stats_max':self.maximum,
+            'stats_mean':self.mean,
+            'stats_std':self.std,
+            'stats_count':int(self.count),
+            'stats_histogram':",".join(str(c) for c in self.histogram_counts)
+        }
+
+    @staticmethod
+    def writeStatisticsXML(xml_fullpath, band_statistics):
+
+        xml_lines = ["<PAMDataset>"]
+
+        for band_index, raster_statistics in enumerate(band_statistics, 1):
+
+            xml_lines.append('  <PAMRasterBand band="%s">' % band_index)
+
+            if raster_statistics.count:
+
+                histogram_min, histogram_max = raster_statistics.histogram_range
+                xml_lines += [
+                    "    <Histograms>",
+                    "      <HistItem>",
+                    "        <HistMin>%r</HistMin>" % histogram_min,
+                    "        <HistMax>%r</HistMax>" % histogram_max,
+                    "        <BucketCount>%s</BucketCount>" % len(raster_statistics.histogram_counts),
+                    "        <IncludeOutOfRange>0</IncludeOutOfRange>",
+                    "        <Approximate>0</Approximate>",
+                    "        <HistCounts>%s</HistCounts>" % "|".join(str(c) for c in raster_statistics.histogram_counts),
+                    "      </HistItem>",
+                    "    </Histograms>",
+                    "    <Metadata>",
+                    '      <MDI key="STATISTICS_MAXIMUM">%r</MDI>' % raster_statistics.maximum,
+                    '      <MDI key="STATISTICS_MEAN">%r</MDI>' % raster_statistics.mean,
+                    '      <MDI key="STATISTICS_MINIMUM">%r</MDI>' % raster_statistics.minimum,
+                    '      <MDI key="STATISTICS_STDDEV">%r</MDI>' % raster_statistics.std,
+                    "    </Metadata>"
+                ]
+
+            xml_lines.append("  </PAMRasterBand>")
+
+        xml_lines.append("</PAMDataset>")
+
+        with open(xml_fullpath, "w") as xml_file:
+            xml_file.write("\n".join(xml_lines) + "\n")
+
+        return xml_fullpath